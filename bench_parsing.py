@@ -0,0 +1,76 @@
+"""Микробенчмарк разбора инлайн-записей и сумм (parsing.py).
+
+Сравнивает parsing.check_entry с прежним разбором через регулярное выражение,
+replace и strptime на типичных запросах инлайн-режима: полная запись,
+недописанная запись и запись с ошибкой.
+
+На неполной и неверной записи новый код медленнее (2-3 мкс против
+0.2-1 мкс): прежний шаблон отказывал одним вызовом на C и ничего не сообщал,
+а check_entry проверяет поля по очереди, чтобы назвать то, которое нужно
+дописать. Это микросекунды на запрос, который и так ждет сеть и debounce
+инлайн-режима; ответ с подсказкой Telegram кэширует (INLINE_HINT_CACHE_TIME).
+
+Пример:
+    python bench_parsing.py --number 200000
+"""
+import argparse
+import re
+import timeit
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+import parsing
+
+_LEGACY_ENTRY_RE = re.compile(r"#?(продажа|закупка)/(\d{2}\.\d{2}\.\d{2})/(@\w+)/(\d{2}:\d{2})/([\d,.]+)(р)?")
+
+def legacy_parse_entry(text: str):
+    """Разбор записи до parsing.py: регулярное выражение, replace по сумме, strptime для даты"""
+    match = _LEGACY_ENTRY_RE.fullmatch(text.strip())
+    if not match:
+        return None
+    sale_type, date, user_tag, time, amount, _ = match.groups()
+    amount = amount.replace(',', '').replace('.', '').strip()
+    datetime.strptime(date, '%d.%m.%y')
+    return sale_type, date, user_tag, time, legacy_parse_amount(amount)
+
+def new_parse_entry(text: str):
+    """Как в инлайн-режиме: check_entry без исключений, на неполной записи - заготовленная подсказка"""
+    entry = parsing.check_entry(text, partial=True)
+    return None if isinstance(entry, parsing.EntryHint) else entry
+
+def legacy_parse_amount(text: str) -> int:
+    """parse_amount до parsing.py: всегда через Decimal"""
+    cleaned = str(text).replace('р', '').replace(',', '').replace(' ', '').strip()
+    value = Decimal(cleaned)
+    if not value.is_finite():
+        raise ValueError(text)
+    return int((value * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+CASES = {
+    'полная запись': "#продажа/10.04.25/@username/10:00/7000р",
+    'недописанная': "#продажа/10.04.25/@usern",
+    'с ошибкой': "#продажа/10.04.25/@username/1000/7000р",
+}
+
+def bench(func, arg, number: int) -> float:
+    """Время одного вызова в микросекундах (лучшее из трех повторов)"""
+    return min(timeit.repeat(lambda: func(arg), number=number, repeat=3)) / number * 1e6
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Микробенчмарк parsing.py")
+    parser.add_argument('--number', type=int, default=100000, help="вызовов в одном замере")
+    args = parser.parse_args(argv)
+
+    print(f"{'случай':<22} {'было, мкс':>10} {'стало, мкс':>11} {'ускорение':>10}")
+    rows = [(name, legacy_parse_entry, new_parse_entry, text) for name, text in CASES.items()]
+    rows += [
+        ('сумма 7000р', legacy_parse_amount, parsing.parse_amount, '7000р'),
+        ('сумма 7000.50', legacy_parse_amount, parsing.parse_amount, '7000.50'),
+        ('дата dd.mm.yy', lambda value: datetime.strptime(value, '%d.%m.%y').date(), parsing.parse_date, '10.04.25'),
+    ]
+    for name, old, new, text in rows:
+        before, after = bench(old, text, args.number), bench(new, text, args.number)
+        print(f"{name:<22} {before:>10.2f} {after:>11.2f} {before / after:>9.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Небольшой in-process кэш с LRU-вытеснением и временем жизни записей"""
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """LRU-кэш на maxsize записей, каждая запись живет не дольше ttl секунд.
+
+    Счетчик generation увеличивается при каждой инвалидации: значение,
+    загрузка которого началась до изменения данных, в кэш уже не попадет.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value, generation: int = None):
+        """Сохраняет значение; если передан generation и с тех пор была инвалидация - ничего не делает"""
+        if generation is not None and generation != self.generation:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys):
+        self.generation += 1
+        for key in keys:
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Удаляет все записи, ключ которых удовлетворяет predicate(key)"""
+        self.generation += 1
+        for key in [key for key in self._data if predicate(key)]:
+            del self._data[key]
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
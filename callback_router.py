@@ -0,0 +1,117 @@
+"""Маршрутизация callback-запросов по таблице вместо цепочки фильтров.
+
+Префикс callback_data разбирается один раз, обработчик ищется в словаре,
+а полезная нагрузка распаковывается в типизированный CallbackData.
+Кнопки старого формата, оставшиеся в уже отправленных сообщениях, сначала
+переводятся в текущий (см. CallbackRouter.legacy).
+"""
+import inspect
+import logging
+import re
+from collections import Counter
+from typing import Callable, Dict, Mapping, Optional, Type
+
+from aiogram import types
+from aiogram.filters.callback_data import CallbackData
+
+logger = logging.getLogger(__name__)
+
+# Префикс - всё до первого разделителя (':' или '|', см. callbacks.ConfirmAdd)
+_PREFIX_RE = re.compile(r'[^:|]*')
+
+class _Route:
+    __slots__ = ('name', 'handler', 'factory', 'params', 'accepts_any')
+
+    def __init__(self, name: str, handler, factory: Optional[Type[CallbackData]]):
+        self.name = name
+        self.handler = handler
+        self.factory = factory
+        signature = inspect.signature(handler)
+        self.params = frozenset(signature.parameters)
+        self.accepts_any = any(p.kind is p.VAR_KEYWORD for p in signature.parameters.values())
+
+class CallbackRouter:
+    def __init__(self, legacy: Optional[Mapping[str, Callable[[str], Optional[str]]]] = None):
+        self._exact = {}
+        self._prefixed = {}
+        self._legacy: Dict[str, Callable[[str], Optional[str]]] = {}
+        self._legacy_prefixes = ()
+        self.hits = Counter()
+        for prefix, convert in (legacy or {}).items():
+            self.legacy(prefix, convert)
+
+    def exact(self, *values: str):
+        """Регистрирует обработчик для callback_data, совпадающих целиком"""
+        def decorator(handler):
+            for value in values:
+                self._exact[value] = _Route(value, handler, None)
+            return handler
+        return decorator
+
+    def on(self, factory: Type[CallbackData]):
+        """Регистрирует обработчик для callback_data, собранных фабрикой factory"""
+        def decorator(handler):
+            self._prefixed[factory.__prefix__] = _Route(factory.__prefix__, handler, factory)
+            return handler
+        return decorator
+
+    def legacy(self, prefix: str, convert: Callable[[str], Optional[str]]):
+        """Регистрирует перевод callback_data старого формата, начинающихся с prefix, в текущий.
+
+        convert возвращает новую callback_data или None (либо TypeError/ValueError),
+        если старую разобрать не удалось
+        """
+        self._legacy[prefix] = convert
+        self._legacy_prefixes = tuple(self._legacy)
+
+    def upgrade(self, data: str) -> str:
+        """callback_data в текущем формате: старые переводятся, остальные возвращаются как есть"""
+        if not self._legacy_prefixes or not data.startswith(self._legacy_prefixes):
+            return data
+        for prefix, convert in self._legacy.items():
+            if data.startswith(prefix):
+                try:
+                    converted = convert(data)
+                except (TypeError, ValueError):
+                    converted = None
+                return data if converted is None else converted
+        return data
+
+    def resolve(self, data: str) -> Optional[_Route]:
+        route = self._exact.get(data)
+        if route is None:
+            route = self._prefixed.get(_PREFIX_RE.match(data).group())
+        return route
+
+    def route_name(self, data: Optional[str]) -> str:
+        route = self.resolve(self.upgrade(data or ''))
+        return route.name if route else 'unknown'
+
+    async def dispatch(self, callback_query: types.CallbackQuery, **kwargs):
+        """Единый обработчик callback-запросов, регистрируется в Dispatcher"""
+        raw = callback_query.data or ''
+        data = self.upgrade(raw)
+        if data != raw:
+            self.hits['legacy'] += 1
+        route = self.resolve(data)
+        if route is None:
+            self.hits['unknown'] += 1
+            logger.warning("Неизвестный callback: %r", data)
+            await callback_query.answer("Кнопка устарела, откройте меню заново")
+            return
+
+        if route.factory is not None:
+            try:
+                kwargs['callback_data'] = route.factory.unpack(data)
+            except (TypeError, ValueError) as e:
+                self.hits['invalid'] += 1
+                logger.warning("Не удалось разобрать callback %r: %s", data, e)
+                await callback_query.answer("Кнопка устарела, откройте меню заново")
+                return
+
+        self.hits[route.name] += 1
+        logger.debug("callback %r -> %s", data, route.name)
+
+        if not route.accepts_any:
+            kwargs = {key: value for key, value in kwargs.items() if key in route.params}
+        return await route.handler(callback_query, **kwargs)
@@ -0,0 +1,125 @@
+"""Типизированные callback_data для инлайн-кнопок бота"""
+from datetime import date
+from typing import Optional
+
+from aiogram.filters.callback_data import CallbackData
+
+class ConfirmAdd(CallbackData, prefix='confirm_add', sep='|'):
+    # Время записи содержит ':', поэтому разделитель другой
+    sale_type: str
+    date: str
+    user_tag: str
+    time: str
+    amount: str
+
+class MonthReport(CallbackData, prefix='month_report'):
+    year: int
+    month: int
+
+class CalendarNav(CallbackData, prefix='calendar_nav'):
+    year: int
+    month: int
+
+class CalendarDay(CallbackData, prefix='calendar_day'):
+    date: str  # YYYY-MM-DD
+
+class EditRecords(CallbackData, prefix='edit_records'):
+    date: str
+    record_type: str
+
+class DeleteRecords(CallbackData, prefix='delete_records'):
+    date: str
+    record_type: str
+
+class BackToRecords(CallbackData, prefix='back_to_records'):
+    date: str
+    record_type: str
+
+class SelectRecord(CallbackData, prefix='select_record'):
+    record_id: int
+
+class SelectDelete(CallbackData, prefix='select_delete'):
+    record_id: int
+
+class ConfirmDelete(CallbackData, prefix='confirm_delete'):
+    record_id: int
+
+class DeleteRecord(CallbackData, prefix='delete_record'):
+    record_id: int
+
+class EditUserTag(CallbackData, prefix='edit_user_tag'):
+    record_id: int
+
+class EditAmount(CallbackData, prefix='edit_amount'):
+    record_id: int
+
+class EditTime(CallbackData, prefix='edit_time'):
+    record_id: int
+
+class EditReport(CallbackData, prefix='edit_report'):
+    field: str  # sales, purchases, admin, card
+
+class RecordsPage(CallbackData, prefix='records_page'):
+    mode: str  # show, edit, delete
+    date: str
+    record_type: str
+    cursor: int
+    backward: bool
+
+class FindPage(CallbackData, prefix='find_page'):
+    # Сам запрос хранится в данных FSM (find_query), в callback_data он может не поместиться
+    cursor: int
+    backward: bool
+
+class SaleHistory(CallbackData, prefix='sale_history'):
+    record_id: int
+
+# Кнопки до перехода на CallbackData остаются в уже отправленных сообщениях:
+# переводим их callback_data в текущий формат (см. CallbackRouter.legacy)
+
+def _legacy_confirm_add(data: str) -> Optional[str]:
+    # 'confirm_add:продажа:10.04.25:@user:10:00:7000' - время тоже через ':'
+    parts = data.split(':')
+    if len(parts) != 7:
+        return None
+    _, sale_type, date, user_tag, hour, minute, amount = parts
+    return ConfirmAdd(sale_type=sale_type, date=date, user_tag=user_tag, time=f"{hour}:{minute}", amount=amount).pack()
+
+def _legacy_calendar_day(data: str) -> str:
+    # 'calendar_day_2025-04-10'
+    return CalendarDay(date=data[len('calendar_day_'):]).pack()
+
+def _legacy_calendar_nav(data: str) -> Optional[str]:
+    # 'calendar_prev_2025_3', 'calendar_next_2025_5'
+    parts = data.split('_')
+    if len(parts) != 4:
+        return None
+    return CalendarNav(year=int(parts[2]), month=int(parts[3])).pack()
+
+def _legacy_edit_report(data: str) -> str:
+    # 'edit_report_sales'
+    return EditReport(field=data[len('edit_report_'):]).pack()
+
+# Старая кнопка "Назад" к списку записей даты не несла и открывала сегодняшний список
+_LEGACY_BACK_RECORD_TYPES = {
+    'back_to_sales': 'продажа',
+    'back_to_purchase': 'закупка',
+    'back_to_продажа': 'продажа',
+    'back_to_закупка': 'закупка',
+}
+
+def _legacy_back_to_records(data: str) -> Optional[str]:
+    # 'back_to_sales', 'back_to_purchase'; списки записей отправляли и 'back_to_продажа'
+    record_type = _LEGACY_BACK_RECORD_TYPES.get(data)
+    if record_type is None:
+        return None
+    return BackToRecords(date=date.today().strftime('%d.%m.%y'), record_type=record_type).pack()
+
+LEGACY_CALLBACKS = {
+    'confirm_add:': _legacy_confirm_add,
+    'calendar_day_': _legacy_calendar_day,
+    'calendar_prev_': _legacy_calendar_nav,
+    'calendar_next_': _legacy_calendar_nav,
+    'edit_report_': _legacy_edit_report,
+    **{prefix: _legacy_back_to_records for prefix in _LEGACY_BACK_RECORD_TYPES},
+}
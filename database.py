@@ -1,82 +1,650 @@
+import json
+import logging
 import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import date as date_type
 from typing import List, Tuple, Optional
 
+from parsing import parse_amount, parse_date
+
 DATABASE_NAME = 'sales.db'
 
-def init_db():
-    """Инициализирует базу данных и создает таблицу, если она не существует"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
+# Формат дат, с которым работает бот; в базе даты хранятся в ISO (YYYY-MM-DD)
+DATE_FORMAT = '%d.%m.%y'
+
+# Столбцы записи в том виде, в котором их ждет бот: дата снова в формате dd.mm.yy,
+# сумма - целое число копеек
+_SALE_COLUMNS = "id, sale_type, user_tag, time, amount, strftime('%d.%m.', date) || substr(date, 3, 2), user_id"
+
+logger = logging.getLogger(__name__)
+
+# Одно соединение на запись (SQLite всё равно допускает только одного писателя)
+# и по одному соединению на чтение в каждом потоке пула из storage.py
+_writer = None
+_writer_lock = threading.Lock()
+_readers = threading.local()
+_generation = 0
+_all_connections = []
+_connections_lock = threading.Lock()
+
+def _connect() -> sqlite3.Connection:
+    """Открывает соединение с базой в режиме WAL"""
+    conn = sqlite3.connect(DATABASE_NAME, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA foreign_keys=ON')
+    with _connections_lock:
+        _all_connections.append(conn)
+    return conn
+
+def _get_reader() -> sqlite3.Connection:
+    """Возвращает соединение для чтения, закрепленное за текущим потоком"""
+    conn = getattr(_readers, 'conn', None)
+    if conn is None or getattr(_readers, 'generation', None) != _generation:
+        conn = _connect()
+        _readers.conn = conn
+        _readers.generation = _generation
+    return conn
+
+@contextmanager
+def _read():
+    """Курсор для чтения на переиспользуемом соединении потока"""
+    cursor = _get_reader().cursor()
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+
+@contextmanager
+def _write():
+    """Курсор на общем соединении записи; коммит по выходу из блока, откат при ошибке"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = _connect()
+        cursor = _writer.cursor()
+        try:
+            with _writer:
+                yield cursor
+        finally:
+            cursor.close()
+
+def close_db():
+    """Закрывает все открытые соединения (вызывается при остановке бота)"""
+    global _writer, _generation
+    with _writer_lock, _connections_lock:
+        for conn in _all_connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _all_connections.clear()
+        _writer = None
+        _generation += 1
+
+def data_version() -> Optional[int]:
+    """PRAGMA data_version соединения записи или None, если оно сейчас занято.
+
+    Значение меняется, только когда базу изменило другое соединение: в этом процессе
+    все записи идут через _write(), так что это запись другого процесса (второго
+    воркера бота, manage.py). Блокировку не ждем - вызывается из цикла событий
+    """
+    global _writer
+    if not _writer_lock.acquire(blocking=False):
+        return None
+    try:
+        if _writer is None:
+            _writer = _connect()
+        return _writer.execute('PRAGMA data_version').fetchone()[0]
+    finally:
+        _writer_lock.release()
+
+def to_iso_date(date: str) -> str:
+    """Переводит дату из формата бота (dd.mm.yy) в формат хранения (YYYY-MM-DD)"""
+    return parse_date(date).isoformat()
+
+# Поля записи в журнале изменений, по порядку столбцов _SALE_COLUMNS после id
+_AUDIT_FIELDS = ('sale_type', 'user_tag', 'time', 'amount', 'date', 'user_id')
+
+def _audit(cursor, action: str, sale_id: int, actor_id: Optional[int], old: Tuple = None, new: Tuple = None):
+    """Пишет строку журнала в транзакции, которая меняет запись; old/new - строки _SALE_COLUMNS"""
+    def dump(row):
+        return None if row is None else json.dumps(dict(zip(_AUDIT_FIELDS, row[1:])), ensure_ascii=False)
+    cursor.execute(
+        'INSERT INTO sales_audit (sale_id, action, actor_id, old, new) VALUES (?, ?, ?, ?, ?)',
+        (sale_id, action, actor_id, dump(old), dump(new))
+    )
+
+def _create_sales_quarantine(cursor):
+    """Записи, которые миграции не смогли перенести как есть: неразобранные суммы
+    и даты (raw_amount - исходный текст суммы), дубликаты; sale_id - прежний id записи.
+
+    Вернуть запись в sales можно командой manage.py quarantine --restore. Таблицу
+    создает v1, а базам, прошедшим v1 раньше, - v10, поэтому IF NOT EXISTS
+    """
     cursor.execute('''
-    CREATE TABLE IF NOT EXISTS sales (
+    CREATE TABLE IF NOT EXISTS sales_quarantine (
+        id INTEGER PRIMARY KEY,
+        sale_id INTEGER NOT NULL,
+        sale_type TEXT NOT NULL,
+        user_tag TEXT NOT NULL,
+        time TEXT NOT NULL,
+        amount INTEGER,
+        raw_amount TEXT,
+        date TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        quarantined_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+def _migrate_v1(cursor):
+    """Даты в ISO, суммы в копейках и составной индекс (sale_type, date, time)"""
+    cursor.execute('''
+    CREATE TABLE sales_v1 (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         sale_type TEXT NOT NULL,
         user_tag TEXT NOT NULL,
         time TEXT NOT NULL,
-        amount TEXT NOT NULL,
+        amount INTEGER NOT NULL,
         date TEXT NOT NULL,
         user_id INTEGER NOT NULL
     )
     ''')
-    
-    conn.commit()
-    conn.close()
+    _create_sales_quarantine(cursor)
 
-def add_sale(sale_type: str, date: str, user_tag: str, time: str, amount: str, user_id: int):
-    """Добавляет новую запись о продаже/закупке в базу данных"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
+    rows = []
+    quarantined = []
+    for sale_id, sale_type, user_tag, time, raw_amount, raw_date, user_id in cursor.execute(
+        'SELECT id, sale_type, user_tag, time, amount, date, user_id FROM sales'
+    ):
+        problems = []
+        try:
+            date = to_iso_date(raw_date)
+        except (TypeError, ValueError):
+            date = raw_date
+            problems.append(f"дата {raw_date!r} не разобрана")
+        try:
+            amount = parse_amount(raw_amount)
+        except ValueError:
+            amount = None
+            problems.append(f"сумма {raw_amount!r} не разобрана")
+        if problems:
+            quarantined.append((sale_id, sale_type, user_tag, time, amount, str(raw_amount), date, user_id, '; '.join(problems)))
+        else:
+            rows.append((sale_id, sale_type, user_tag, time, amount, date, user_id))
+
+    cursor.executemany('''
+    INSERT INTO sales_v1 (id, sale_type, user_tag, time, amount, date, user_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    cursor.executemany('''
+    INSERT INTO sales_quarantine (sale_id, sale_type, user_tag, time, amount, raw_amount, date, user_id, reason)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', quarantined)
+    if quarantined:
+        logger.warning("Записей с неразобранной датой или суммой отложено в sales_quarantine: %s", len(quarantined))
+    cursor.execute('DROP TABLE sales')
+    cursor.execute('ALTER TABLE sales_v1 RENAME TO sales')
+    cursor.execute('CREATE INDEX idx_sales_type_date_time ON sales (sale_type, date, time)')
+
+def _migrate_v2(cursor):
+    """Таблица дневных итогов daily_totals, поддерживаемая триггерами на sales"""
     cursor.execute('''
-    INSERT INTO sales (sale_type, user_tag, time, amount, date, user_id)
-    VALUES (?, ?, ?, ?, ?, ?)
-    ''', (sale_type, user_tag, time, amount, date, user_id))
-    
-    conn.commit()
-    conn.close()
+    CREATE TABLE daily_totals (
+        date TEXT NOT NULL,
+        sale_type TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (date, sale_type)
+    ) WITHOUT ROWID
+    ''')
 
-def get_sales_by_date(date: str, sale_type: str) -> List[Tuple]:
-    """Возвращает все записи о продажах/закупках за указанную дату"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
+    # Триггеры выполняются в той же транзакции, что и изменение записи,
+    # поэтому итоги не могут разойтись с таблицей sales
+    cursor.execute('''
+    CREATE TRIGGER sales_totals_insert AFTER INSERT ON sales
+    BEGIN
+        INSERT INTO daily_totals (date, sale_type, total, count)
+        VALUES (NEW.date, NEW.sale_type, NEW.amount, 1)
+        ON CONFLICT (date, sale_type) DO UPDATE
+        SET total = total + excluded.total, count = count + 1;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER sales_totals_delete AFTER DELETE ON sales
+    BEGIN
+        UPDATE daily_totals
+        SET total = total - OLD.amount, count = count - 1
+        WHERE date = OLD.date AND sale_type = OLD.sale_type;
+        DELETE FROM daily_totals
+        WHERE date = OLD.date AND sale_type = OLD.sale_type AND count <= 0;
+    END
+    ''')
     cursor.execute('''
-    SELECT id, sale_type, user_tag, time, amount, date, user_id
+    CREATE TRIGGER sales_totals_update AFTER UPDATE OF amount, date, sale_type ON sales
+    BEGIN
+        UPDATE daily_totals
+        SET total = total - OLD.amount, count = count - 1
+        WHERE date = OLD.date AND sale_type = OLD.sale_type;
+        DELETE FROM daily_totals
+        WHERE date = OLD.date AND sale_type = OLD.sale_type AND count <= 0;
+        INSERT INTO daily_totals (date, sale_type, total, count)
+        VALUES (NEW.date, NEW.sale_type, NEW.amount, 1)
+        ON CONFLICT (date, sale_type) DO UPDATE
+        SET total = total + excluded.total, count = count + 1;
+    END
+    ''')
+
+    _rebuild_daily_totals(cursor)
+
+def _rebuild_daily_totals(cursor):
+    cursor.execute('DELETE FROM daily_totals')
+    cursor.execute('''
+    INSERT INTO daily_totals (date, sale_type, total, count)
+    SELECT date, sale_type, SUM(amount), COUNT(*)
     FROM sales
-    WHERE date = ? AND sale_type = ?
-    ORDER BY time
-    ''', (date, sale_type))
-    
-    sales = cursor.fetchall()
-    conn.close()
-    return sales
-
-def delete_sale(sale_id: int):
-    """Удаляет запись о продаже/закупке по ID"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
+    GROUP BY date, sale_type
+    ''')
+
+def _migrate_v3(cursor):
+    """Уникальный ключ записи (sale_type, date, user_tag, time, amount)"""
+    # Из уже накопившихся дублей в sales остается самая ранняя запись, остальные
+    # переносятся в sales_quarantine; триггеры daily_totals при этом сами поправят итоги
     cursor.execute('''
-    DELETE FROM sales
-    WHERE id = ?
-    ''', (sale_id,))
-    
-    conn.commit()
-    conn.close()
+    CREATE TEMP TABLE sales_duplicates AS
+    SELECT sales.id AS sale_id, originals.id AS original_id
+    FROM sales
+    JOIN (
+        SELECT MIN(id) AS id, sale_type, date, user_tag, time, amount
+        FROM sales
+        GROUP BY sale_type, date, user_tag, time, amount
+    ) AS originals USING (sale_type, date, user_tag, time, amount)
+    WHERE sales.id != originals.id
+    ''')
+    cursor.execute('''
+    INSERT INTO sales_quarantine (sale_id, sale_type, user_tag, time, amount, date, user_id, reason)
+    SELECT sales.id, sale_type, user_tag, time, amount, date, user_id, 'дубликат записи ' || original_id
+    FROM sales_duplicates
+    JOIN sales ON sales.id = sales_duplicates.sale_id
+    ''')
+    cursor.execute('DELETE FROM sales WHERE id IN (SELECT sale_id FROM sales_duplicates)')
+    moved = cursor.rowcount
+    cursor.execute('DROP TABLE sales_duplicates')
+    if moved:
+        logger.warning("Дублирующихся записей отложено в sales_quarantine: %s", moved)
+    cursor.execute('''
+    CREATE UNIQUE INDEX ux_sales_entry
+    ON sales (sale_type, date, user_tag, time, amount)
+    ''')
+
+def _migrate_v4(cursor):
+    """Кэш file_id загруженных в Telegram файлов"""
+    cursor.execute('''
+    CREATE TABLE media_cache (
+        path TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        PRIMARY KEY (path, kind)
+    )
+    ''')
+
+def _migrate_v5(cursor):
+    """Снимки готовых отчетов за закрытые дни и месяцы"""
+    # period - 'YYYY-MM-DD' для отчета за день или 'YYYY-MM' для отчета за месяц
+    cursor.execute('''
+    CREATE TABLE report_snapshots (
+        period TEXT PRIMARY KEY,
+        text TEXT NOT NULL,
+        data TEXT NOT NULL,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID
+    ''')
+
+    # Любое изменение записи задним числом сбрасывает снимки ее дня и месяца
+    cursor.execute('''
+    CREATE TRIGGER sales_snapshots_insert AFTER INSERT ON sales
+    BEGIN
+        DELETE FROM report_snapshots WHERE period IN (NEW.date, substr(NEW.date, 1, 7));
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER sales_snapshots_delete AFTER DELETE ON sales
+    BEGIN
+        DELETE FROM report_snapshots WHERE period IN (OLD.date, substr(OLD.date, 1, 7));
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER sales_snapshots_update AFTER UPDATE OF amount, date, sale_type ON sales
+    BEGIN
+        DELETE FROM report_snapshots
+        WHERE period IN (OLD.date, substr(OLD.date, 1, 7), NEW.date, substr(NEW.date, 1, 7));
+    END
+    ''')
+
+def _migrate_v6(cursor):
+    """Ручные правки отчета по дням и ставки (процент админа, карта) по периодам"""
+    # NULL в поле правки - значение считается по записям и ставкам
+    cursor.execute('''
+    CREATE TABLE report_overrides (
+        date TEXT PRIMARY KEY,
+        sales INTEGER,
+        purchases INTEGER,
+        admin INTEGER,
+        card INTEGER
+    ) WITHOUT ROWID
+    ''')
+    # Ставки действуют с start_date до начала следующего периода; card_fee в копейках за день
+    cursor.execute('''
+    CREATE TABLE report_settings (
+        start_date TEXT PRIMARY KEY,
+        admin_rate REAL NOT NULL,
+        card_fee INTEGER NOT NULL
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute("INSERT INTO report_settings (start_date, admin_rate, card_fee) VALUES ('0000-01-01', 0.15, 10000)")
+
+    for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+        cursor.execute(f'''
+        CREATE TRIGGER report_overrides_snapshots_{event.lower()} AFTER {event} ON report_overrides
+        BEGIN
+            DELETE FROM report_snapshots WHERE period IN ({row}.date, substr({row}.date, 1, 7));
+        END
+        ''')
+        # Изменение ставок сбрасывает снимки всех периодов, начиная с месяца, где они вступают в силу
+        cursor.execute(f'''
+        CREATE TRIGGER report_settings_snapshots_{event.lower()} AFTER {event} ON report_settings
+        BEGIN
+            DELETE FROM report_snapshots WHERE period >= substr({row}.start_date, 1, 7);
+        END
+        ''')
+
+def _migrate_v7(cursor):
+    """Индекс (user_tag, date) для аналитики и выборок по покупателю"""
+    cursor.execute('CREATE INDEX idx_sales_user_tag_date ON sales (user_tag, date)')
+
+def _migrate_v8(cursor):
+    """Индексы для поиска записей: префикс user_tag без учета регистра, период, сумма"""
+    cursor.execute('DROP INDEX idx_sales_user_tag_date')
+    cursor.execute('CREATE INDEX idx_sales_user_tag_date ON sales (user_tag COLLATE NOCASE, date)')
+    cursor.execute('CREATE INDEX idx_sales_date_time ON sales (date, time)')
+    cursor.execute('CREATE INDEX idx_sales_amount ON sales (amount)')
+
+def _migrate_v9(cursor):
+    """Журнал изменений записей sales_audit (только добавление строк)"""
+    # old/new - значения записи до и после изменения в JSON, changed_at - UTC
+    cursor.execute('''
+    CREATE TABLE sales_audit (
+        id INTEGER PRIMARY KEY,
+        sale_id INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        actor_id INTEGER,
+        changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        old TEXT,
+        new TEXT
+    )
+    ''')
+    cursor.execute('CREATE INDEX idx_sales_audit_sale ON sales_audit (sale_id, id)')
+    cursor.execute('CREATE INDEX idx_sales_audit_changed_at ON sales_audit (changed_at)')
+    cursor.execute('''
+    CREATE TRIGGER sales_audit_no_update BEFORE UPDATE ON sales_audit
+    BEGIN
+        SELECT RAISE(ABORT, 'sales_audit доступен только для добавления');
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER sales_audit_no_delete BEFORE DELETE ON sales_audit
+    BEGIN
+        SELECT RAISE(ABORT, 'sales_audit доступен только для добавления');
+    END
+    ''')
+
+def _migrate_v10(cursor):
+    """Таблица sales_quarantine для баз, прошедших v1 и v3 до того, как те стали откладывать записи"""
+    _create_sales_quarantine(cursor)
+
+def _migrate_v11(cursor):
+    """Отправки отчетов по расписанию: какой отчет в какой чат уже ушел или отправляется сейчас"""
+    # Отправку занимает тот воркер, который первым вставил строку (period, chat_id);
+    # claimed_at - unix-время, delivered_at - NULL, пока отчет не отправлен
+    cursor.execute('DROP TABLE IF EXISTS report_pushes')
+    cursor.execute('''
+    CREATE TABLE report_deliveries (
+        period TEXT NOT NULL,
+        chat_id INTEGER NOT NULL,
+        claimed_at INTEGER NOT NULL,
+        delivered_at TEXT,
+        PRIMARY KEY (period, chat_id)
+    ) WITHOUT ROWID
+    ''')
+
+def _migrate_v12(cursor):
+    """Покрывающий индекс для итогов по операторам за период (get_operator_totals)"""
+    # Топ покупателей (get_top_user_tags) уже покрыт ux_sales_entry: sale_type и период -
+    # начало ключа, user_tag и amount в нем тоже есть. IF NOT EXISTS - индекс мог создать
+    # измененный ранее вариант v7
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sales_date_user ON sales (date, user_id, sale_type, amount)')
+
+# Миграции схемы по порядку; номер версии хранится в PRAGMA user_version
+_MIGRATIONS = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+    _migrate_v6,
+    _migrate_v7,
+    _migrate_v8,
+    _migrate_v9,
+    _migrate_v10,
+    _migrate_v11,
+    _migrate_v12,
+]
+
+def init_db():
+    """Инициализирует базу данных и приводит схему к последней версии"""
+    with _write() as cursor:
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sales (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sale_type TEXT NOT NULL,
+            user_tag TEXT NOT NULL,
+            time TEXT NOT NULL,
+            amount TEXT NOT NULL,
+            date TEXT NOT NULL,
+            user_id INTEGER NOT NULL
+        )
+        ''')
+
+    # Версия читается внутри той же транзакции BEGIN IMMEDIATE, в которой применяется
+    # миграция: если одновременно стартуют несколько процессов, каждую миграцию
+    # применит только первый, а остальные увидят уже новую версию
+    while True:
+        with _write() as cursor:
+            cursor.execute('BEGIN IMMEDIATE')
+            version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(_MIGRATIONS):
+                return
+            _MIGRATIONS[version](cursor)
+            cursor.execute(f'PRAGMA user_version = {version + 1}')
+        logger.info("База данных обновлена до версии %s", version + 1)
+
+def _insert_sale(cursor, sale_type: str, date: str, user_tag: str, time: str, amount: int, user_id: int) -> Tuple[int, bool]:
+    key = (sale_type, to_iso_date(date), user_tag, time, int(amount))
+    cursor.execute('''
+    INSERT INTO sales (sale_type, date, user_tag, time, amount, user_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (sale_type, date, user_tag, time, amount) DO NOTHING
+    RETURNING id
+    ''', key + (user_id,))
+    row = cursor.fetchone()
+    if row:
+        sale_id = row[0]
+        _audit(cursor, 'add', sale_id, user_id, new=(sale_id, sale_type, user_tag, time, int(amount), date, user_id))
+        return sale_id, True
+    cursor.execute('''
+    SELECT id FROM sales
+    WHERE sale_type = ? AND date = ? AND user_tag = ? AND time = ? AND amount = ?
+    ''', key)
+    return cursor.fetchone()[0], False
+
+def add_sale(sale_type: str, date: str, user_tag: str, time: str, amount: int, user_id: int) -> Tuple[int, bool]:
+    """Добавляет запись о продаже/закупке (сумма в копейках), если такой еще нет.
+
+    Возвращает (id записи, True), если запись создана, или (id существующей записи, False)
+    """
+    with _write() as cursor:
+        return _insert_sale(cursor, sale_type, date, user_tag, time, amount, user_id)
+
+def add_sales_batch(entries) -> list:
+    """Добавляет несколько записей (аргументы add_sale) одной транзакцией - один коммит на всю пачку.
+
+    Для каждой записи возвращает то же, что add_sale, или исключение, если именно ее
+    добавить не удалось: каждая запись идет в своей точке сохранения и не откатывает остальные
+    """
+    results = []
+    with _write() as cursor:
+        cursor.execute('BEGIN IMMEDIATE')
+        for entry in entries:
+            cursor.execute('SAVEPOINT add_sale')
+            try:
+                results.append(_insert_sale(cursor, *entry))
+            except Exception as e:
+                # Любая ошибка записи (в том числе OverflowError на слишком большой сумме)
+                # откатывает только ее точку сохранения, а не всю пачку
+                cursor.execute('ROLLBACK TO add_sale')
+                results.append(e)
+            cursor.execute('RELEASE add_sale')
+    return results
+
+def add_sales_bulk(rows, actor_id: int = None) -> int:
+    """Добавляет пачку записей одной транзакцией, пропуская уже существующие.
+
+    rows - последовательность (sale_type, date в ISO, user_tag, time, amount в копейках, user_id).
+    Возвращает количество добавленных записей
+    """
+    with _write() as cursor:
+        cursor.execute('BEGIN IMMEDIATE')
+        last_id = cursor.execute('SELECT COALESCE(MAX(id), 0) FROM sales').fetchone()[0]
+        cursor.executemany('''
+        INSERT INTO sales (sale_type, date, user_tag, time, amount, user_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (sale_type, date, user_tag, time, amount) DO NOTHING
+        ''', rows)
+        inserted = cursor.rowcount
+        # Транзакция взята сразу на запись и id растут (AUTOINCREMENT), поэтому новые записи - это id > last_id
+        cursor.execute('''
+        INSERT INTO sales_audit (sale_id, action, actor_id, new)
+        SELECT id, 'import', ?, json_object(
+            'sale_type', sale_type, 'user_tag', user_tag, 'time', time, 'amount', amount,
+            'date', strftime('%d.%m.', date) || substr(date, 3, 2), 'user_id', user_id
+        )
+        FROM sales
+        WHERE id > ?
+        ''', (actor_id, last_id))
+        return inserted
+
+def sale_exists(sale_type: str, date: str, user_tag: str, time: str, amount: int) -> Optional[int]:
+    """Ищет запись по уникальному ключу и возвращает ее ID или None"""
+    with _read() as cursor:
+        cursor.execute('''
+        SELECT id FROM sales
+        WHERE sale_type = ? AND date = ? AND user_tag = ? AND time = ? AND amount = ?
+        ''', (sale_type, to_iso_date(date), user_tag, time, int(amount)))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+def get_sales_by_date(date: str, sale_type: str) -> List[Tuple]:
+    """Возвращает все записи о продажах/закупках за указанную дату"""
+    with _read() as cursor:
+        cursor.execute(f'''
+        SELECT {_SALE_COLUMNS}
+        FROM sales
+        WHERE sale_type = ? AND date = ?
+        ORDER BY time
+        ''', (sale_type, to_iso_date(date)))
+        return cursor.fetchall()
+
+def get_sales_page(
+    date: str,
+    sale_type: str,
+    cursor_id: int = None,
+    backward: bool = False,
+    limit: int = 10
+) -> Tuple[List[Tuple], bool]:
+    """Возвращает страницу записей за дату в порядке (time, id) и признак, что в этом направлении есть еще записи.
+
+    cursor_id - ID записи, после которой (или перед которой, если backward) начинается страница;
+    если такой записи уже нет, возвращается первая страница
+    """
+    iso_date = to_iso_date(date)
+    with _read() as cursor:
+        anchor = None
+        if cursor_id is not None:
+            cursor.execute('SELECT time FROM sales WHERE id = ?', (cursor_id,))
+            anchor = cursor.fetchone()
+
+        if anchor is None:
+            cursor.execute(f'''
+            SELECT {_SALE_COLUMNS}
+            FROM sales
+            WHERE sale_type = ? AND date = ?
+            ORDER BY time, id
+            LIMIT ?
+            ''', (sale_type, iso_date, limit + 1))
+        elif backward:
+            cursor.execute(f'''
+            SELECT {_SALE_COLUMNS}
+            FROM sales
+            WHERE sale_type = ? AND date = ? AND (time, id) < (?, ?)
+            ORDER BY time DESC, id DESC
+            LIMIT ?
+            ''', (sale_type, iso_date, anchor[0], cursor_id, limit + 1))
+        else:
+            cursor.execute(f'''
+            SELECT {_SALE_COLUMNS}
+            FROM sales
+            WHERE sale_type = ? AND date = ? AND (time, id) > (?, ?)
+            ORDER BY time, id
+            LIMIT ?
+            ''', (sale_type, iso_date, anchor[0], cursor_id, limit + 1))
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if anchor is not None and backward:
+        rows.reverse()
+    return rows, has_more
+
+def delete_sale(sale_id: int, actor_id: int = None) -> Optional[Tuple]:
+    """Удаляет запись о продаже/закупке по ID и возвращает удаленную запись"""
+    with _write() as cursor:
+        cursor.execute(f'''
+        DELETE FROM sales
+        WHERE id = ?
+        RETURNING {_SALE_COLUMNS}
+        ''', (sale_id,))
+        deleted = cursor.fetchone()
+        if deleted:
+            _audit(cursor, 'delete', sale_id, actor_id, old=deleted)
+        return deleted
 
 def update_sale(
     sale_id: int,
     sale_type: str = None,
     user_tag: str = None,
     time: str = None,
-    amount: str = None,
-    date: str = None
-):
-    """Обновляет запись о продаже/закупке"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
+    amount: int = None,
+    date: str = None,
+    actor_id: int = None
+) -> Optional[Tuple[Tuple, Tuple]]:
+    """Обновляет запись о продаже/закупке и возвращает (старая запись, новая запись).
+
+    Возвращает None, если записи нет или менять нечего. Если после изменения
+    запись совпадет с уже существующей, будет выброшен sqlite3.IntegrityError
+    """
     updates = []
     params = []
     
@@ -91,47 +659,412 @@ def update_sale(
         params.append(time)
     if amount is not None:
         updates.append("amount = ?")
-        params.append(amount)
+        params.append(int(amount))
     if date is not None:
         updates.append("date = ?")
-        params.append(date)
+        params.append(to_iso_date(date))
     
-    if updates:
-        query = "UPDATE sales SET " + ", ".join(updates) + " WHERE id = ?"
-        params.append(sale_id)
-        
-        cursor.execute(query, tuple(params))
-        conn.commit()
+    if not updates:
+        return None
+
+    query = f"UPDATE sales SET {', '.join(updates)} WHERE id = ? RETURNING {_SALE_COLUMNS}"
+    params.append(sale_id)
     
-    conn.close()
+    with _write() as cursor:
+        cursor.execute(f"SELECT {_SALE_COLUMNS} FROM sales WHERE id = ?", (sale_id,))
+        old = cursor.fetchone()
+        if old is None:
+            return None
+        cursor.execute(query, tuple(params))
+        new = cursor.fetchone()
+        _audit(cursor, 'update', sale_id, actor_id, old=old, new=new)
+        return old, new
+
+# Если префикс user_tag совпадает хотя бы с таким числом записей (например, '@a'),
+# выгоднее идти по индексу (date, time) от новых записей, чем сортировать все совпадения
+SEARCH_BROAD_PREFIX_ROWS = 2000
+
+def _prefix_upper_bound(prefix: str) -> str:
+    """Наименьшая строка больше всех строк с этим префиксом (для сравнения с NOCASE)"""
+    prefix = ''.join(c.lower() if c.isascii() else c for c in prefix)
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def search_sales(
+    user_tag: str = None,
+    sale_type: str = None,
+    min_amount: int = None,
+    max_amount: int = None,
+    start_date: str = None,
+    end_date: str = None,
+    cursor_id: int = None,
+    backward: bool = False,
+    limit: int = 10
+) -> Tuple[List[Tuple], bool]:
+    """Ищет записи по префиксу user_tag (без учета регистра), типу, диапазону суммы (копейки)
+    и периоду (dd.mm.yy). Результаты от новых к старым, постранично как в get_sales_page
+    """
+    conditions = []
+    params = []
+    if sale_type:
+        conditions.append('sale_type = ?')
+        params.append(sale_type)
+    if min_amount is not None:
+        conditions.append('amount >= ?')
+        params.append(int(min_amount))
+    if max_amount is not None:
+        conditions.append('amount <= ?')
+        params.append(int(max_amount))
+    if start_date:
+        conditions.append('date >= ?')
+        params.append(to_iso_date(start_date))
+    if end_date:
+        conditions.append('date <= ?')
+        params.append(to_iso_date(end_date))
+
+    with _read() as cursor:
+        if user_tag:
+            bounds = (user_tag, _prefix_upper_bound(user_tag))
+            cursor.execute('''
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM sales
+                WHERE user_tag COLLATE NOCASE >= ? AND user_tag COLLATE NOCASE < ?
+                LIMIT ?
+            )
+            ''', (*bounds, SEARCH_BROAD_PREFIX_ROWS))
+            # Унарный плюс не дает планировщику взять индекс по user_tag
+            column = '+user_tag' if cursor.fetchone()[0] >= SEARCH_BROAD_PREFIX_ROWS else 'user_tag'
+            conditions.append(f'{column} COLLATE NOCASE >= ? AND {column} COLLATE NOCASE < ?')
+            params += bounds
+
+        anchor = None
+        if cursor_id is not None:
+            cursor.execute('SELECT date, time FROM sales WHERE id = ?', (cursor_id,))
+            anchor = cursor.fetchone()
+
+        order = 'date DESC, time DESC, id DESC'
+        if anchor is not None:
+            if backward:
+                conditions.append('(date, time, id) > (?, ?, ?)')
+                order = 'date, time, id'
+            else:
+                conditions.append('(date, time, id) < (?, ?, ?)')
+            params += [anchor[0], anchor[1], cursor_id]
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        cursor.execute(f'''
+        SELECT {_SALE_COLUMNS}
+        FROM sales
+        {where}
+        ORDER BY {order}
+        LIMIT ?
+        ''', (*params, limit + 1))
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if anchor is not None and backward:
+        rows.reverse()
+    return rows, has_more
+
+def get_sale_history(sale_id: int) -> List[Tuple]:
+    """Журнал изменений записи от старых к новым: (action, actor_id, changed_at UTC, old, new)"""
+    with _read() as cursor:
+        cursor.execute('''
+        SELECT action, actor_id, changed_at, old, new
+        FROM sales_audit
+        WHERE sale_id = ?
+        ORDER BY id
+        ''', (sale_id,))
+        return [
+            (action, actor_id, changed_at, json.loads(old) if old else None, json.loads(new) if new else None)
+            for action, actor_id, changed_at, old, new in cursor.fetchall()
+        ]
 
 def get_sale_by_id(sale_id: int) -> Optional[Tuple]:
     """Возвращает запись о продаже/закупке по ID или None, если не найдена"""
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT id, sale_type, user_tag, time, amount, date, user_id
-    FROM sales
-    WHERE id = ?
-    ''', (sale_id,))
-    
-    sale = cursor.fetchone()
-    conn.close()
-    return sale
+    with _read() as cursor:
+        cursor.execute(f'''
+        SELECT {_SALE_COLUMNS}
+        FROM sales
+        WHERE id = ?
+        ''', (sale_id,))
+        return cursor.fetchone()
+
+def get_quarantined_sales() -> List[Tuple]:
+    """Записи, отложенные миграциями в sales_quarantine.
+
+    Строки: (id, sale_id, sale_type, user_tag, time, amount в копейках или None,
+    raw_amount, date, user_id, reason, quarantined_at)
+    """
+    with _read() as cursor:
+        cursor.execute('''
+        SELECT id, sale_id, sale_type, user_tag, time, amount, raw_amount, date, user_id, reason, quarantined_at
+        FROM sales_quarantine
+        ORDER BY id
+        ''')
+        return cursor.fetchall()
+
+def restore_quarantined_sale(quarantine_id: int, amount: int = None, date: str = None) -> Optional[Tuple[int, bool]]:
+    """Возвращает отложенную запись в sales и убирает ее из sales_quarantine.
+
+    amount (в копейках) и date (dd.mm.yy) заменяют неразобранные значения. Возвращает то же,
+    что add_sale, None, если такой отложенной записи нет, или ValueError, если сумму или
+    дату по-прежнему не разобрать
+    """
+    with _write() as cursor:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+        SELECT sale_type, user_tag, time, amount, raw_amount, date, user_id
+        FROM sales_quarantine
+        WHERE id = ?
+        ''', (quarantine_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        sale_type, user_tag, time, stored_amount, raw_amount, stored_date, user_id = row
+        if amount is None:
+            amount = stored_amount if stored_amount is not None else parse_amount(raw_amount)
+        if date is None:
+            try:
+                date = date_type.fromisoformat(stored_date).strftime(DATE_FORMAT)
+            except ValueError:
+                raise ValueError(f"Дата {stored_date!r} не разобрана")
+        result = _insert_sale(cursor, sale_type, date, user_tag, time, amount, user_id)
+        cursor.execute('DELETE FROM sales_quarantine WHERE id = ?', (quarantine_id,))
+        return result
 
 def sum_sales_for_period(start_date, end_date, sale_type):
-    """Суммирует продажи/закупки за указанный период"""
-    # Пример реализации - замените на реальный запрос к вашей БД
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT SUM(amount) 
-        FROM sales 
+    """Суммирует продажи/закупки за указанный период (даты в формате dd.mm.yy), результат в рублях"""
+    with _read() as cursor:
+        cursor.execute("""
+            SELECT SUM(total) 
+            FROM daily_totals 
+            WHERE date BETWEEN ? AND ? AND sale_type = ?
+        """, (to_iso_date(start_date), to_iso_date(end_date), sale_type))
+        result = cursor.fetchone()[0] or 0
+    return result / 100
+
+def get_day_totals(date: str) -> dict:
+    """Возвращает итоги дня по типам: {sale_type: (сумма в копейках, количество записей)}"""
+    with _read() as cursor:
+        cursor.execute('''
+        SELECT sale_type, total, count
+        FROM daily_totals
+        WHERE date = ?
+        ''', (to_iso_date(date),))
+        return {sale_type: (total, count) for sale_type, total, count in cursor.fetchall()}
+
+def iter_sales(start_date: str, end_date: str, sale_type: str, batch_size: int = 1000):
+    """Потоково отдает записи за период (даты в формате dd.mm.yy) пачками по batch_size.
+
+    Строки: (id, sale_type, date в ISO, time, user_tag, amount в копейках, user_id).
+    Генератор нужно дочитать в том же потоке, в котором он создан
+    """
+    with _read() as cursor:
+        cursor.execute('''
+        SELECT id, sale_type, date, time, user_tag, amount, user_id
+        FROM sales
         WHERE sale_type = ? AND date BETWEEN ? AND ?
-    """, (sale_type, start_date, end_date))
-    
-    result = cursor.fetchone()[0] or 0
-    conn.close()
-    return float(result) if result else 0
\ No newline at end of file
+        ORDER BY date, time
+        ''', (sale_type, to_iso_date(start_date), to_iso_date(end_date)))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+def _period_breakdown(cursor, start_date: str, end_date: str) -> List[Tuple]:
+    iso_start, iso_end = to_iso_date(start_date), to_iso_date(end_date)
+    cursor.execute('''
+    WITH RECURSIVE days (date) AS (
+        SELECT ? WHERE ? <= ?
+        UNION ALL
+        SELECT date(date, '+1 day') FROM days WHERE date < ?
+    ),
+    totals AS (
+        SELECT date,
+               SUM(CASE WHEN sale_type = 'продажа' THEN total ELSE 0 END) AS sales,
+               SUM(CASE WHEN sale_type = 'закупка' THEN total ELSE 0 END) AS purchases
+        FROM daily_totals
+        WHERE date BETWEEN ? AND ?
+        GROUP BY date
+    )
+    SELECT strftime('%d.%m.', d.date) || substr(d.date, 3, 2),
+           COALESCE(o.sales, t.sales, 0),
+           COALESCE(o.purchases, t.purchases, 0),
+           o.admin,
+           COALESCE(o.card, s.card_fee),
+           s.admin_rate,
+           o.date IS NOT NULL
+    FROM days d
+    LEFT JOIN totals t ON t.date = d.date
+    LEFT JOIN report_overrides o ON o.date = d.date
+    LEFT JOIN report_settings s
+        ON s.start_date = (SELECT MAX(start_date) FROM report_settings WHERE start_date <= d.date)
+    ORDER BY d.date
+    ''', (iso_start, iso_start, iso_end, iso_end, iso_start, iso_end))
+    return cursor.fetchall()
+
+def get_period_breakdown(start_date: str, end_date: str) -> List[Tuple]:
+    """Возвращает строку по каждому дню периода одним запросом: итоги записей вместе с правками и ставками.
+
+    Строки: (date, продажи, закупки, процент админа или None, карта, ставка админа, есть правки),
+    суммы в копейках; процент админа None, если его нужно считать по ставке
+    """
+    with _read() as cursor:
+        return _period_breakdown(cursor, start_date, end_date)
+
+# Поля отчета, которые можно поправить вручную
+REPORT_OVERRIDE_FIELDS = ('sales', 'purchases', 'admin', 'card')
+
+def set_report_override(date: str, **fields):
+    """Сохраняет ручные правки отчета за день (суммы в копейках), остальные поля не трогает"""
+    unknown = set(fields) - set(REPORT_OVERRIDE_FIELDS)
+    if unknown or not fields:
+        raise ValueError(f"Неизвестные поля отчета: {sorted(unknown)}")
+    columns = list(fields)
+    with _write() as cursor:
+        cursor.execute(f'''
+        INSERT INTO report_overrides (date, {', '.join(columns)})
+        VALUES (?, {', '.join('?' for _ in columns)})
+        ON CONFLICT (date) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns)}
+        ''', (to_iso_date(date), *(int(fields[c]) for c in columns)))
+
+def clear_report_overrides(date: str) -> bool:
+    """Удаляет ручные правки отчета за день; возвращает True, если они были"""
+    with _write() as cursor:
+        cursor.execute('DELETE FROM report_overrides WHERE date = ?', (to_iso_date(date),))
+        return cursor.rowcount > 0
+
+def set_report_settings(start_date: str, admin_rate: float, card_fee: int):
+    """Задает ставки отчета, действующие с start_date (dd.mm.yy); card_fee в копейках за день"""
+    with _write() as cursor:
+        cursor.execute('''
+        INSERT INTO report_settings (start_date, admin_rate, card_fee) VALUES (?, ?, ?)
+        ON CONFLICT (start_date) DO UPDATE
+        SET admin_rate = excluded.admin_rate, card_fee = excluded.card_fee
+        ''', (to_iso_date(start_date), float(admin_rate), int(card_fee)))
+
+def get_report_settings() -> List[Tuple]:
+    """Возвращает все периоды ставок: (start_date в ISO, admin_rate, card_fee в копейках)"""
+    with _read() as cursor:
+        cursor.execute('SELECT start_date, admin_rate, card_fee FROM report_settings ORDER BY start_date')
+        return cursor.fetchall()
+
+def get_report_snapshot(period: str) -> Optional[Tuple[str, dict]]:
+    """Возвращает сохраненный снимок отчета (текст, цифры) или None"""
+    with _read() as cursor:
+        cursor.execute('SELECT text, data FROM report_snapshots WHERE period = ?', (period,))
+        row = cursor.fetchone()
+    return (row[0], json.loads(row[1])) if row else None
+
+def build_report_snapshot(period: str, start_date: str, end_date: str, render) -> Tuple[str, dict]:
+    """Строит снимок отчета за период по render(breakdown) -> (текст, цифры) и сохраняет его.
+
+    Итоги читаются и снимок пишется в одной транзакции записи, поэтому изменение
+    записей не может вклиниться между расчетом и сохранением
+    """
+    with _write() as cursor:
+        cursor.execute('BEGIN IMMEDIATE')
+        text, data = render(_period_breakdown(cursor, start_date, end_date))
+        cursor.execute('''
+        INSERT INTO report_snapshots (period, text, data) VALUES (?, ?, ?)
+        ON CONFLICT (period) DO UPDATE
+        SET text = excluded.text, data = excluded.data, created_at = CURRENT_TIMESTAMP
+        ''', (period, text, json.dumps(data, ensure_ascii=False)))
+    return text, data
+
+def claim_report_delivery(period: str, chat_id: int, timeout: float) -> str:
+    """Занимает отправку отчета за period ('YYYY-MM-DD' или 'YYYY-MM') в чат chat_id.
+
+    Возвращает 'claimed', если отправлять этому процессу, 'delivered', если отчет уже
+    отправлен, или 'busy', если его отправляет другой процесс. Отправка, занятая больше
+    timeout секунд назад и так и не завершенная (процесс упал), занимается заново
+    """
+    with _write() as cursor:
+        cursor.execute('''
+        INSERT INTO report_deliveries (period, chat_id, claimed_at)
+        VALUES (?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+        ON CONFLICT (period, chat_id) DO UPDATE SET claimed_at = excluded.claimed_at
+        WHERE delivered_at IS NULL AND claimed_at <= excluded.claimed_at - ?
+        ''', (period, chat_id, timeout))
+        if cursor.rowcount == 1:
+            return 'claimed'
+        cursor.execute(
+            'SELECT delivered_at FROM report_deliveries WHERE period = ? AND chat_id = ?',
+            (period, chat_id)
+        )
+        return 'busy' if cursor.fetchone()[0] is None else 'delivered'
+
+def finish_report_delivery(period: str, chat_id: int, delivered: bool):
+    """Отмечает отчет отправленным, а если отправить не удалось - снимает отметку, чтобы его отправили снова"""
+    with _write() as cursor:
+        if delivered:
+            cursor.execute('''
+            UPDATE report_deliveries SET delivered_at = CURRENT_TIMESTAMP
+            WHERE period = ? AND chat_id = ?
+            ''', (period, chat_id))
+        else:
+            cursor.execute('''
+            DELETE FROM report_deliveries
+            WHERE period = ? AND chat_id = ? AND delivered_at IS NULL
+            ''', (period, chat_id))
+
+def get_top_user_tags(start_date: str, end_date: str, limit: int = 10) -> List[Tuple]:
+    """Топ покупателей за период по сумме продаж: (user_tag, сумма в копейках, количество)"""
+    with _read() as cursor:
+        cursor.execute('''
+        SELECT user_tag, SUM(amount) AS revenue, COUNT(*) AS sales_count
+        FROM sales
+        WHERE sale_type = 'продажа' AND date BETWEEN ? AND ?
+        GROUP BY user_tag
+        ORDER BY revenue DESC, sales_count DESC, user_tag
+        LIMIT ?
+        ''', (to_iso_date(start_date), to_iso_date(end_date), limit))
+        return cursor.fetchall()
+
+def get_operator_totals(start_date: str, end_date: str) -> List[Tuple]:
+    """Итоги за период по операторам: (user_id, продажи, закупки в копейках, количество записей)"""
+    with _read() as cursor:
+        cursor.execute('''
+        SELECT user_id,
+               SUM(CASE WHEN sale_type = 'продажа' THEN amount ELSE 0 END) AS sales,
+               SUM(CASE WHEN sale_type = 'закупка' THEN amount ELSE 0 END) AS purchases,
+               COUNT(*)
+        FROM sales
+        WHERE date BETWEEN ? AND ?
+        GROUP BY user_id
+        ORDER BY sales DESC, purchases DESC
+        ''', (to_iso_date(start_date), to_iso_date(end_date)))
+        return cursor.fetchall()
+
+def rebuild_daily_totals():
+    """Пересчитывает таблицу дневных итогов по всем записям и сбрасывает снимки отчетов"""
+    with _write() as cursor:
+        cursor.execute('BEGIN IMMEDIATE')
+        _rebuild_daily_totals(cursor)
+        cursor.execute('DELETE FROM report_snapshots')
+
+def get_media_file_id(path: str, kind: str, sha256: str) -> Optional[str]:
+    """Возвращает сохраненный file_id файла, если его содержимое не менялось"""
+    with _read() as cursor:
+        cursor.execute('''
+        SELECT file_id FROM media_cache
+        WHERE path = ? AND kind = ? AND sha256 = ?
+        ''', (path, kind, sha256))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+def save_media_file_id(path: str, kind: str, sha256: str, file_id: str):
+    """Сохраняет file_id загруженного файла"""
+    with _write() as cursor:
+        cursor.execute('''
+        INSERT INTO media_cache (path, kind, sha256, file_id)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (path, kind) DO UPDATE SET sha256 = excluded.sha256, file_id = excluded.file_id
+        ''', (path, kind, sha256, file_id))
+
+def delete_media_file_id(path: str, kind: str):
+    """Удаляет сохраненный file_id (например, если Telegram его больше не принимает)"""
+    with _write() as cursor:
+        cursor.execute('DELETE FROM media_cache WHERE path = ? AND kind = ?', (path, kind))
@@ -0,0 +1,84 @@
+"""Выгрузка записей и отчетности за период в CSV или XLSX.
+
+Записи читаются из базы курсором пачками и сразу пишутся в файл на диске
+(для XLSX - в режиме write_only), поэтому расход памяти не зависит от того,
+сколько лет истории попадает в выгрузку.
+
+Столбцы выгрузки записей совпадают с форматом импорта (см. importer.py),
+так что выгруженный файл можно загрузить обратно.
+"""
+import csv
+from datetime import date
+
+import database
+import reports
+from parsing import format_amount, parse_date
+
+SALE_TYPES = ('продажа', 'закупка')
+
+SALES_HEADER = ['sale_type', 'date', 'user_tag', 'time', 'amount', 'user_id']
+REPORT_HEADER = ['Дата', 'Продажи', 'Закупки', 'Процент админа', 'Карта', 'Итог дня']
+
+def _iter_sales_rows(start_date: str, end_date: str, sale_types):
+    for sale_type in sale_types:
+        for _, _, iso_date, time, user_tag, amount, user_id in database.iter_sales(start_date, end_date, sale_type):
+            yield sale_type, date.fromisoformat(iso_date), user_tag, time, amount, user_id
+
+def _iter_report_rows(start_date: str, end_date: str):
+    """Строки отчета по каждому дню периода, как в generate_report (с учетом правок), суммы в рублях"""
+    for row in database.get_period_breakdown(start_date, end_date):
+        figures = reports.breakdown_figures(row)
+        day = parse_date(row[0])
+        yield day, figures['sales'], figures['purchases'], figures['admin'], figures['card'], figures['total']
+
+def export_csv(path, start_date: str, end_date: str, kind: str = 'все'):
+    """Пишет CSV: записи выбранного типа ('продажа', 'закупка', 'все') или отчет по дням ('отчет')"""
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        if kind == 'отчет':
+            writer.writerow(REPORT_HEADER)
+            for day, *values in _iter_report_rows(start_date, end_date):
+                writer.writerow([day.strftime(database.DATE_FORMAT), *values])
+            return
+
+        writer.writerow(SALES_HEADER)
+        sale_types = SALE_TYPES if kind == 'все' else (kind,)
+        for sale_type, day, user_tag, time, amount, user_id in _iter_sales_rows(start_date, end_date, sale_types):
+            writer.writerow([
+                sale_type, day.strftime(database.DATE_FORMAT), user_tag, time,
+                format_amount(amount), user_id,
+            ])
+
+def export_xlsx(path, start_date: str, end_date: str, kind: str = 'все'):
+    """Пишет XLSX с листами 'Записи' (кроме kind='отчет') и 'Отчет'"""
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RuntimeError("Для выгрузки в XLSX нужен пакет openpyxl")
+
+    workbook = Workbook(write_only=True)
+
+    if kind != 'отчет':
+        sheet = workbook.create_sheet('Записи')
+        sheet.append(SALES_HEADER)
+        sale_types = SALE_TYPES if kind == 'все' else (kind,)
+        for sale_type, day, user_tag, time, amount, user_id in _iter_sales_rows(start_date, end_date, sale_types):
+            sheet.append([sale_type, day, user_tag, time, amount / 100, user_id])
+
+    sheet = workbook.create_sheet('Отчет')
+    sheet.append(REPORT_HEADER)
+    for row in _iter_report_rows(start_date, end_date):
+        sheet.append(list(row))
+
+    workbook.save(path)
+
+def export_file(path, start_date: str, end_date: str, kind: str = 'все', fmt: str = 'xlsx'):
+    """Выгружает данные за период (даты в формате dd.mm.yy) в файл формата fmt ('csv' или 'xlsx')"""
+    if kind not in SALE_TYPES + ('все', 'отчет'):
+        raise ValueError(f"Неизвестный тип выгрузки: {kind!r}")
+    if fmt == 'csv':
+        export_csv(path, start_date, end_date, kind)
+    elif fmt == 'xlsx':
+        export_xlsx(path, start_date, end_date, kind)
+    else:
+        raise ValueError(f"Неизвестный формат: {fmt!r}")
@@ -0,0 +1,200 @@
+"""Хранилища состояний FSM, которые переживают перезапуск и общие для нескольких воркеров.
+
+SQLiteStorage держит состояния в отдельном файле рядом с sales.db. Изменения
+копятся в памяти и пишутся в базу пачкой раз в flush_interval секунд, до этого
+чтения этого же процесса отдаются из буфера. Записи, которые не обновлялись
+дольше ttl секунд, считаются устаревшими и периодически удаляются.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+FSM_DATABASE_NAME = 'fsm.db'
+
+logger = logging.getLogger(__name__)
+
+_UNSET = object()
+
+class SQLiteStorage(BaseStorage):
+    def __init__(
+        self,
+        path: str = FSM_DATABASE_NAME,
+        ttl: float = 7 * 24 * 3600,
+        flush_interval: float = 0.05,
+        cleanup_interval: float = 600,
+        key_builder: Optional[KeyBuilder] = None,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.cleanup_interval = cleanup_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+        # key -> [state, data]; _UNSET означает, что эта часть не менялась
+        self._pending: Dict[str, list] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_cleanup = 0.0
+        # Один поток - одно соединение, запросы к файлу состояний идут по очереди
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm-db')
+        self._conn: Optional[sqlite3.Connection] = None
+
+    # --- работа с базой (выполняется в потоке self._executor) ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS fsm (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}',
+                updated_at REAL NOT NULL
+            )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_updated_at ON fsm (updated_at)')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _read(self, key: str):
+        row = self._connect().execute(
+            'SELECT state, data FROM fsm WHERE key = ? AND updated_at >= ?',
+            (key, time.time() - self.ttl)
+        ).fetchone()
+        if row is None:
+            return None, {}
+        return row[0], json.loads(row[1])
+
+    def _write(self, batch: Dict[str, list], cleanup: bool):
+        now = time.time()
+        states = [(key, state, now) for key, (state, data) in batch.items() if state is not _UNSET]
+        datas = [(key, data, now) for key, (state, data) in batch.items() if data is not _UNSET]
+        conn = self._connect()
+        with conn:
+            # Устаревшую строку сначала удаляем: иначе обновление только state (или только data)
+            # продлило бы ей updated_at и вернуло к жизни вторую, давно устаревшую часть
+            conn.executemany(
+                'DELETE FROM fsm WHERE key = ? AND updated_at < ?',
+                [(key, now - self.ttl) for key in batch]
+            )
+            conn.executemany('''
+            INSERT INTO fsm (key, state, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+            ''', states)
+            conn.executemany('''
+            INSERT INTO fsm (key, data, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            ''', datas)
+            conn.executemany(
+                "DELETE FROM fsm WHERE key = ? AND state IS NULL AND data = '{}'",
+                [(key,) for key in batch]
+            )
+            if cleanup:
+                deleted = conn.execute('DELETE FROM fsm WHERE updated_at < ?', (now - self.ttl,)).rowcount
+                if deleted:
+                    logger.info("Удалено устаревших состояний FSM: %s", deleted)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    # --- пакетная запись ---
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Не удалось сохранить состояния FSM: %s", e)
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        now = time.monotonic()
+        cleanup = now - self._last_cleanup >= self.cleanup_interval
+        if cleanup:
+            self._last_cleanup = now
+        try:
+            await self._run(self._write, batch, cleanup)
+        except Exception:
+            # Не теряем изменения: возвращаем их в буфер, если сверху ничего новее не записали
+            for key, (state, data) in batch.items():
+                entry = self._pending.setdefault(key, [_UNSET, _UNSET])
+                if entry[0] is _UNSET:
+                    entry[0] = state
+                if entry[1] is _UNSET:
+                    entry[1] = data
+            raise
+
+    # --- интерфейс BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        self._pending.setdefault(self.key_builder.build(key), [_UNSET, _UNSET])[0] = value
+        self._schedule_flush()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        db_key = self.key_builder.build(key)
+        entry = self._pending.get(db_key)
+        if entry is not None and entry[0] is not _UNSET:
+            return entry[0]
+        state, _ = await self._run(self._read, db_key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        value = json.dumps(dict(data), ensure_ascii=False)
+        self._pending.setdefault(self.key_builder.build(key), [_UNSET, _UNSET])[1] = value
+        self._schedule_flush()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        db_key = self.key_builder.build(key)
+        entry = self._pending.get(db_key)
+        if entry is not None and entry[1] is not _UNSET:
+            return json.loads(entry[1])
+        _, data = await self._run(self._read, db_key)
+        return data
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+def create_storage(kind: str = 'sqlite', path: str = FSM_DATABASE_NAME, ttl: float = 7 * 24 * 3600,
+                   redis_url: str = 'redis://localhost:6379/0') -> BaseStorage:
+    """Создает хранилище FSM по названию: 'sqlite', 'redis' или 'memory'"""
+    if kind == 'sqlite':
+        return SQLiteStorage(path=path, ttl=ttl)
+    if kind == 'redis':
+        # Нужен пакет redis; подойдет и любой Redis-совместимый сервер (KeyDB, Dragonfly и т.п.)
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(
+            redis_url,
+            key_builder=DefaultKeyBuilder(with_bot_id=True, with_destiny=True),
+            state_ttl=int(ttl),
+            data_ttl=int(ttl),
+        )
+    if kind == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Неизвестное хранилище FSM: {kind!r}")
@@ -0,0 +1,191 @@
+"""Импорт исторических продаж из текстовых файлов, CSV и XLSX.
+
+Текстовый файл - по одной записи в строке в том же формате, что и в инлайн-режиме:
+    #продажа/10.04.25/@username/10:00/7000р
+CSV и XLSX - таблица с заголовком: sale_type, date, user_tag, time, amount и
+необязательный user_id (подходят и русские названия столбцов).
+
+Файл читается потоково, строки проверяются по одной и пишутся пачками
+по CHUNK_SIZE записей в одной транзакции.
+"""
+import csv
+from datetime import date as date_type, datetime, time as time_type
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import database
+import parsing
+from parsing import SALE_TYPES
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 20
+
+COLUMN_ALIASES = {
+    'sale_type': 'sale_type', 'type': 'sale_type', 'тип': 'sale_type',
+    'date': 'date', 'дата': 'date',
+    'user_tag': 'user_tag', 'user': 'user_tag', 'username': 'user_tag', 'пользователь': 'user_tag',
+    'time': 'time', 'время': 'time',
+    'amount': 'amount', 'сумма': 'amount',
+    'user_id': 'user_id',
+}
+REQUIRED_COLUMNS = ('sale_type', 'date', 'user_tag', 'time', 'amount')
+
+class ImportResult:
+    def __init__(self):
+        self.total = 0
+        self.inserted = 0
+        self.errors: List[Tuple[int, str]] = []
+        self.error_count = 0
+
+    @property
+    def duplicates(self) -> int:
+        return self.total - self.error_count - self.inserted
+
+    def add_error(self, line_no: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line_no, message))
+
+    def summary(self) -> str:
+        lines = [
+            f"Строк обработано: {self.total}",
+            f"Добавлено: {self.inserted}",
+            f"Дубликатов: {self.duplicates}",
+            f"Ошибок: {self.error_count}",
+        ]
+        for line_no, message in self.errors:
+            lines.append(f"  строка {line_no}: {message}")
+        if self.error_count > len(self.errors):
+            lines.append(f"  ... и еще {self.error_count - len(self.errors)}")
+        return "\n".join(lines)
+
+def parse_entry(text: str) -> Tuple[str, str, str, str, int]:
+    """Разбирает строку '#продажа/dd.mm.yy/@user/HH:MM/сумма' в (sale_type, ISO-дата, user_tag, time, копейки)"""
+    entry = parsing.parse_entry(text)
+    return entry.sale_type, database.to_iso_date(entry.date), entry.user_tag, entry.time, entry.amount
+
+def _parse_date(value) -> str:
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date_type):
+        return value.isoformat()
+    value = str(value).strip()
+    try:
+        return parsing.parse_date(value).isoformat()
+    except ValueError:
+        pass
+    for fmt in ('%d.%m.%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f"неверная дата {value!r}")
+
+def _parse_time(value) -> str:
+    if isinstance(value, (datetime, time_type)):
+        return value.strftime('%H:%M')
+    value = str(value).strip()
+    if len(value) == 4 and value[1] == ':':
+        value = '0' + value
+    try:
+        return parsing.parse_time(value)
+    except ValueError:
+        raise ValueError(f"неверное время {value!r}")
+
+def parse_columns(values: dict, default_user_id: int) -> Tuple[str, str, str, str, int, int]:
+    """Проверяет строку таблицы и возвращает кортеж для database.add_sales_bulk"""
+    sale_type = str(values.get('sale_type') or '').strip().lstrip('#').lower()
+    if sale_type not in SALE_TYPES:
+        raise ValueError(f"неизвестный тип {sale_type!r}")
+    user_tag = str(values.get('user_tag') or '').strip()
+    if user_tag and not user_tag.startswith('@'):
+        user_tag = '@' + user_tag
+    if not parsing.is_user_tag(user_tag):
+        raise ValueError(f"неверный username {user_tag!r}")
+    amount = values.get('amount')
+    if amount is None or amount == '':
+        raise ValueError("не указана сумма")
+    user_id = values.get('user_id')
+    user_id = int(user_id) if user_id not in (None, '') else default_user_id
+    return (
+        sale_type,
+        _parse_date(values.get('date')),
+        user_tag,
+        _parse_time(values.get('time')),
+        parsing.parse_amount(amount),
+        user_id,
+    )
+
+def _map_header(header) -> List[Optional[str]]:
+    columns = [COLUMN_ALIASES.get(str(name or '').strip().lower()) for name in header]
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        raise ValueError(f"в заголовке нет столбцов: {', '.join(missing)}")
+    return columns
+
+def _iter_table(rows, default_user_id: int, result: ImportResult) -> Iterator[tuple]:
+    rows = iter(rows)
+    columns = _map_header(next(rows, ()))
+    for line_no, row in enumerate(rows, start=2):
+        if not any(cell not in (None, '') for cell in row):
+            continue
+        result.total += 1
+        values = {name: cell for name, cell in zip(columns, row) if name}
+        try:
+            yield parse_columns(values, default_user_id)
+        except (TypeError, ValueError) as e:
+            result.add_error(line_no, str(e))
+
+def _iter_text(lines, default_user_id: int, result: ImportResult) -> Iterator[tuple]:
+    for line_no, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        result.total += 1
+        try:
+            yield parse_entry(line) + (default_user_id,)
+        except ValueError as e:
+            result.add_error(line_no, str(e))
+
+def _iter_xlsx(path: str):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise RuntimeError("Для импорта XLSX нужен пакет openpyxl")
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def import_file(path, default_user_id: int = 0, chunk_size: int = CHUNK_SIZE) -> ImportResult:
+    """Импортирует записи из файла (.csv, .xlsx или текст) и возвращает отчет"""
+    path = str(path)
+    suffix = Path(path).suffix.lower()
+    result = ImportResult()
+
+    if suffix == '.xlsx':
+        rows = _iter_table(_iter_xlsx(path), default_user_id, result)
+        _insert_chunks(rows, chunk_size, result, default_user_id)
+        return result
+
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if suffix == '.csv':
+            sample = f.read(4096)
+            f.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            rows = _iter_table(csv.reader(f, dialect), default_user_id, result)
+        else:
+            rows = _iter_text(f, default_user_id, result)
+        _insert_chunks(rows, chunk_size, result, default_user_id)
+    return result
+
+def _insert_chunks(rows: Iterator[tuple], chunk_size: int, result: ImportResult, actor_id: int):
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        result.inserted += database.add_sales_bulk(chunk, actor_id=actor_id)
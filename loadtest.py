@@ -0,0 +1,272 @@
+"""Нагрузочный прогон бота без Telegram и сети.
+
+Синтетические апдейты (инлайн-запросы, подтверждение добавления, навигация
+по календарю, отчеты за день и месяц, списки записей, поиск) подаются прямо
+в dp.feed_update. Bot работает через подменную сессию, которая отвечает на
+любой метод API сразу (или с задержкой --api-latency), база - временный
+sales.db с заранее сгенерированными записями. В конце печатается пропускная
+способность и задержки p50/p95/p99 по каждому обработчику.
+
+Пример:
+    python loadtest.py --updates 5000 --concurrency 32 --seed-rows 50000
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types as pytypes
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+from aiogram import methods, types
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.storage.memory import MemoryStorage
+
+class FakeSession(BaseSession):
+    """Сессия Bot, которая не ходит в сеть и считает вызванные методы API"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = Counter()
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, (methods.SendMessage, methods.SendPhoto, methods.SendDocument,
+                               methods.EditMessageText, methods.EditMessageReplyMarkup)):
+            return types.Message(
+                message_id=random.randint(1, 1 << 30),
+                date=datetime.now(),
+                chat=types.Chat(id=1, type='private'),
+                text=getattr(method, 'text', None),
+            )
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+def _ensure_config():
+    """Если config.py нет (например, на чистой машине), подставляет заглушку с фиктивным токеном"""
+    try:
+        import config  # noqa: F401
+    except ImportError:
+        config = pytypes.ModuleType('config')
+        config.BOT_TOKEN = '123456:LOADTEST'
+        sys.modules['config'] = config
+
+class UpdateFactory:
+    """Генерирует апдейты от pool_size пользователей по датам за последние days дней"""
+
+    def __init__(self, rng: random.Random, days: int = 60, pool_size: int = 50):
+        self.rng = rng
+        self.today = date.today()
+        self.days = days
+        self.users = [types.User(id=1000 + i, is_bot=False, first_name=f"user{i}") for i in range(pool_size)]
+        self.update_id = 0
+
+    def _next_id(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    def _date(self) -> date:
+        return self.today - timedelta(days=self.rng.randrange(self.days))
+
+    def _entry(self):
+        sale_type = self.rng.choice(['продажа', 'закупка'])
+        return (
+            sale_type, self._date().strftime('%d.%m.%y'), f"@user{self.rng.randrange(500)}",
+            f"{self.rng.randrange(24):02d}:{self.rng.randrange(60):02d}", str(self.rng.randrange(100, 20000)),
+        )
+
+    def _user(self) -> types.User:
+        return self.rng.choice(self.users)
+
+    def _message(self, user: types.User, text: str) -> types.Update:
+        update_id = self._next_id()
+        return types.Update(update_id=update_id, message=types.Message(
+            message_id=update_id, date=datetime.now(), text=text, from_user=user,
+            chat=types.Chat(id=user.id, type='private'),
+        ))
+
+    def _callback(self, user: types.User, data: str) -> types.Update:
+        update_id = self._next_id()
+        return types.Update(update_id=update_id, callback_query=types.CallbackQuery(
+            id=str(update_id), from_user=user, chat_instance='loadtest', data=data,
+            message=types.Message(
+                message_id=update_id, date=datetime.now(), text='-', from_user=user,
+                chat=types.Chat(id=user.id, type='private'),
+            ),
+        ))
+
+    def _inline(self, user: types.User, query: str) -> types.Update:
+        update_id = self._next_id()
+        return types.Update(update_id=update_id, inline_query=types.InlineQuery(
+            id=str(update_id), from_user=user, query=query, offset='',
+        ))
+
+    # Сценарии: каждый возвращает список апдейтов, которые один пользователь шлет по очереди
+
+    def inline_add(self):
+        user = self._user()
+        sale_type, date_str, user_tag, time_str, amount = self._entry()
+        query = f"#{sale_type}/{date_str}/{user_tag}/{time_str}/{amount}р"
+        confirm = f"confirm_add|{sale_type}|{date_str}|{user_tag}|{time_str}|{amount}"
+        return [self._inline(user, query[:self.rng.randint(5, len(query))]), self._inline(user, query),
+                self._callback(user, confirm)]
+
+    def calendar(self):
+        user = self._user()
+        day = self._date()
+        return [self._callback(user, f"calendar_nav:{day.year}:{day.month}")]
+
+    def day_report(self):
+        user = self._user()
+        return [self._callback(user, 'report'), self._callback(user, f"calendar_day:{self._date().isoformat()}")]
+
+    def month_report(self):
+        user = self._user()
+        day = self._date()
+        return [self._callback(user, f"month_report:{day.year}:{day.month}")]
+
+    def records(self):
+        user = self._user()
+        return [self._callback(user, 'sales'), self._callback(user, f"calendar_day:{self._date().isoformat()}")]
+
+    def search(self):
+        user = self._user()
+        return [self._message(user, f"/find @user{self.rng.randrange(50)}")]
+
+    SCENARIOS = {
+        'inline_add': 5,
+        'calendar': 2,
+        'day_report': 3,
+        'month_report': 1,
+        'records': 2,
+        'search': 1,
+    }
+
+    def scenario(self):
+        names = list(self.SCENARIOS)
+        name = self.rng.choices(names, weights=[self.SCENARIOS[n] for n in names])[0]
+        return getattr(self, name)()
+
+def handler_name(main, update: types.Update) -> str:
+    """Имя обработчика для статистики: маршрут callback, команда или вид инлайн-запроса"""
+    if update.callback_query is not None:
+        return main.router.route_name(update.callback_query.data)
+    if update.inline_query is not None:
+        return 'inline_find' if main.INLINE_FIND_RE.match(update.inline_query.query) else 'inline_sales'
+    if update.message is not None and update.message.text and update.message.text.startswith('/'):
+        return update.message.text.split()[0]
+    return 'message'
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def seed_database(database, rows: int, days: int, rng: random.Random):
+    """Заполняет временную базу записями за последние days дней"""
+    today = date.today()
+    batch = []
+    for _ in range(rows):
+        day = today - timedelta(days=rng.randrange(days))
+        batch.append((
+            rng.choice(['продажа', 'закупка']), day.isoformat(), f"@user{rng.randrange(500)}",
+            f"{rng.randrange(24):02d}:{rng.randrange(60):02d}", rng.randrange(100, 2000000), rng.randrange(1, 6),
+        ))
+        if len(batch) == 10000:
+            database.add_sales_bulk(batch)
+            batch.clear()
+    if batch:
+        database.add_sales_bulk(batch)
+
+async def run(args):
+    rng = random.Random(args.seed)
+    _ensure_config()
+
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    os.chdir(workdir)
+    import database
+    database.DATABASE_NAME = os.path.join(workdir, 'sales.db')
+    import main
+    import storage
+
+    session = FakeSession(latency=args.api_latency / 1000)
+    session.middleware = main.bot.session.middleware
+    main.bot.session = session
+    # Состояния FSM держим в памяти, чтобы не трогать fsm.db или Redis из config.py
+    main.dp.fsm.storage = MemoryStorage()
+    # Порт метрик не занимаем: прогон может идти рядом с работающим ботом
+    main.metrics_server = None
+    if not args.throttle:
+        main.throttling.user_limit = main.throttling.chat_limit = None
+
+    await main.dp.emit_startup(bot=main.bot)
+    await storage._run(seed_database, database, args.seed_rows, args.days, rng)
+    print(f"База: {database.DATABASE_NAME}, записей: {args.seed_rows}")
+
+    factory = UpdateFactory(rng, days=args.days)
+    scenarios = []
+    total = 0
+    while total < args.updates:
+        scenario = factory.scenario()
+        scenarios.append(scenario)
+        total += len(scenario)
+
+    latencies = defaultdict(list)
+    errors = Counter()
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def play(updates):
+        async with slots:
+            for update in updates:
+                name = handler_name(main, update)
+                started = time.perf_counter()
+                try:
+                    await main.dp.feed_update(main.bot, update)
+                except Exception:
+                    errors[name] += 1
+                latencies[name].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(play(updates) for updates in scenarios))
+    elapsed = time.perf_counter() - started
+
+    await main.dp.emit_shutdown(bot=main.bot)
+    if not args.keep_db:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\nАпдейтов: {total} за {elapsed:.2f} с, {total / elapsed:.0f} апдейтов/с, параллельно: {args.concurrency}")
+    print(f"\n{'обработчик':<18} {'кол-во':>7} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} {'max мс':>8} {'ошибок':>7}")
+    for name in sorted(latencies, key=lambda n: -len(latencies[n])):
+        values = [v * 1000 for v in latencies[name]]
+        print(
+            f"{name:<18} {len(values):>7} {percentile(values, 0.5):>8.2f} {percentile(values, 0.95):>8.2f} "
+            f"{percentile(values, 0.99):>8.2f} {max(values):>8.2f} {errors[name]:>7}"
+        )
+    print(f"\nВызовы API: {dict(session.requests)}")
+    print(f"Кэш: {storage.cache_stats()}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон обработчиков бота")
+    parser.add_argument('--updates', type=int, default=2000, help="сколько апдейтов отправить")
+    parser.add_argument('--concurrency', type=int, default=16, help="сколько пользователей одновременно")
+    parser.add_argument('--seed-rows', type=int, default=20000, help="сколько записей заранее положить в базу")
+    parser.add_argument('--days', type=int, default=60, help="за сколько последних дней генерировать записи")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="задержка ответа API Telegram, мс")
+    parser.add_argument('--seed', type=int, default=1, help="seed генератора, для повторяемых прогонов")
+    parser.add_argument('--throttle', action='store_true', help="не отключать ограничение частоты апдейтов")
+    parser.add_argument('--keep-db', action='store_true', help="не удалять временную базу после прогона")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    asyncio.run(run(parse_args()))
@@ -1,19 +1,39 @@
+import asyncio
 import logging
-from aiogram import Bot, Dispatcher, types
+from aiogram import Bot, Dispatcher, F, html, types
 from aiogram.enums import ParseMode
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, InputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.client.default import DefaultBotProperties
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import CommandObject
 
-from database import init_db, add_sale, get_sales_by_date, delete_sale, update_sale, get_sale_by_id, sum_sales_for_period
+from storage import init_db, close_db, add_sale, get_sales_page, delete_sale, update_sale, get_sale_by_id, get_day_totals, sale_exists, import_file, export_file, set_report_override, clear_report_overrides, search_sales, get_sale_history
+from parsing import parse_amount, format_amount, parse_date, parse_time, check_entry, EntryHint, ENTRY_EXAMPLE, SaleEntry
+from reports import get_day_report, get_month_report, build_leaderboard
+from scheduler import ReportScheduler, parse_report_time
+from metrics import HandlerMetrics, MetricsServer
+from throttling import ThrottlingMiddleware, CallbackCoalescer, RetryAfterBackoff
+from callback_router import CallbackRouter
+from callbacks import (
+    ConfirmAdd, MonthReport, CalendarNav, CalendarDay, EditRecords, DeleteRecords, BackToRecords,
+    SelectRecord, SelectDelete, ConfirmDelete, DeleteRecord, EditUserTag, EditAmount, EditTime, EditReport,
+    RecordsPage, FindPage, SaleHistory, LEGACY_CALLBACKS,
+)
 import re
+import sqlite3
+import config
 from config import BOT_TOKEN
+from fsm_storage import create_storage
+from media import send_cached
+from cache import TTLCache
+from search import parse_search_query, SEARCH_HELP
 import os
+import tempfile
 from pathlib import Path
 
 # Настройка логирования
@@ -21,7 +41,42 @@ logging.basicConfig(level=logging.INFO)
 
 # Инициализация бота
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
+# Хранилище состояний: 'sqlite' (по умолчанию, файл fsm.db), 'redis' или 'memory'
+dp = Dispatcher(storage=create_storage(
+    getattr(config, 'FSM_STORAGE', 'sqlite'),
+    path=getattr(config, 'FSM_DATABASE', 'fsm.db'),
+    ttl=getattr(config, 'FSM_TTL', 7 * 24 * 3600),
+    redis_url=getattr(config, 'REDIS_URL', 'redis://localhost:6379/0'),
+))
+router = CallbackRouter(legacy=LEGACY_CALLBACKS)
+# Ежедневный расчет и рассылка отчетов: REPORT_TIME = '09:00', REPORT_CHAT_IDS = [id чата, ...]
+scheduler = ReportScheduler(
+    bot,
+    report_time=parse_report_time(getattr(config, 'REPORT_TIME', '09:00')),
+    chat_ids=getattr(config, 'REPORT_CHAT_IDS', []),
+    retry_interval=getattr(config, 'REPORT_RETRY_INTERVAL', 300),
+)
+# Метрики Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (METRICS_PORT = None - выключить),
+# обработчики дольше SLOW_HANDLER_MS пишутся в лог
+_metrics_port = getattr(config, 'METRICS_PORT', 9108)
+metrics_server = MetricsServer(getattr(config, 'METRICS_HOST', '127.0.0.1'), _metrics_port) if _metrics_port else None
+_slow_handler_ms = getattr(config, 'SLOW_HANDLER_MS', 1000)
+handler_metrics = HandlerMetrics(router, slow_threshold=_slow_handler_ms / 1000 if _slow_handler_ms else None)
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+dp.inline_query.middleware(handler_metrics)
+# Ограничение частоты: RATE_LIMIT_USER / RATE_LIMIT_CHAT = (апдейтов в секунду, запас) или None
+throttling = ThrottlingMiddleware(
+    user_limit=getattr(config, 'RATE_LIMIT_USER', (2, 6)),
+    chat_limit=getattr(config, 'RATE_LIMIT_CHAT', (5, 15)),
+)
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+# Повторные нажатия навигации и обновления на одном сообщении выполняются один раз
+dp.callback_query.outer_middleware(CallbackCoalescer(router, (
+    'calendar_nav', 'calendar_today', 'month_report', 'records_page', 'find_page', 'update_report', 'reload',
+)))
+bot.session.middleware(RetryAfterBackoff())
 
 # Состояния для FSM
 class Form(StatesGroup):
@@ -36,124 +91,146 @@ class Form(StatesGroup):
     waiting_for_edit_card = State()
     waiting_for_edit_user_tag = State()
     waiting_for_delete_confirmation = State()
+    waiting_for_import_file = State()
 
 # Функция для создания инлайн-календаря
-def create_calendar(year=None, month=None, selected_date=None):
-    if year is None or month is None:
-        today = datetime.now()
-        year, month = today.year, today.month
+@lru_cache(maxsize=64)
+def _month_title(year: int, month: int) -> str:
+    return datetime(year, month, 1).strftime('%B %Y')
 
-    keyboard = InlineKeyboardBuilder()
-
-    month_name = datetime(year, month, 1).strftime('%B %Y')
-    keyboard.row(InlineKeyboardButton(text=month_name, callback_data="ignore"))
+@lru_cache(maxsize=64)
+def _calendar_layout(year: int, month: int):
+    """Кнопки календаря на месяц без отметки выбранного дня и позиции дней в сетке.
 
-    week_days = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
-    keyboard.row(*[InlineKeyboardButton(text=day, callback_data="ignore") for day in week_days])
+    Результат кэшируется: при листании календаря сетка месяца строится один раз
+    """
+    rows = [
+        [InlineKeyboardButton(text=_month_title(year, month), callback_data="ignore")],
+        [InlineKeyboardButton(text=day, callback_data="ignore") for day in ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]],
+    ]
 
     first_day = datetime(year, month, 1)
     last_day = (datetime(year, month + 1, 1) - timedelta(days=1)) if month < 12 else (datetime(year + 1, 1, 1) - timedelta(days=1))
 
     buttons = []
+    positions = {}
 
     for _ in range((first_day.weekday() + 1) % 7):
         buttons.append(InlineKeyboardButton(text=" ", callback_data="ignore"))
 
     for day in range(1, last_day.day + 1):
-        date_obj = datetime(year, month, day).date()
-        date_str = date_obj.strftime('%Y-%m-%d')
-
-        text = f"{day}"
-        if selected_date and date_obj == selected_date:
-            text = f"✅ {day}"
-
-        buttons.append(InlineKeyboardButton(text=text, callback_data=f"calendar_day_{date_str}"))
+        positions[day] = (len(rows) + len(buttons) // 7, len(buttons) % 7)
+        buttons.append(InlineKeyboardButton(text=f"{day}", callback_data=CalendarDay(date=f"{year:04d}-{month:02d}-{day:02d}").pack()))
 
     while len(buttons) % 7 != 0:
         buttons.append(InlineKeyboardButton(text=" ", callback_data="ignore"))
 
     for i in range(0, len(buttons), 7):
-        keyboard.row(*buttons[i:i+7])
+        rows.append(buttons[i:i+7])
 
     prev_month = month - 1 if month > 1 else 12
     prev_year = year if month > 1 else year - 1
     next_month = month + 1 if month < 12 else 1
     next_year = year if month < 12 else year + 1
 
-    keyboard.row(
-        InlineKeyboardButton(text="⬅️", callback_data=f"calendar_prev_{prev_year}_{prev_month}"),
+    rows.append([
+        InlineKeyboardButton(text="⬅️", callback_data=CalendarNav(year=prev_year, month=prev_month).pack()),
         InlineKeyboardButton(text="Сегодня", callback_data="calendar_today"),
-        InlineKeyboardButton(text="➡️", callback_data=f"calendar_next_{next_year}_{next_month}")
-    )
+        InlineKeyboardButton(text="➡️", callback_data=CalendarNav(year=next_year, month=next_month).pack())
+    ])
     
     # Добавляем кнопку отчетности за месяц
-    keyboard.row(
-        InlineKeyboardButton(text="📊 Отчет за месяц", callback_data=f"month_report:{year}:{month}"),
+    rows.append([
+        InlineKeyboardButton(text="📊 Отчет за месяц", callback_data=MonthReport(year=year, month=month).pack()),
         InlineKeyboardButton(text="🔄 Перезагрузить", callback_data="reload")
-    )
+    ])
     
-    keyboard.row(
+    rows.append([
         InlineKeyboardButton(text="🔙 Вернуться в меню", callback_data="back_to_menu")
-    )
+    ])
 
-    return keyboard.as_markup()
+    return InlineKeyboardMarkup(inline_keyboard=rows), positions
+
+def create_calendar(year=None, month=None, selected_date=None):
+    if year is None or month is None:
+        today = datetime.now()
+        year, month = today.year, today.month
+
+    markup, positions = _calendar_layout(year, month)
+
+    if not selected_date or (selected_date.year, selected_date.month) != (year, month):
+        return markup
+
+    # Копируем только строку с выбранным днем, остальные кнопки общие
+    row_index, col_index = positions[selected_date.day]
+    rows = list(markup.inline_keyboard)
+    row = list(rows[row_index])
+    row[col_index] = InlineKeyboardButton(text=f"✅ {selected_date.day}", callback_data=row[col_index].callback_data)
+    rows[row_index] = row
+
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
 # Добавляем обработчик для отчетности за месяц
-@dp.callback_query(lambda c: c.data.startswith('month_report:'))
-async def handle_month_report(callback_query: types.CallbackQuery):
-    _, year, month = callback_query.data.split(':')
-    year, month = int(year), int(month)
-    
-    # Получаем все записи за месяц
-    start_date = datetime(year, month, 1).strftime('%d.%m.%y')
-    end_date = (datetime(year, month + 1, 1) - timedelta(days=1)).strftime('%d.%m.%y') if month < 12 else (datetime(year + 1, 1, 1) - timedelta(days=1)).strftime('%d.%m.%y')
-    
-    # Здесь нужно реализовать получение данных за месяц из вашей БД
-    # Это примерная реализация - адаптируйте под свою структуру БД
-    monthly_sales = sum_sales_for_period(start_date, end_date, 'продажа')
-    monthly_purchases = sum_sales_for_period(start_date, end_date, 'закупка')
-    
-    admin_percent = round(monthly_sales * 0.15)
-    card_fee = 100 * (datetime(year, month + 1, 1) - datetime(year, month, 1)).days if month < 12 else (datetime(year + 1, 1, 1) - datetime(year, month, 1)).days
-    month_total = int(monthly_sales - monthly_purchases - admin_percent - card_fee)
-    
-    month_name = datetime(year, month, 1).strftime('%B %Y')
-    report = (
-        f"<b>Отчетность за {month_name}</b>\n\n"
-        f"Продажи: {int(monthly_sales)}р\n"
-        f"Закупки: {int(monthly_purchases)}р\n"
-        f"Процент админа: {admin_percent}р\n"
-        f"Комиссия карты: {card_fee}р\n\n"
-        f"<b>ИТОГО: {month_total}р</b>"
-    )
+@router.on(MonthReport)
+async def handle_month_report(callback_query: types.CallbackQuery, callback_data: MonthReport):
+    report = await get_month_report(callback_data.year, callback_data.month)
     
     await callback_query.message.answer(report)
     await callback_query.answer()
 
 
-@dp.inline_query()
-async def handle_inline_sales(query: types.InlineQuery):
-    # Строгое регулярное выражение
-    pattern = r"#?(продажа|закупка)/(\d{2}\.\d{2}\.\d{2})/(@\w+)/(\d{2}:\d{2})/([\d,.]+)(р)?$"
-    match = re.fullmatch(pattern, query.query.strip())
-    
-    if not match:
-        await query.answer(
-            results=[],
-            switch_pm_text="Неверный формат. Пример: #продажа/10.04.25/@username/10:00/7000р",
-            switch_pm_parameter="help"
-        )
+FIND_PAGE_SIZE = 10
+INLINE_FIND_RE = re.compile(r"(?:найти|find)(?:\s+(.*))?\Z", re.IGNORECASE | re.DOTALL)
+
+def describe_record(record) -> str:
+    record_id, sale_type, user_tag, time, amount, date = record[:6]
+    return f"{record_id}. {sale_type} {date} {user_tag}/{time}/{format_amount(amount)}"
+
+@dp.inline_query(F.query.regexp(INLINE_FIND_RE))
+async def handle_inline_find(query: types.InlineQuery):
+    """Инлайн-поиск: '@bot найти @user 01.04.25 >5000', страницы через offset"""
+    text = INLINE_FIND_RE.fullmatch(query.query.strip()).group(1) or ''
+    try:
+        filters = parse_search_query(text)
+    except ValueError as e:
+        await query.answer(results=[], cache_time=5, switch_pm_text=str(e)[:64], switch_pm_parameter="help")
         return
 
-    sale_type, date, user_tag, time, amount, _ = match.groups()
-    amount = amount.replace(',', '').replace('.', '').strip()
-    
-    # Проверка на дубликаты
-    existing = get_sales_by_date(date, sale_type)
-    duplicate = any(
-        sale[2] == user_tag and sale[3] == time and sale[4] == amount
-        for sale in existing
+    cursor_id = int(query.offset) if query.offset.isdigit() else None
+    rows, more = await search_sales(cursor_id=cursor_id, limit=FIND_PAGE_SIZE * 2, **filters)
+    results = []
+    for record in rows:
+        record_id, sale_type, user_tag, time, amount, date = record[:6]
+        results.append(types.InlineQueryResultArticle(
+            id=str(record_id),
+            title=f"{user_tag} — {format_amount(amount)}р",
+            description=f"{sale_type} {date} {time}",
+            input_message_content=types.InputTextMessageContent(message_text=html.quote(describe_record(record))),
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+                InlineKeyboardButton(text="✏️ Открыть", callback_data=SelectRecord(record_id=record_id).pack())
+            ]]),
+        ))
+    await query.answer(
+        results=results,
+        cache_time=5,
+        is_personal=True,
+        next_offset=str(rows[-1][0]) if rows and more else '',
     )
+
+# Инлайн-добавление. Подсказка о формате зависит только от текста запроса, поэтому Telegram
+# может долго отдавать ее из своего кэша; ответ на полную запись личный (проверка дубликата,
+# имя автора) и кэшируется ненадолго - и у Telegram, и у нас по (пользователь, запись)
+INLINE_HINT_CACHE_TIME = 300
+INLINE_RESULT_CACHE_TIME = 5
+# Пока дописывается сумма, каждая цифра - уже полная запись: в базу идем после паузы в наборе
+INLINE_DEBOUNCE = 0.2
+inline_answers = TTLCache(maxsize=1024, ttl=10)
+_inline_latest = {}
+
+async def build_inline_sale_result(entry, user: types.User) -> types.InlineQueryResultArticle:
+    sale_type, date, user_tag, time, kopecks = entry
+    amount = format_amount(kopecks)
+    duplicate = await sale_exists(sale_type, date, user_tag, time, kopecks) is not None
     
     if duplicate:
         result = types.InlineQueryResultArticle(
@@ -171,7 +248,9 @@ async def handle_inline_sales(query: types.InlineQuery):
                 [
                     InlineKeyboardButton(
                         text="Подтвердить добавление",
-                        callback_data=f"confirm_add:{sale_type}:{date}:{user_tag}:{time}:{amount}"
+                        callback_data=ConfirmAdd(
+                            sale_type=sale_type, date=date, user_tag=user_tag, time=time, amount=amount
+                        ).pack()
                     )
                 ]
             ]
@@ -188,45 +267,75 @@ async def handle_inline_sales(query: types.InlineQuery):
                     f"Пользователь: {user_tag}\n"
                     f"Время: {time}\n"
                     f"Сумма: {amount}р\n"
-                    f"Добавил: {query.from_user.full_name}"
+                    f"Добавил: {user.full_name}"
                 ),
                 parse_mode=ParseMode.HTML
             ),
             description=f"{sale_type} {date} {user_tag} {time}",
             reply_markup=keyboard
         )
+    return result
 
-    await query.answer(results=[result], cache_time=0)
+@dp.inline_query()
+async def handle_inline_sales(query: types.InlineQuery):
+    entry = check_entry(query.query, partial=True)
+    if isinstance(entry, EntryHint):
+        # Подсказываем, какое поле записи дописать или исправить; в базу не ходим
+        await query.answer(
+            results=[],
+            switch_pm_text=f"{entry.message}. Пример: {ENTRY_EXAMPLE}",
+            switch_pm_parameter="help",
+            cache_time=INLINE_HINT_CACHE_TIME,
+        )
+        return
 
-@dp.callback_query(lambda c: c.data.startswith('confirm_add:'))
-async def process_confirmation(callback_query: types.CallbackQuery):
-    try:
-        # Разбиваем данные callback, но берем только первые 6 элементов
-        parts = callback_query.data.split(':')
-        if len(parts) < 6:
-            await callback_query.answer("Ошибка: неверный формат данных", show_alert=True)
+    user_id = query.from_user.id
+    key = (user_id, entry)
+    result = inline_answers.get(key)
+    if result is None:
+        # Если за время паузы пришел новый запрос, отвечать на этот уже незачем
+        _inline_latest[user_id] = query.id
+        await asyncio.sleep(INLINE_DEBOUNCE)
+        if _inline_latest.get(user_id) != query.id:
             return
-            
-        _, sale_type, date, user_tag, time, amount = parts[:6]
-        
+        del _inline_latest[user_id]
+        generation = inline_answers.generation
+        result = await build_inline_sale_result(entry, query.from_user)
+        inline_answers.set(key, result, generation)
 
+    await query.answer(results=[result], cache_time=INLINE_RESULT_CACHE_TIME, is_personal=True)
 
-        add_sale(
+@router.on(ConfirmAdd)
+async def process_confirmation(callback_query: types.CallbackQuery, callback_data: ConfirmAdd):
+    try:
+        sale_type, date, user_tag, time, amount = (
+            callback_data.sale_type, callback_data.date, callback_data.user_tag,
+            callback_data.time, callback_data.amount
+        )
+
+        kopecks = parse_amount(amount)
+        _, created = await add_sale(
             sale_type=sale_type,
             date=date,
             user_tag=user_tag,
             time=time,
-            amount=amount,
+            amount=kopecks,
             user_id=callback_query.from_user.id
         )
-        await callback_query.answer("✅ Запись успешно добавлена", show_alert=True)
+        if created:
+            # Закэшированные инлайн-ответы "Подтвердить добавление" для этой записи устарели
+            entry = SaleEntry(sale_type, date, user_tag, time, kopecks)
+            inline_answers.invalidate_where(lambda key: key[1] == entry)
+            await callback_query.answer("✅ Запись успешно добавлена", show_alert=True)
+        else:
+            await callback_query.answer("Такая запись уже существует", show_alert=True)
         
         # Убираем кнопку после нажатия
         await callback_query.message.edit_reply_markup(reply_markup=None)
         
     except Exception as e:
         await callback_query.answer(f"Ошибка: {str(e)}", show_alert=True)
-        print(f"Error in process_confirmation: {e}")
+        logging.exception("Ошибка при добавлении записи")
 
 @dp.message(Command("start"))
 async def send_welcome(message: types.Message):
@@ -238,9 +347,8 @@ async def send_welcome(message: types.Message):
     builder.row(InlineKeyboardButton(text="Отчетность", callback_data="report"))
 
     try:
-        photo_path = Path("hello_photo.jpg").absolute()
-        await message.reply_photo(
-            photo=types.FSInputFile(photo_path),
+        await send_cached(
+            message.reply_photo, 'photo', Path("hello_photo.jpg"),
             caption="Всю информацию по отчетности канала можно глянуть по кнопкам ниже👇",
             reply_markup=builder.as_markup()
         )
@@ -251,14 +359,11 @@ async def send_welcome(message: types.Message):
             reply_markup=builder.as_markup()
         )
 
-@dp.callback_query(lambda c: c.data.startswith(('calendar_prev_', 'calendar_next_', 'calendar_today')))
-async def process_calendar_navigation(callback_query: types.CallbackQuery):
-    if callback_query.data.startswith('calendar_prev_'):
-        _, _, year, month = callback_query.data.split('_')
-        year, month = int(year), int(month)
-    elif callback_query.data.startswith('calendar_next_'):
-        _, _, year, month = callback_query.data.split('_')
-        year, month = int(year), int(month)
+@router.exact('calendar_today')
+@router.on(CalendarNav)
+async def process_calendar_navigation(callback_query: types.CallbackQuery, callback_data: CalendarNav = None):
+    if callback_data is not None:
+        year, month = callback_data.year, callback_data.month
     else:
         today = datetime.now()
         year, month = today.year, today.month
@@ -268,29 +373,104 @@ async def process_calendar_navigation(callback_query: types.CallbackQuery):
     )
     await callback_query.answer()
 
-async def show_records(date_str: str, records: list, message: types.Message, record_type: str):
+RECORDS_PAGE_SIZE = 10
+
+def page_flags(cursor_id, backward: bool, more: bool):
+    """Есть ли страницы до и после текущей при постраничной выборке по курсору"""
+    if cursor_id is None:
+        return False, more
+    if backward:
+        return more, True
+    return True, more
+
+async def load_records_page(mode: str, date_str: str, record_type: str, cursor_id: int = None, backward: bool = False):
+    """Загружает страницу записей за день и кнопки перехода к соседним страницам"""
+    rows, more = await get_sales_page(date_str, record_type, cursor_id, backward, RECORDS_PAGE_SIZE)
+    if not rows and cursor_id is not None:
+        return await load_records_page(mode, date_str, record_type)
+
+    has_prev, has_next = page_flags(cursor_id, backward, more)
+    nav = []
+    if rows and has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=RecordsPage(
+            mode=mode, date=date_str, record_type=record_type, cursor=rows[0][0], backward=True
+        ).pack()))
+    if rows and has_next:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=RecordsPage(
+            mode=mode, date=date_str, record_type=record_type, cursor=rows[-1][0], backward=False
+        ).pack()))
+    return rows, nav
+
+async def render_records(date_str: str, record_type: str, cursor_id: int = None, backward: bool = False):
+    """Текст и клавиатура списка записей за день; None, если записей нет"""
+    rows, nav = await load_records_page('show', date_str, record_type, cursor_id, backward)
+    if not rows:
+        return None
+
+    total, count = (await get_day_totals(date_str)).get(record_type, (0, 0))
+
     report = f"{'Закупки' if record_type == 'закупка' else 'Продажи'} за {date_str}\n\n"
-    total = 0
-    
-    for record in records:
+    for record in rows:
         record_id, user_tag, time, amount = record[0], record[2], record[3], record[4]
-        report += f"{record_id}. {user_tag}/{time}/{amount}\n"
-        try:
-            total += float(amount.replace('р', '').replace(',', '').strip())
-        except:
-            pass
+        report += f"{record_id}. {user_tag}/{time}/{format_amount(amount)}\n"
     
-    report += f"\nОбщая сумма: {int(total)}р"
+    report += f"\nОбщая сумма: {total // 100}р"
+    if count > len(rows):
+        report += f"\nВсего записей: {count}"
     
     keyboard = InlineKeyboardBuilder()
+    if nav:
+        keyboard.row(*nav)
     keyboard.row(
-        InlineKeyboardButton(text="✏️ Редактировать", callback_data=f"edit_records:{date_str}:{record_type}"),
-        InlineKeyboardButton(text="❌ Удалить", callback_data=f"delete_records:{date_str}:{record_type}")
+        InlineKeyboardButton(text="✏️ Редактировать", callback_data=EditRecords(date=date_str, record_type=record_type).pack()),
+        InlineKeyboardButton(text="❌ Удалить", callback_data=DeleteRecords(date=date_str, record_type=record_type).pack())
     )
+    return report, keyboard.as_markup()
+
+async def show_records(date_str: str, message: types.Message, record_type: str) -> bool:
+    """Отправляет первую страницу записей за день; возвращает False, если записей нет"""
+    rendered = await render_records(date_str, record_type)
+    if rendered is None:
+        return False
+    report, markup = rendered
+    await message.answer(report, reply_markup=markup)
+    return True
+
+async def render_record_picker(mode: str, date_str: str, record_type: str, cursor_id: int = None, backward: bool = False):
+    """Клавиатура выбора записи для редактирования (mode='edit') или удаления (mode='delete')"""
+    rows, nav = await load_records_page(mode, date_str, record_type, cursor_id, backward)
+    select = SelectRecord if mode == 'edit' else SelectDelete
+
+    keyboard = InlineKeyboardBuilder()
+    for record in rows:
+        record_id, user_tag, time, amount = record[0], record[2], record[3], record[4]
+        keyboard.row(InlineKeyboardButton(
+            text=f"{record_id}. {user_tag}/{time}/{format_amount(amount)}",
+            callback_data=select(record_id=record_id).pack()
+        ))
+    if nav:
+        keyboard.row(*nav)
     
-    await message.answer(report, reply_markup=keyboard.as_markup())
+    keyboard.row(InlineKeyboardButton(text="🔙 Назад", callback_data=BackToRecords(date=date_str, record_type=record_type).pack()))
+    return keyboard.as_markup()
+
+@router.on(RecordsPage)
+async def handle_records_page(callback_query: types.CallbackQuery, callback_data: RecordsPage):
+    if callback_data.mode == 'show':
+        rendered = await render_records(callback_data.date, callback_data.record_type, callback_data.cursor, callback_data.backward)
+        if rendered is None:
+            await callback_query.answer("Записей больше нет")
+            return
+        report, markup = rendered
+        await callback_query.message.edit_text(report, reply_markup=markup)
+    else:
+        markup = await render_record_picker(
+            callback_data.mode, callback_data.date, callback_data.record_type, callback_data.cursor, callback_data.backward
+        )
+        await callback_query.message.edit_reply_markup(reply_markup=markup)
+    await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data in ['sales', 'purchase', 'report'])
+@router.exact('sales', 'purchase', 'report')
 async def process_callback_button(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer()
     await state.update_data(action=callback_query.data)
@@ -299,17 +479,11 @@ async def process_callback_button(callback_query: types.CallbackQuery, state: FS
     formatted_today = today.strftime('%d.%m.%y')
 
     if callback_query.data == 'sales':
-        sales = get_sales_by_date(formatted_today, 'продажа')
-        if sales:
-            await show_records(formatted_today, sales, callback_query.message, 'продажа')
-        else:
+        if not await show_records(formatted_today, callback_query.message, 'продажа'):
             await callback_query.message.answer("Сегодня пока нет данных о продажах.")
 
     elif callback_query.data == 'purchase':
-        purchases = get_sales_by_date(formatted_today, 'закупка')
-        if purchases:
-            await show_records(formatted_today, purchases, callback_query.message, 'закупка')
-        else:
+        if not await show_records(formatted_today, callback_query.message, 'закупка'):
             await callback_query.message.answer("Сегодня пока нет данных о закупках.")
 
     elif callback_query.data == 'report':
@@ -320,42 +494,32 @@ async def process_callback_button(callback_query: types.CallbackQuery, state: FS
         reply_markup=create_calendar()
     )
 
-@dp.callback_query(lambda c: c.data.startswith('edit_records:'))
-async def handle_edit_records(callback_query: types.CallbackQuery, state: FSMContext):
-    _, date_str, record_type = callback_query.data.split(':')
-    records = get_sales_by_date(date_str, record_type)
-    
-    keyboard = InlineKeyboardBuilder()
-    for record in records:
-        record_id, user_tag, time, amount = record[0], record[2], record[3], record[4]
-        keyboard.row(InlineKeyboardButton(
-            text=f"{record_id}. {user_tag}/{time}/{amount}",
-            callback_data=f"select_record:{record_id}"
-        ))
-    
-    keyboard.row(InlineKeyboardButton(text="🔙 Назад", callback_data=f"back_to_{record_type}"))
+@router.on(EditRecords)
+async def handle_edit_records(callback_query: types.CallbackQuery, state: FSMContext, callback_data: EditRecords):
+    date_str, record_type = callback_data.date, callback_data.record_type
     
     await state.set_state(Form.waiting_for_record_selection)
     await state.update_data(record_type=record_type, date_str=date_str)
     
     await callback_query.message.edit_text(
         "Выберите запись для редактирования:",
-        reply_markup=keyboard.as_markup()
+        reply_markup=await render_record_picker('edit', date_str, record_type)
     )
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith('select_record:'))
-async def handle_select_record(callback_query: types.CallbackQuery, state: FSMContext):
-    record_id = int(callback_query.data.split(':')[1])
+@router.on(SelectRecord)
+async def handle_select_record(callback_query: types.CallbackQuery, state: FSMContext, callback_data: SelectRecord):
+    record_id = callback_data.record_id
     
     keyboard = InlineKeyboardBuilder()
     keyboard.row(
-        InlineKeyboardButton(text="✏️ Сумму", callback_data=f"edit_amount:{record_id}"),
-        InlineKeyboardButton(text="✏️ Время", callback_data=f"edit_time:{record_id}"),
-        InlineKeyboardButton(text="✏️ Username", callback_data=f"edit_user_tag:{record_id}"),
+        InlineKeyboardButton(text="✏️ Сумму", callback_data=EditAmount(record_id=record_id).pack()),
+        InlineKeyboardButton(text="✏️ Время", callback_data=EditTime(record_id=record_id).pack()),
+        InlineKeyboardButton(text="✏️ Username", callback_data=EditUserTag(record_id=record_id).pack()),
     )
     keyboard.row(
-        InlineKeyboardButton(text="❌ Удалить запись", callback_data=f"confirm_delete:{record_id}"),
+        InlineKeyboardButton(text="❌ Удалить запись", callback_data=ConfirmDelete(record_id=record_id).pack()),
+        InlineKeyboardButton(text="📜 История", callback_data=SaleHistory(record_id=record_id).pack()),
     )
     keyboard.row(
         InlineKeyboardButton(text="🔙 Назад", callback_data="cancel_edit")
@@ -364,16 +528,64 @@ async def handle_select_record(callback_query: types.CallbackQuery, state: FSMCo
     await state.set_state(Form.waiting_for_edit_choice)
     await state.update_data(record_id=record_id)
     
-    await callback_query.message.edit_text(
-        "Что вы хотите изменить?",
-        reply_markup=keyboard.as_markup()
-    )
+    if callback_query.message is None:
+        # Кнопка из инлайн-поиска: у такого сообщения нет чата, меню открываем в личке с ботом
+        await callback_query.bot.send_message(
+            callback_query.from_user.id,
+            "Что вы хотите изменить?",
+            reply_markup=keyboard.as_markup()
+        )
+    else:
+        await callback_query.message.edit_text(
+            "Что вы хотите изменить?",
+            reply_markup=keyboard.as_markup()
+        )
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith('confirm_delete:'))
-async def handle_confirm_delete(callback_query: types.CallbackQuery, state: FSMContext):
-    record_id = int(callback_query.data.split(':')[1])
-    record = get_sale_by_id(record_id)
+AUDIT_ACTIONS = {'add': "добавлена", 'import': "импортирована", 'update': "изменена", 'delete': "удалена"}
+AUDIT_FIELD_NAMES = {
+    'sale_type': "тип", 'user_tag': "username", 'time': "время", 'amount': "сумма", 'date': "дата", 'user_id': "оператор",
+}
+
+def _audit_value(field: str, value) -> str:
+    return format_amount(value) if field == 'amount' else str(value)
+
+def render_sale_history(record_id: int, history) -> str:
+    """Текст журнала изменений записи, время в местном часовом поясе"""
+    lines = [f"<b>История записи {record_id}</b>"]
+    for action, actor_id, changed_at, old, new in history:
+        when = datetime.fromisoformat(changed_at).replace(tzinfo=timezone.utc).astimezone()
+        line = f"\n{when:%d.%m.%y %H:%M} — {AUDIT_ACTIONS.get(action, action)} (ID {actor_id})"
+        if old and new:
+            changes = [
+                f"{AUDIT_FIELD_NAMES.get(field, field)}: {_audit_value(field, old[field])} → {_audit_value(field, new[field])}"
+                for field in new if old.get(field) != new[field]
+            ]
+            line += "\n" + "\n".join(changes)
+        else:
+            row = new or old
+            line += f"\n{row['sale_type']} {row['date']} {row['user_tag']}/{row['time']}/{format_amount(row['amount'])}"
+        lines.append(html.quote(line))
+    return "\n".join(lines)
+
+@router.on(SaleHistory)
+async def handle_sale_history(callback_query: types.CallbackQuery, callback_data: SaleHistory):
+    record_id = callback_data.record_id
+    history = await get_sale_history(record_id)
+    text = render_sale_history(record_id, history) if history else f"Для записи {record_id} изменений не найдено"
+
+    keyboard = InlineKeyboardBuilder()
+    keyboard.row(InlineKeyboardButton(text="🔙 Назад", callback_data=SelectRecord(record_id=record_id).pack()))
+    if callback_query.message is None:
+        await callback_query.bot.send_message(callback_query.from_user.id, text, reply_markup=keyboard.as_markup())
+    else:
+        await callback_query.message.edit_text(text, reply_markup=keyboard.as_markup())
+    await callback_query.answer()
+
+@router.on(ConfirmDelete)
+async def handle_confirm_delete(callback_query: types.CallbackQuery, state: FSMContext, callback_data: ConfirmDelete):
+    record_id = callback_data.record_id
+    record = await get_sale_by_id(record_id)
     
     if not record:
         await callback_query.answer("Запись не найдена")
@@ -381,7 +593,7 @@ async def handle_confirm_delete(callback_query: types.CallbackQuery, state: FSMC
     
     keyboard = InlineKeyboardBuilder()
     keyboard.row(
-        InlineKeyboardButton(text="✅ Да, удалить", callback_data=f"delete_record:{record_id}"),
+        InlineKeyboardButton(text="✅ Да, удалить", callback_data=DeleteRecord(record_id=record_id).pack()),
         InlineKeyboardButton(text="❌ Нет, отмена", callback_data="cancel_delete")
     )
     
@@ -395,18 +607,18 @@ async def handle_confirm_delete(callback_query: types.CallbackQuery, state: FSMC
         f"Дата: {record[5]}\n"
         f"Пользователь: {record[2]}\n"
         f"Время: {record[3]}\n"
-        f"Сумма: {record[4]}",
+        f"Сумма: {format_amount(record[4])}",
         reply_markup=keyboard.as_markup()
     )
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith('delete_record:'))
-async def handle_delete_record(callback_query: types.CallbackQuery, state: FSMContext):
-    record_id = int(callback_query.data.split(':')[1])
-    record = get_sale_by_id(record_id)
+@router.on(DeleteRecord)
+async def handle_delete_record(callback_query: types.CallbackQuery, state: FSMContext, callback_data: DeleteRecord):
+    record_id = callback_data.record_id
+    record = await get_sale_by_id(record_id)
     
     if record:
-        delete_sale(record_id)
+        await delete_sale(record_id, actor_id=callback_query.from_user.id)
         await callback_query.message.edit_text(f"Запись {record_id} успешно удалена")
     else:
         await callback_query.message.edit_text("Ошибка: запись не найдена")
@@ -414,7 +626,7 @@ async def handle_delete_record(callback_query: types.CallbackQuery, state: FSMCo
     await state.clear()
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data == 'cancel_delete')
+@router.exact('cancel_delete')
 async def handle_cancel_delete(callback_query: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     record_id = data.get('record_id')
@@ -422,12 +634,12 @@ async def handle_cancel_delete(callback_query: types.CallbackQuery, state: FSMCo
     if record_id:
         keyboard = InlineKeyboardBuilder()
         keyboard.row(
-            InlineKeyboardButton(text="✏️ Сумму", callback_data=f"edit_amount:{record_id}"),
-            InlineKeyboardButton(text="✏️ Время", callback_data=f"edit_time:{record_id}"),
-            InlineKeyboardButton(text="✏️ Username", callback_data=f"edit_user_tag:{record_id}"),
+            InlineKeyboardButton(text="✏️ Сумму", callback_data=EditAmount(record_id=record_id).pack()),
+            InlineKeyboardButton(text="✏️ Время", callback_data=EditTime(record_id=record_id).pack()),
+            InlineKeyboardButton(text="✏️ Username", callback_data=EditUserTag(record_id=record_id).pack()),
         )
         keyboard.row(
-            InlineKeyboardButton(text="❌ Удалить запись", callback_data=f"confirm_delete:{record_id}"),
+            InlineKeyboardButton(text="❌ Удалить запись", callback_data=ConfirmDelete(record_id=record_id).pack()),
         )
         keyboard.row(
             InlineKeyboardButton(text="🔙 Назад", callback_data="cancel_edit")
@@ -441,10 +653,9 @@ async def handle_cancel_delete(callback_query: types.CallbackQuery, state: FSMCo
     await state.set_state(Form.waiting_for_edit_choice)
     await callback_query.answer("Удаление отменено")
 
-@dp.callback_query(lambda c: c.data.startswith('edit_user_tag:'))
-async def handle_edit_user_tag_choice(callback_query: types.CallbackQuery, state: FSMContext):
-    _, record_id = callback_query.data.split(':')
-    record_id = int(record_id)
+@router.on(EditUserTag)
+async def handle_edit_user_tag_choice(callback_query: types.CallbackQuery, state: FSMContext, callback_data: EditUserTag):
+    record_id = callback_data.record_id
     
     await state.set_state(Form.waiting_for_edit_user_tag)
     await state.update_data(record_id=record_id)
@@ -457,22 +668,26 @@ async def process_new_user_tag(message: types.Message, state: FSMContext):
     record_id = data['record_id']
     
     if message.text.startswith('@') and len(message.text) > 1:
-        update_sale(record_id, user_tag=message.text)
+        try:
+            await update_sale(record_id, actor_id=message.from_user.id, user_tag=message.text)
+        except sqlite3.IntegrityError:
+            await message.answer("Такая запись уже существует. Введите другой username.")
+            return
         await message.answer("Username успешно обновлен")
         await state.clear()
     else:
         await message.answer("Неверный формат username. Должен начинаться с @ и содержать имя пользователя. Попробуйте еще раз.")
         
-@dp.callback_query(lambda c: c.data.startswith(('edit_amount:', 'edit_time:')))
-async def handle_edit_choice(callback_query: types.CallbackQuery, state: FSMContext):
-    action, record_id = callback_query.data.split(':')
-    record_id = int(record_id)
+@router.on(EditAmount)
+@router.on(EditTime)
+async def handle_edit_choice(callback_query: types.CallbackQuery, state: FSMContext, callback_data):
+    record_id = callback_data.record_id
     
-    if action == 'edit_amount':
+    if isinstance(callback_data, EditAmount):
         await state.set_state(Form.waiting_for_edit_amount)
         await state.update_data(record_id=record_id)
         await callback_query.message.answer("Введите новую сумму:")
-    elif action == 'edit_time':
+    else:
         await state.set_state(Form.waiting_for_edit_time)
         await state.update_data(record_id=record_id)
         await callback_query.message.answer("Введите новое время (формат ЧЧ:ММ):")
@@ -485,93 +700,74 @@ async def process_new_amount(message: types.Message, state: FSMContext):
     record_id = data['record_id']
     
     try:
-        new_amount = message.text.replace('р', '').replace(',', '').strip()
-        float(new_amount)
-        update_sale(record_id, amount=new_amount)
+        new_amount = parse_amount(message.text)
+        await update_sale(record_id, actor_id=message.from_user.id, amount=new_amount)
         await message.answer("Сумма успешно обновлена")
         await state.clear()
     except ValueError:
         await message.answer("Неверный формат суммы. Попробуйте еще раз.")
+    except sqlite3.IntegrityError:
+        await message.answer("Такая запись уже существует. Введите другую сумму.")
 
 @dp.message(Form.waiting_for_edit_time)
 async def process_new_time(message: types.Message, state: FSMContext):
     data = await state.get_data()
     record_id = data['record_id']
     
-    if re.match(r'^\d{2}:\d{2}$', message.text):
-        update_sale(record_id, time=message.text)
-        await message.answer("Время успешно обновлено")
-        await state.clear()
-    else:
+    try:
+        new_time = parse_time((message.text or '').strip())
+    except ValueError:
         await message.answer("Неверный формат времени. Используйте ЧЧ:ММ (например, 14:30)")
+        return
 
-async def generate_report(message: types.Message, date_str: str, state: FSMContext):
-    sales = get_sales_by_date(date_str, 'продажа')
-    purchases = get_sales_by_date(date_str, 'закупка')
-
-    total_sales = sum([float(s[4].replace('р', '').replace(',', '').strip()) for s in sales if s[4]]) if sales else 0
-    total_purchases = sum([float(p[4].replace('р', '').replace(',', '').strip()) for p in purchases if p[4]]) if purchases else 0
-
-    admin_percent = round(total_sales * 0.15)
-    card_fee = 100
-    day_total = int(total_sales - total_purchases - admin_percent - card_fee)
-
-    report = (
-        f"<b>Отчетность за {date_str}г</b>\n"
-        f"1. Сумма продаж : {int(total_sales)}р\n"
-        f"2. Покупка рекламы : {int(total_purchases)}р\n"
-        f"3. Процент админа : {admin_percent}р\n"
-        f"4. Контенщик : - \n"
-        f"5. Карта : - {card_fee}р\n\n"
-        f"<b>ИТОГ ДНЯ : {day_total}р</b>"
-    )
+    try:
+        await update_sale(record_id, actor_id=message.from_user.id, time=new_time)
+    except sqlite3.IntegrityError:
+        await message.answer("Такая запись уже существует. Введите другое время.")
+        return
+    await message.answer("Время успешно обновлено")
+    await state.clear()
 
+def report_keyboard(edited: bool = False) -> InlineKeyboardMarkup:
     keyboard = InlineKeyboardBuilder()
     keyboard.row(
-        InlineKeyboardButton(text="✏️ Продажи", callback_data="edit_report_sales"),
-        InlineKeyboardButton(text="✏️ Закупки", callback_data="edit_report_purchases")
+        InlineKeyboardButton(text="✏️ Продажи", callback_data=EditReport(field='sales').pack()),
+        InlineKeyboardButton(text="✏️ Закупки", callback_data=EditReport(field='purchases').pack())
     )
     keyboard.row(
-        InlineKeyboardButton(text="✏️ % Админа", callback_data="edit_report_admin"),
-        InlineKeyboardButton(text="✏️ Карта", callback_data="edit_report_card")
+        InlineKeyboardButton(text="✏️ % Админа", callback_data=EditReport(field='admin').pack()),
+        InlineKeyboardButton(text="✏️ Карта", callback_data=EditReport(field='card').pack())
     )
     keyboard.row(
         InlineKeyboardButton(text="🔄 Обновить", callback_data="update_report"),
         InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_menu")
     )
+    if edited:
+        keyboard.row(InlineKeyboardButton(text="↩️ Сбросить правки", callback_data="reset_report"))
+    return keyboard.as_markup()
 
-    await state.update_data(
-        current_sales=total_sales,
-        current_purchases=total_purchases,
-        current_admin=admin_percent,
-        current_card=card_fee,
-        report_date=date_str
-    )
-
-    await message.answer(report, reply_markup=keyboard.as_markup())
-
-@dp.callback_query(lambda c: c.data.startswith('calendar_day_'))
-async def process_calendar(callback_query: types.CallbackQuery, state: FSMContext):
+async def generate_report(message: types.Message, date_str: str, state: FSMContext):
+    # Закрытые дни отдаются из снимка, посчитанного планировщиком или первым запросом;
+    # ручные правки хранятся в базе и уже учтены в отчете
+    report, figures = await get_day_report(date_str)
+    await state.update_data(report_date=date_str)
+    await message.answer(report, reply_markup=report_keyboard(figures['edited']))
+
+@router.on(CalendarDay)
+async def process_calendar(callback_query: types.CallbackQuery, state: FSMContext, callback_data: CalendarDay):
     try:
-        date_str = callback_query.data.split('_')[2]
-        selected_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+        selected_date = datetime.strptime(callback_data.date, "%Y-%m-%d").date()
         formatted_date = selected_date.strftime('%d.%m.%y')
         
         data = await state.get_data()
         action = data.get('action')
         
         if action == 'sales':
-            sales = get_sales_by_date(formatted_date, 'продажа')
-            if sales:
-                await show_records(formatted_date, sales, callback_query.message, 'продажа')
-            else:
+            if not await show_records(formatted_date, callback_query.message, 'продажа'):
                 await callback_query.message.answer(f"Нет данных о продажах за {formatted_date}")
 
         elif action == 'purchase':
-            purchases = get_sales_by_date(formatted_date, 'закупка')
-            if purchases:
-                await show_records(formatted_date, purchases, callback_query.message, 'закупка')
-            else:
+            if not await show_records(formatted_date, callback_query.message, 'закупка'):
                 await callback_query.message.answer(f"Нет данных о закупках за {formatted_date}")
 
         elif action == 'report':
@@ -593,36 +789,28 @@ async def process_calendar(callback_query: types.CallbackQuery, state: FSMContex
         logging.error(f"Ошибка при обработке календаря: {e}")
         await callback_query.answer("Произошла ошибка, попробуйте еще раз")
 
-@dp.callback_query(lambda c: c.data == 'cancel_edit')
+@router.exact('cancel_edit')
 async def handle_cancel_edit(callback_query: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback_query.message.delete()
     await callback_query.answer("Редактирование отменено")
 
-@dp.callback_query(lambda c: c.data.startswith('back_to_'))
-async def handle_back_to_records(callback_query: types.CallbackQuery, state: FSMContext):
-    record_type = callback_query.data.split('_')[-1]
-    today = datetime.now().date()
-    formatted_today = today.strftime('%d.%m.%y')
+@router.on(BackToRecords)
+async def handle_back_to_records(callback_query: types.CallbackQuery, state: FSMContext, callback_data: BackToRecords):
+    date_str, record_type = callback_data.date, callback_data.record_type
+    await state.clear()
     
-    if record_type == 'sales':
-        sales = get_sales_by_date(formatted_today, 'продажа')
-        if sales:
-            await show_records(formatted_today, sales, callback_query.message, 'продажа')
-        else:
-            await callback_query.message.answer("Сегодня пока нет данных о продажах.")
-    elif record_type == 'purchase':
-        purchases = get_sales_by_date(formatted_today, 'закупка')
-        if purchases:
-            await show_records(formatted_today, purchases, callback_query.message, 'закупка')
+    if not await show_records(date_str, callback_query.message, record_type):
+        if record_type == 'продажа':
+            await callback_query.message.answer(f"Нет данных о продажах за {date_str}")
         else:
-            await callback_query.message.answer("Сегодня пока нет данных о закупках.")
+            await callback_query.message.answer(f"Нет данных о закупках за {date_str}")
     
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith('edit_report_'))
-async def handle_edit_report(callback_query: types.CallbackQuery, state: FSMContext):
-    action = callback_query.data.split('_')[-1]
+@router.on(EditReport)
+async def handle_edit_report(callback_query: types.CallbackQuery, state: FSMContext, callback_data: EditReport):
+    action = callback_data.field
     
     if action == 'sales':
         await state.set_state(Form.waiting_for_edit_sales)
@@ -639,90 +827,57 @@ async def handle_edit_report(callback_query: types.CallbackQuery, state: FSMCont
     
     await callback_query.answer()
 
-@dp.message(Form.waiting_for_edit_sales)
-async def process_new_sales(message: types.Message, state: FSMContext):
+async def save_report_field(message: types.Message, state: FSMContext, field: str, done_text: str):
+    """Сохраняет ручную правку поля отчета за день и показывает пересчитанный отчет"""
     try:
-        new_sales = float(message.text.replace('р', '').replace(',', '').strip())
-        await state.update_data(current_sales=new_sales)
-        await message.answer(f"Сумма продаж обновлена: {int(new_sales)}р")
-        await show_updated_report(message, state)
+        amount = parse_amount(message.text)
     except ValueError:
         await message.answer("Неверный формат суммы. Попробуйте еще раз.")
+        return
+
+    data = await state.get_data()
+    date_str = data.get('report_date', datetime.now().strftime('%d.%m.%y'))
+    await set_report_override(date_str, **{field: amount})
+    await message.answer(f"{done_text}: {format_amount(amount)}р")
+    await show_updated_report(message, state)
+
+@dp.message(Form.waiting_for_edit_sales)
+async def process_new_sales(message: types.Message, state: FSMContext):
+    await save_report_field(message, state, 'sales', "Сумма продаж обновлена")
 
 @dp.message(Form.waiting_for_edit_purchases)
 async def process_new_purchases(message: types.Message, state: FSMContext):
-    try:
-        new_purchases = float(message.text.replace('р', '').replace(',', '').strip())
-        await state.update_data(current_purchases=new_purchases)
-        await message.answer(f"Сумма закупок обновлена: {int(new_purchases)}р")
-        await show_updated_report(message, state)
-    except ValueError:
-        await message.answer("Неверный формат суммы. Попробуйте еще раз.")
+    await save_report_field(message, state, 'purchases', "Сумма закупок обновлена")
 
 @dp.message(Form.waiting_for_edit_admin)
 async def process_new_admin(message: types.Message, state: FSMContext):
-    try:
-        new_admin = float(message.text.replace('р', '').replace(',', '').strip())
-        await state.update_data(current_admin=new_admin)
-        await message.answer(f"Процент админа обновлен: {int(new_admin)}р")
-        await show_updated_report(message, state)
-    except ValueError:
-        await message.answer("Неверный формат суммы. Попробуйте еще раз.")
+    await save_report_field(message, state, 'admin', "Процент админа обновлен")
 
 @dp.message(Form.waiting_for_edit_card)
 async def process_new_card(message: types.Message, state: FSMContext):
-    try:
-        new_card = float(message.text.replace('р', '').replace(',', '').strip())
-        await state.update_data(current_card=new_card)
-        await message.answer(f"Комиссия карты обновлена: {int(new_card)}р")
-        await show_updated_report(message, state)
-    except ValueError:
-        await message.answer("Неверный формат суммы. Попробуйте еще раз.")
+    await save_report_field(message, state, 'card', "Комиссия карты обновлена")
 
 async def show_updated_report(message: types.Message, state: FSMContext):
     data = await state.get_data()
-    
-    total_sales = data.get('current_sales', 0)
-    total_purchases = data.get('current_purchases', 0)
-    admin_percent = data.get('current_admin', round(total_sales * 0.15))
-    card_fee = data.get('current_card', 100)
     date_str = data.get('report_date', datetime.now().strftime('%d.%m.%y'))
-    day_total = int(total_sales - total_purchases - admin_percent - card_fee)
-
-    report = (
-        f"<b>Отчетность за {date_str}г</b>\n"
-        f"1. Сумма продаж : {int(total_sales)}р\n"
-        f"2. Покупка рекламы : {int(total_purchases)}р\n"
-        f"3. Процент админа : {admin_percent}р\n"
-        f"4. Контенщик : - \n"
-        f"5. Карта : - {card_fee}р\n\n"
-        f"<b>ИТОГ ДНЯ : {day_total}р</b>"
-    )
+    await generate_report(message, date_str, state)
 
-    keyboard = InlineKeyboardBuilder()
-    keyboard.row(
-        InlineKeyboardButton(text="✏️ Продажи", callback_data="edit_report_sales"),
-        InlineKeyboardButton(text="✏️ Закупки", callback_data="edit_report_purchases")
-    )
-    keyboard.row(
-        InlineKeyboardButton(text="✏️ % Админа", callback_data="edit_report_admin"),
-        InlineKeyboardButton(text="✏️ Карта", callback_data="edit_report_card")
-    )
-    keyboard.row(
-        InlineKeyboardButton(text="🔄 Обновить", callback_data="update_report"),
-        InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_menu")
-    )
-
-    await message.answer(report, reply_markup=keyboard.as_markup())
-
-@dp.callback_query(lambda c: c.data == 'update_report')
+@router.exact('update_report')
 async def handle_update_report(callback_query: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
     date_str = data.get('report_date', datetime.now().strftime('%d.%m.%y'))
     await generate_report(callback_query.message, date_str, state)
     await callback_query.answer("Отчет обновлен")
 
-@dp.callback_query(lambda c: c.data == 'reload')
+@router.exact('reset_report')
+async def handle_reset_report(callback_query: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    date_str = data.get('report_date', datetime.now().strftime('%d.%m.%y'))
+    await clear_report_overrides(date_str)
+    await generate_report(callback_query.message, date_str, state)
+    await callback_query.answer("Правки сброшены")
+
+@router.exact('reload')
 async def reload_handler(callback_query: types.CallbackQuery):
     builder = InlineKeyboardBuilder()
     builder.row(
@@ -741,7 +896,7 @@ async def reload_handler(callback_query: types.CallbackQuery):
         logging.error(f"Ошибка при перезагрузке: {str(e)}")
         await callback_query.answer("Произошла ошибка, попробуйте еще раз")
 
-@dp.callback_query(lambda c: c.data == 'back_to_menu')
+@router.exact('back_to_menu')
 async def back_to_menu_handler(callback_query: types.CallbackQuery, state: FSMContext):
     try:
         await state.clear()
@@ -771,34 +926,23 @@ async def back_to_menu_handler(callback_query: types.CallbackQuery, state: FSMCo
         logging.error(f"Ошибка в back_to_menu_handler: {e}")
         await callback_query.answer("Произошла ошибка, попробуйте еще раз")
 
-@dp.callback_query(lambda c: c.data.startswith('delete_records:'))
-async def handle_delete_records(callback_query: types.CallbackQuery, state: FSMContext):
-    _, date_str, record_type = callback_query.data.split(':')
-    records = get_sales_by_date(date_str, record_type)
-    
-    keyboard = InlineKeyboardBuilder()
-    for record in records:
-        record_id, user_tag, time, amount = record[0], record[2], record[3], record[4]
-        keyboard.row(InlineKeyboardButton(
-            text=f"{record_id}. {user_tag}/{time}/{amount}",
-            callback_data=f"select_delete:{record_id}"
-        ))
-    
-    keyboard.row(InlineKeyboardButton(text="🔙 Назад", callback_data=f"back_to_{record_type}"))
+@router.on(DeleteRecords)
+async def handle_delete_records(callback_query: types.CallbackQuery, state: FSMContext, callback_data: DeleteRecords):
+    date_str, record_type = callback_data.date, callback_data.record_type
     
     await state.set_state(Form.waiting_for_record_selection)
     await state.update_data(record_type=record_type, date_str=date_str)
     
     await callback_query.message.edit_text(
         "Выберите запись для удаления:",
-        reply_markup=keyboard.as_markup()
+        reply_markup=await render_record_picker('delete', date_str, record_type)
     )
     await callback_query.answer()
 
-@dp.callback_query(lambda c: c.data.startswith('select_delete:'))
-async def handle_select_delete(callback_query: types.CallbackQuery, state: FSMContext):
-    record_id = int(callback_query.data.split(':')[1])
-    record = get_sale_by_id(record_id)
+@router.on(SelectDelete)
+async def handle_select_delete(callback_query: types.CallbackQuery, state: FSMContext, callback_data: SelectDelete):
+    record_id = callback_data.record_id
+    record = await get_sale_by_id(record_id)
     
     if not record:
         await callback_query.answer("Запись не найдена")
@@ -806,7 +950,7 @@ async def handle_select_delete(callback_query: types.CallbackQuery, state: FSMCo
     
     keyboard = InlineKeyboardBuilder()
     keyboard.row(
-        InlineKeyboardButton(text="✅ Да, удалить", callback_data=f"delete_record:{record_id}"),
+        InlineKeyboardButton(text="✅ Да, удалить", callback_data=DeleteRecord(record_id=record_id).pack()),
         InlineKeyboardButton(text="❌ Нет, отмена", callback_data="cancel_delete")
     )
     
@@ -820,15 +964,199 @@ async def handle_select_delete(callback_query: types.CallbackQuery, state: FSMCo
         f"Дата: {record[5]}\n"
         f"Пользователь: {record[2]}\n"
         f"Время: {record[3]}\n"
-        f"Сумма: {record[4]}",
+        f"Сумма: {format_amount(record[4])}",
         reply_markup=keyboard.as_markup()
     )
     await callback_query.answer()
 
+@dp.message(Command("import"), F.document)
+@dp.message(Form.waiting_for_import_file, F.document)
+async def process_import_file(message: types.Message, state: FSMContext):
+    await state.clear()
+    suffix = Path(message.document.file_name or '').suffix.lower() or '.txt'
+    await message.answer("Импорт начался, это может занять немного времени...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / f"import{suffix}"
+        await bot.download(message.document, destination=path)
+        try:
+            result = await import_file(path, default_user_id=message.from_user.id)
+        except (ValueError, RuntimeError) as e:
+            await message.answer(f"Не удалось импортировать файл: {e}")
+            return
+
+    await message.answer(f"<b>Импорт завершен</b>\n{html.quote(result.summary())}")
+
+@dp.message(Command("import"))
+async def handle_import_command(message: types.Message, state: FSMContext):
+    await state.set_state(Form.waiting_for_import_file)
+    await message.answer(
+        "Отправьте файл для импорта:\n"
+        "• .txt - по строке на запись: #продажа/10.04.25/@username/10:00/7000р\n"
+        "• .csv или .xlsx - столбцы sale_type, date, user_tag, time, amount"
+    )
+
+EXPORT_USAGE = (
+    "Использование: /export dd.mm.yy dd.mm.yy [продажа|закупка|все|отчет] [csv|xlsx]\n"
+    "Например: /export 01.04.25 30.04.25 все xlsx"
+)
+
+@dp.message(Command("export"))
+async def handle_export(message: types.Message, command: CommandObject):
+    args = (command.args or '').split()
+    if len(args) < 2:
+        await message.answer(EXPORT_USAGE)
+        return
+
+    start_date, end_date = args[0], args[1]
+    kind = args[2].lower() if len(args) > 2 else 'все'
+    fmt = args[3].lower() if len(args) > 3 else 'xlsx'
+    try:
+        if parse_date(start_date) > parse_date(end_date):
+            raise ValueError("начало периода позже конца")
+    except ValueError as e:
+        await message.answer(f"Неверный период: {e}\n\n{EXPORT_USAGE}")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = f"{kind}_{start_date}-{end_date}.{fmt}"
+        path = Path(tmp_dir) / filename
+        try:
+            await export_file(path, start_date, end_date, kind, fmt)
+        except (ValueError, RuntimeError) as e:
+            await message.answer(f"Не удалось выгрузить: {e}\n\n{EXPORT_USAGE}")
+            return
+        # Файл отправляется с диска по частям, а не целиком из памяти
+        await message.answer_document(
+            types.FSInputFile(path, filename=filename),
+            caption=f"Выгрузка за {start_date} - {end_date}"
+        )
+
+TOP_USAGE = (
+    "Использование: /top [сегодня|месяц|dd.mm.yy [dd.mm.yy]] [N]\n"
+    "Без периода - текущий месяц, N - сколько покупателей показать (по умолчанию 10)"
+)
+
+def parse_top_period(args):
+    """Период и размер топа из аргументов /top; даты в формате dd.mm.yy"""
+    limit = 10
+    if args and args[-1].isdigit():
+        limit = max(1, min(int(args.pop()), 50))
+
+    today = datetime.now().date()
+    if not args or args == ['месяц']:
+        start = today.replace(day=1)
+        end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    elif args in (['сегодня'], ['день']):
+        start = end = today
+    elif len(args) <= 2:
+        try:
+            start = parse_date(args[0])
+            end = parse_date(args[-1])
+        except ValueError:
+            raise ValueError("даты нужны в формате dd.mm.yy")
+        if start > end:
+            raise ValueError("начало периода позже конца")
+    else:
+        raise ValueError("слишком много аргументов")
+    return start.strftime('%d.%m.%y'), end.strftime('%d.%m.%y'), limit
+
+@dp.message(Command("top"))
+async def handle_top(message: types.Message, command: CommandObject):
+    try:
+        start_date, end_date, limit = parse_top_period((command.args or '').lower().split())
+    except ValueError as e:
+        await message.answer(f"Неверный период: {e}\n\n{TOP_USAGE}")
+        return
+    await message.answer(await build_leaderboard(start_date, end_date, limit))
+
+async def render_find_results(query_text: str, cursor_id: int = None, backward: bool = False):
+    """Текст и клавиатура страницы результатов поиска; кнопки ведут в меню записи"""
+    filters = parse_search_query(query_text)
+    rows, more = await search_sales(cursor_id=cursor_id, backward=backward, limit=FIND_PAGE_SIZE, **filters)
+    if not rows and cursor_id is not None:
+        return await render_find_results(query_text)
+    if not rows:
+        return f"По запросу «{html.quote(query_text)}» ничего не найдено", None
+
+    keyboard = InlineKeyboardBuilder()
+    for record in rows:
+        keyboard.row(InlineKeyboardButton(
+            text=describe_record(record),
+            callback_data=SelectRecord(record_id=record[0]).pack()
+        ))
+
+    has_prev, has_next = page_flags(cursor_id, backward, more)
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=FindPage(cursor=rows[0][0], backward=True).pack()))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=FindPage(cursor=rows[-1][0], backward=False).pack()))
+    if nav:
+        keyboard.row(*nav)
+    return f"Результаты поиска «{html.quote(query_text)}»:", keyboard.as_markup()
+
+@dp.message(Command("find"))
+async def handle_find(message: types.Message, command: CommandObject, state: FSMContext):
+    query_text = (command.args or '').strip()
+    if not query_text:
+        await message.answer(html.quote(SEARCH_HELP))
+        return
+    try:
+        text, markup = await render_find_results(query_text)
+    except ValueError as e:
+        await message.answer(html.quote(f"{e}\n\n{SEARCH_HELP}"))
+        return
+    await state.update_data(find_query=query_text)
+    await message.answer(text, reply_markup=markup)
+
+@router.on(FindPage)
+async def handle_find_page(callback_query: types.CallbackQuery, state: FSMContext, callback_data: FindPage):
+    query_text = (await state.get_data()).get('find_query')
+    if not query_text:
+        await callback_query.answer("Поиск устарел, повторите /find")
+        return
+    text, markup = await render_find_results(query_text, callback_data.cursor, callback_data.backward)
+    await callback_query.message.edit_text(text, reply_markup=markup)
+    await callback_query.answer()
+
+@router.exact('ignore')
+async def handle_ignore(callback_query: types.CallbackQuery):
+    await callback_query.answer()
+
+# Все callback-запросы проходят через один обработчик с таблицей маршрутов
+dp.callback_query.register(router.dispatch)
+
+@dp.startup()
+async def on_startup():
+    await init_db()
+    scheduler.start()
+    if metrics_server is not None:
+        await metrics_server.start()
+
+@dp.shutdown()
+async def on_shutdown():
+    await scheduler.stop()
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await close_db()
+
 async def main():
     await dp.start_polling(bot)
 
 if __name__ == '__main__':
-    import asyncio
-    init_db()
-    asyncio.run(main())
\ No newline at end of file
+    import sys
+    # По умолчанию long polling; вебхук: python main.py --webhook или USE_WEBHOOK = True в config.py
+    if '--webhook' in sys.argv[1:] or getattr(config, 'USE_WEBHOOK', False):
+        from webhook import run_webhook
+        run_webhook(
+            dp, bot,
+            host=getattr(config, 'WEBHOOK_HOST', '127.0.0.1'),
+            port=getattr(config, 'WEBHOOK_PORT', 8080),
+            path=getattr(config, 'WEBHOOK_PATH', '/webhook'),
+            webhook_url=getattr(config, 'WEBHOOK_URL', None),
+            secret_token=getattr(config, 'WEBHOOK_SECRET', None),
+            max_concurrency=getattr(config, 'WEBHOOK_MAX_CONCURRENCY', 64),
+        )
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""Служебные команды для базы продаж.
+
+Примеры:
+    python manage.py init-db
+    python manage.py rebuild-totals
+    python manage.py import sales_2024.xlsx --user-id 12345
+    python manage.py export 01.01.24 31.12.24 --kind все --format xlsx --out sales_2024.xlsx
+    python manage.py rates --from 01.05.25 --admin-rate 0.2 --card-fee 150
+    python manage.py quarantine
+    python manage.py quarantine --restore 3 --amount 7000 --date 10.04.25
+"""
+import argparse
+import logging
+
+import database
+import exporter
+import importer
+from parsing import format_amount, parse_amount
+
+def cmd_init_db(args):
+    database.init_db()
+    print("База данных инициализирована")
+
+def cmd_rebuild_totals(args):
+    database.init_db()
+    database.rebuild_daily_totals()
+    print("Дневные итоги пересчитаны")
+
+def cmd_import(args):
+    database.init_db()
+    result = importer.import_file(args.file, default_user_id=args.user_id)
+    print(result.summary())
+
+def cmd_export(args):
+    database.init_db()
+    out = args.out or f"export_{args.kind}_{args.start}_{args.end}.{args.format}"
+    exporter.export_file(out, args.start, args.end, args.kind, args.format)
+    print(f"Выгружено в {out}")
+
+def cmd_rates(args):
+    database.init_db()
+    if args.start:
+        if args.admin_rate is None or args.card_fee is None:
+            raise SystemExit("Для --from нужны --admin-rate и --card-fee")
+        database.set_report_settings(args.start, args.admin_rate, parse_amount(args.card_fee))
+    for start_date, admin_rate, card_fee in database.get_report_settings():
+        print(f"с {start_date}: процент админа {admin_rate:g}, карта {format_amount(card_fee)}р/день")
+
+def cmd_quarantine(args):
+    database.init_db()
+    if args.restore is not None:
+        amount = parse_amount(args.amount) if args.amount is not None else None
+        try:
+            result = database.restore_quarantined_sale(args.restore, amount=amount, date=args.date)
+        except ValueError as e:
+            raise SystemExit(f"{e}; укажите --amount и/или --date")
+        if result is None:
+            raise SystemExit(f"Отложенной записи {args.restore} нет")
+        sale_id, created = result
+        print(f"Запись возвращена под ID {sale_id}" if created else f"Такая запись уже есть (ID {sale_id}), отложенная удалена")
+        return
+    rows = database.get_quarantined_sales()
+    for quarantine_id, sale_id, sale_type, user_tag, time, amount, raw_amount, date, user_id, reason, _ in rows:
+        shown = format_amount(amount) if amount is not None else raw_amount
+        print(f"{quarantine_id}. (было ID {sale_id}) {sale_type}/{date}/{user_tag}/{time}/{shown} - {reason}")
+    if not rows:
+        print("Отложенных записей нет")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Служебные команды для базы продаж")
+    parser.add_argument('--db', default=database.DATABASE_NAME, help="путь к файлу базы")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('init-db', help="создать базу и применить миграции").set_defaults(func=cmd_init_db)
+    commands.add_parser('rebuild-totals', help="пересчитать таблицу daily_totals").set_defaults(func=cmd_rebuild_totals)
+
+    import_parser = commands.add_parser('import', help="импортировать записи из .txt, .csv или .xlsx")
+    import_parser.add_argument('file')
+    import_parser.add_argument('--user-id', type=int, default=0, help="user_id для строк, где он не указан")
+    import_parser.set_defaults(func=cmd_import)
+
+    export_parser = commands.add_parser('export', help="выгрузить записи и отчет за период")
+    export_parser.add_argument('start', help="начало периода, dd.mm.yy")
+    export_parser.add_argument('end', help="конец периода, dd.mm.yy")
+    export_parser.add_argument('--kind', default='все', choices=['продажа', 'закупка', 'все', 'отчет'])
+    export_parser.add_argument('--format', default='xlsx', choices=['csv', 'xlsx'])
+    export_parser.add_argument('--out', help="файл для выгрузки")
+    export_parser.set_defaults(func=cmd_export)
+
+    rates_parser = commands.add_parser('rates', help="показать или задать ставки отчета (процент админа, карта)")
+    rates_parser.add_argument('--from', dest='start', help="дата начала действия ставок, dd.mm.yy")
+    rates_parser.add_argument('--admin-rate', type=float, help="доля продаж для админа, например 0.15")
+    rates_parser.add_argument('--card-fee', help="комиссия карты в рублях за день")
+    rates_parser.set_defaults(func=cmd_rates)
+
+    quarantine_parser = commands.add_parser('quarantine', help="показать записи, отложенные миграциями, или вернуть одну из них")
+    quarantine_parser.add_argument('--restore', type=int, metavar='ID', help="вернуть отложенную запись в sales")
+    quarantine_parser.add_argument('--amount', help="исправленная сумма, например 7000 или 7000.50")
+    quarantine_parser.add_argument('--date', help="исправленная дата, dd.mm.yy")
+    quarantine_parser.set_defaults(func=cmd_quarantine)
+
+    args = parser.parse_args(argv)
+    database.DATABASE_NAME = args.db
+    try:
+        args.func(args)
+    finally:
+        database.close_db()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,61 @@
+"""Отправка файлов с кэшированием file_id.
+
+Файл загружается в Telegram один раз, полученный file_id сохраняется в базе
+по пути и хэшу содержимого. Следующие отправки идут по file_id; если файл
+на диске изменился, он загружается заново.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Tuple
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+# path -> (mtime_ns, size, sha256), чтобы не перечитывать файл, пока он не изменился
+_hashes: Dict[str, Tuple[int, int, str]] = {}
+
+def _file_hash(path: str) -> str:
+    stat = os.stat(path)
+    cached = _hashes.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    _hashes[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+    return _hashes[path][2]
+
+def _sent_file_id(message: types.Message, kind: str) -> str:
+    if kind == 'photo':
+        return message.photo[-1].file_id
+    return getattr(message, kind).file_id
+
+async def send_cached(
+    send: Callable[..., Awaitable[types.Message]],
+    kind: str,
+    path,
+    **kwargs,
+) -> types.Message:
+    """Отправляет файл через send (например, message.reply_photo) с параметром kind ('photo', 'document', ...)"""
+    path = str(Path(path).absolute())
+    sha256 = await asyncio.to_thread(_file_hash, path)
+
+    file_id = await storage.get_media_file_id(path, kind, sha256)
+    if file_id:
+        try:
+            return await send(**{kind: file_id}, **kwargs)
+        except TelegramBadRequest as e:
+            logger.warning("file_id для %s больше не действует: %s", path, e)
+            await storage.delete_media_file_id(path, kind)
+
+    sent = await send(**{kind: types.FSInputFile(path)}, **kwargs)
+    await storage.save_media_file_id(path, kind, sha256, _sent_file_id(sent, kind))
+    return sent
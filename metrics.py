@@ -0,0 +1,277 @@
+"""Метрики обработчиков и запросов к базе в текстовом формате Prometheus.
+
+HandlerMetrics - middleware aiogram: время каждого обработчика сообщений,
+callback-запросов и инлайн-запросов по имени маршрута, число ошибок и
+предупреждение в лог, если обработчик работал дольше slow_threshold.
+observe_db() вызывается из storage._run для каждой функции database.py:
+число вызовов, время в пуле и выполнения, сколько строк вернулось.
+
+Метрики отдаются по HTTP (MetricsServer), например:
+    curl http://127.0.0.1:9108/metrics
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Optional, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware, types
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Счетчик с метками; значения меняются из разных потоков, поэтому под блокировкой"""
+
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            yield self.name, _format_labels(self.labels, label_values), value
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин, как в клиенте Prometheus"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счетчики по корзинам, сумма, количество]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, *label_values) -> int:
+        state = self._values.get(label_values)
+        return state[2] if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+        for label_values, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, label_values, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket", labels, cumulative
+            yield f"{self.name}_bucket", _format_labels(self.labels, label_values, 'le="+Inf"'), count
+            yield f"{self.name}_sum", _format_labels(self.labels, label_values), total
+            yield f"{self.name}_count", _format_labels(self.labels, label_values), count
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, documentation: str, labels: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, func: Callable[[], list]):
+        """Регистрирует функцию, которая при каждом запросе /metrics возвращает
+        список (имя, тип, описание, [(метки dict, значение), ...])"""
+        self._collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception:
+                logger.exception("Ошибка при сборе метрик %s", collect)
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    names = tuple(labels)
+                    lines.append(f"{name}{_format_labels(names, tuple(labels[n] for n in names))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+handler_seconds = registry.histogram(
+    'bot_handler_seconds', "Время обработчика апдейта", ('event', 'handler'),
+)
+handler_errors = registry.counter(
+    'bot_handler_errors_total', "Обработчики, завершившиеся исключением", ('event', 'handler'),
+)
+slow_handlers = registry.counter(
+    'bot_slow_handlers_total', "Обработчики дольше порога slow_threshold", ('event', 'handler'),
+)
+throttled_updates = registry.counter(
+    'bot_throttled_updates_total', "Апдейты, отброшенные ограничением частоты", ('limit',),
+)
+coalesced_callbacks = registry.counter(
+    'bot_coalesced_callbacks_total', "Повторные нажатия, которые не стали выполнять", ('reason',),
+)
+retry_after = registry.counter(
+    'bot_retry_after_total', "Ответы 429 от Bot API", ('method',),
+)
+db_query_seconds = registry.histogram(
+    'bot_db_query_seconds', "Время выполнения функции database.py в потоке пула", ('function',),
+)
+db_wait_seconds = registry.histogram(
+    'bot_db_pool_wait_seconds', "Ожидание свободного потока в пуле базы", (),
+)
+db_rows = registry.counter(
+    'bot_db_rows_total', "Строк вернули функции database.py", ('function',),
+)
+db_write_batch_size = registry.histogram(
+    'bot_db_write_batch_size', "Записей в одной транзакции группового коммита", (),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+db_errors = registry.counter(
+    'bot_db_errors_total', "Функции database.py, завершившиеся исключением", ('function',),
+)
+
+def _row_count(result) -> int:
+    """Сколько строк вернула функция: список строк, (строки, есть ли еще) или одна строка"""
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    return 1
+
+def observe_db(func, submitted_at: float):
+    """Оборачивает вызов функции database.py для выполнения в пуле потоков"""
+    name = getattr(func, '__name__', None) or getattr(getattr(func, 'func', None), '__name__', 'unknown')
+
+    def call(*args, **kwargs):
+        started = time.perf_counter()
+        db_wait_seconds.observe(started - submitted_at)
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            db_errors.inc(name)
+            raise
+        finally:
+            db_query_seconds.observe(time.perf_counter() - started, name)
+        db_rows.inc(name, amount=_row_count(result))
+        return result
+    return call
+
+class HandlerMetrics(BaseMiddleware):
+    """Замеряет обработчики сообщений, callback- и инлайн-запросов.
+
+    Имя маршрута для callback-запросов берется из CallbackRouter (все они
+    проходят через один router.dispatch), для остальных - имя функции-обработчика.
+    """
+
+    def __init__(self, callback_router=None, slow_threshold: Optional[float] = None):
+        self.callback_router = callback_router
+        self.slow_threshold = slow_threshold
+
+    def _route(self, event, data: dict) -> Tuple[str, str]:
+        if isinstance(event, types.CallbackQuery):
+            if self.callback_router is not None:
+                return 'callback_query', self.callback_router.route_name(event.data)
+            kind = 'callback_query'
+        elif isinstance(event, types.InlineQuery):
+            kind = 'inline_query'
+        else:
+            kind = 'message'
+        handler = data.get('handler')
+        return kind, getattr(getattr(handler, 'callback', None), '__name__', 'unknown')
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(*self._route(event, data))
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            route = self._route(event, data)
+            handler_seconds.observe(elapsed, *route)
+            if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+                slow_handlers.inc(*route)
+                logger.warning("Медленный обработчик %s/%s: %.0f мс", route[0], route[1], elapsed * 1000)
+
+class MetricsServer:
+    """HTTP-сервер, отдающий /metrics; работает в том же цикле событий, что и бот"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 9108, path: str = '/metrics'):
+        self.host = host
+        self.port = port
+        self.path = path
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode(),
+            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get(self.path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("Метрики: http://%s:%s%s", self.host, self.port, self.path)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
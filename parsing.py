@@ -0,0 +1,194 @@
+"""Разбор сумм, дат, времени и записей '#продажа/dd.mm.yy/@user/HH:MM/сумма'.
+
+Общий модуль для инлайн-режима, импорта, поиска и ввода при редактировании.
+Разбор идет через split и проверки символов, без регулярных выражений и
+strptime. Суммы везде - целые копейки (Kopecks).
+
+check_entry(text, partial=True) без исключений возвращает подсказку (EntryHint),
+какое поле записи еще не дописано или заполнено неверно; parse_entry делает то
+же, но бросает EntryError. Полная запись разбирается быстрее прежнего шаблона,
+неполная - медленнее, зато с подсказкой; замеры: bench_parsing.py.
+"""
+from calendar import isleap, monthrange
+from datetime import date
+from typing import NamedTuple, NewType, Optional, Union
+
+# Сумма в копейках; в базе и между модулями суммы передаются только так
+Kopecks = NewType('Kopecks', int)
+
+SALE_TYPES = ('продажа', 'закупка')
+
+ENTRY_EXAMPLE = "#продажа/10.04.25/@username/10:00/7000р"
+
+# Поля записи по порядку: подсказка, пока поле не дописано, и сообщение, если оно неверное
+ENTRY_FIELDS = (
+    ('sale_type', "Введите тип: продажа или закупка", "Неверный тип, нужно продажа или закупка"),
+    ('date', "Введите дату dd.mm.yy", "Неверная дата, нужен формат dd.mm.yy"),
+    ('user_tag', "Введите @username", "Неверный username, нужен @username"),
+    ('time', "Введите время ЧЧ:ММ", "Неверное время, нужен формат ЧЧ:ММ"),
+    ('amount', "Введите сумму, например 7000р", "Неверная сумма, например 7000р или 7000.50"),
+)
+
+class SaleEntry(NamedTuple):
+    sale_type: str
+    date: str
+    user_tag: str
+    time: str
+    amount: Kopecks
+
+class EntryHint(NamedTuple):
+    """Что не так с записью: первое неверное поле, сообщение и дописано ли поле"""
+    field: str
+    message: str
+    incomplete: bool
+
+class EntryError(ValueError):
+    """Запись не разобрана: field - первое неверное поле, incomplete - поле еще не дописано"""
+
+    def __init__(self, field: str, message: str, incomplete: bool = False):
+        super().__init__(message)
+        self.field = field
+        self.incomplete = incomplete
+
+def _is_digits(text: str) -> bool:
+    return text.isdigit() and text.isascii()
+
+def parse_amount(text) -> Kopecks:
+    """Разбирает сумму вида '7000р', '7 000' или '7000.50' в целое число копеек.
+
+    Грамматика та же, что у суммы в записи (_entry_amount): отрицательные суммы,
+    экспоненты и неоднозначные '7,000' / '7.000' не принимаются.
+    """
+    kopecks = _entry_amount(str(text).strip())
+    if kopecks is None:
+        raise ValueError(f"Неверный формат суммы: {text!r}, нужно например 7000 или 7000.50")
+    return kopecks
+
+def format_amount(kopecks: int) -> str:
+    """Форматирует сумму в копейках для вывода: '7000' или '7000.50'"""
+    rubles, rest = divmod(int(kopecks), 100)
+    return f"{rubles}.{rest:02d}" if rest else f"{rubles}"
+
+# Проверки полей записи: возвращают значение поля или None, без исключений -
+# при наборе записи почти каждый запрос неполный, а исключения в Python дорогие
+
+def _entry_sale_type(text: str) -> Optional[str]:
+    text = text.lower()
+    return text if text in SALE_TYPES else None
+
+# Все допустимые 'dd.mm' и 'ЧЧ:ММ': проверка поля - один поиск в множестве
+_DAY_MONTHS = frozenset(
+    f"{day:02d}.{month:02d}" for month in range(1, 13) for day in range(1, monthrange(2000, month)[1] + 1)
+)
+_TIMES = frozenset(f"{hour:02d}:{minute:02d}" for hour in range(24) for minute in range(60))
+
+def _entry_date(text: str) -> Optional[str]:
+    if len(text) != 8 or text[5] != '.' or text[:5] not in _DAY_MONTHS:
+        return None
+    year = text[6:]
+    if not _is_digits(year):
+        return None
+    # 29 февраля есть только в високосные годы (в 2000-м - есть)
+    if text[:5] == '29.02' and not isleap(int(year) + (1900 if year >= '69' else 2000)):
+        return None
+    return text
+
+def _entry_user_tag(text: str) -> Optional[str]:
+    return text if is_user_tag(text) else None
+
+def _entry_time(text: str) -> Optional[str]:
+    return text if text in _TIMES else None
+
+# Верхняя граница суммы (не включительно): 100 млрд рублей - с запасом для любой записи
+# и далеко от 2**63, так что и SUM по многим записям в SQLite не переполнится
+MAX_AMOUNT = Kopecks(10 ** 13)
+# Ведущие нули не в счет, но длиннее этого сумма - заведомо мусор
+_MAX_RUBLE_DIGITS = 20
+
+# Пробелы между разрядами ('7 000'), в том числе неразрывные из таблиц
+_GROUP_SPACES = str.maketrans('', '', ' \xa0\u202f')
+
+def _entry_amount(text: str) -> Optional[Kopecks]:
+    """Рубли и необязательные копейки после '.' или ',' (не больше двух цифр), 'р' в конце необязательна.
+
+    '7,000' и '7.000' не принимаются: непонятно, это тысячи или рубли с копейками.
+    Суммы от MAX_AMOUNT и больше тоже: в базе они не поместились бы в INTEGER.
+    """
+    if text[-1:] == 'р':
+        text = text[:-1]
+    if _is_digits(text):
+        rubles, cents = text, ''
+    else:
+        rubles, separator, cents = text.translate(_GROUP_SPACES).replace(',', '.').partition('.')
+        if not _is_digits(rubles):
+            return None
+        if separator and (len(cents) > 2 or not _is_digits(cents)):
+            return None
+    # Длинную строку цифр не переводим в int: это заведомо больше MAX_AMOUNT
+    if len(rubles) > _MAX_RUBLE_DIGITS:
+        return None
+    kopecks = int(rubles) * 100 + (int(cents.ljust(2, '0')) if cents else 0)
+    return Kopecks(kopecks) if kopecks < MAX_AMOUNT else None
+
+_ENTRY_CHECKS = (_entry_sale_type, _entry_date, _entry_user_tag, _entry_time, _entry_amount)
+_AMOUNT_INDEX = len(_ENTRY_CHECKS) - 1
+
+# Подсказки заготовлены заранее: check_entry на неполной записи ничего не создает
+_INCOMPLETE = tuple(EntryHint(field, hint, True) for field, hint, _ in ENTRY_FIELDS)
+_INVALID = tuple(EntryHint(field, error, False) for field, _, error in ENTRY_FIELDS)
+_EXTRA_FIELDS = EntryHint('amount', "Лишние поля после суммы", False)
+
+def parse_date(text: str) -> date:
+    """Разбирает дату dd.mm.yy; годы 69-99 - это 1969-1999, как у strptime('%y')"""
+    if not isinstance(text, str):
+        raise TypeError(f"Дата должна быть строкой, а не {type(text).__name__}")
+    if _entry_date(text) is None:
+        raise ValueError(f"Неверная дата: {text!r}")
+    year = int(text[6:])
+    return date(year + (1900 if year >= 69 else 2000), int(text[3:5]), int(text[:2]))
+
+def parse_time(text: str) -> str:
+    """Проверяет время ЧЧ:ММ (00:00-23:59) и возвращает его"""
+    if _entry_time(text) is None:
+        raise ValueError(f"Неверное время: {text!r}")
+    return text
+
+def is_user_tag(text: str) -> bool:
+    """'@' и дальше буквы, цифры или '_' (как @\\w+)"""
+    return len(text) > 1 and text[0] == '@' and text[1:].replace('_', 'a').isalnum()
+
+def check_entry(text: str, partial: bool = False) -> Union[SaleEntry, EntryHint]:
+    """Как parse_entry, но вместо исключения возвращает EntryHint - для инлайн-режима,
+    где почти каждый запрос неполный"""
+    text = text.strip()
+    if text[:1] == '#':
+        text = text[1:]
+    parts = text.split('/')
+    count = len(parts)
+    if count > len(ENTRY_FIELDS):
+        return _EXTRA_FIELDS
+
+    values = []
+    for index, part in enumerate(parts):
+        value = _ENTRY_CHECKS[index](part)
+        if value is None:
+            # Последнее поле без '/' после него, возможно, еще дописывается; сумма - только пока пустая
+            if partial and index == count - 1 and (index != _AMOUNT_INDEX or not part):
+                return _INCOMPLETE[index]
+            return _INVALID[index]
+        values.append(value)
+
+    if count < len(ENTRY_FIELDS):
+        return _INCOMPLETE[count]
+    return SaleEntry(*values)
+
+def parse_entry(text: str, partial: bool = False) -> SaleEntry:
+    """Разбирает запись '#продажа/dd.mm.yy/@user/HH:MM/сумма'; EntryError, если она неверна.
+
+    С partial=True неверное последнее поле без '/' после него считается недописанным
+    (EntryError.incomplete) - так инлайн-режим подсказывает, что вводить дальше.
+    """
+    entry = check_entry(text, partial)
+    if isinstance(entry, EntryHint):
+        raise EntryError(*entry)
+    return entry
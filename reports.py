@@ -0,0 +1,141 @@
+"""Расчет отчетности за день и за месяц с разбивкой по дням.
+
+Ставки (процент админа, комиссия карты) и ручные правки отчета хранятся
+в базе (report_settings, report_overrides) и приходят вместе с итогами дня.
+Отчеты за закрытые периоды (прошедшие дни и месяцы) считаются один раз
+и дальше отдаются из снимка в базе, см. storage.get_report_snapshot.
+"""
+import calendar
+from datetime import date
+from functools import partial
+
+from aiogram import html
+
+import storage
+from parsing import parse_date
+
+def day_figures(sales: float, purchases: float, admin_rate: float, card_fee: float, admin: float = None) -> dict:
+    """Показатели одного дня в рублях; процент админа считается по ставке, если не задан явно"""
+    if admin is None:
+        admin = round(sales * admin_rate)
+    return {
+        'sales': sales,
+        'purchases': purchases,
+        'admin': admin,
+        'card': card_fee,
+        'total': int(sales - purchases - admin - card_fee),
+    }
+
+def breakdown_figures(row) -> dict:
+    """Показатели дня по строке storage.get_period_breakdown"""
+    _, sales, purchases, admin, card, admin_rate, edited = row
+    figures = day_figures(
+        sales / 100, purchases / 100, admin_rate, card / 100,
+        admin=None if admin is None else admin / 100,
+    )
+    figures['edited'] = bool(edited)
+    return figures
+
+def render_day_report(date_str: str, figures: dict) -> str:
+    """Текст отчета за день"""
+    return (
+        f"<b>Отчетность за {date_str}г</b>\n"
+        f"1. Сумма продаж : {int(figures['sales'])}р\n"
+        f"2. Покупка рекламы : {int(figures['purchases'])}р\n"
+        f"3. Процент админа : {int(figures['admin'])}р\n"
+        f"4. Контенщик : - \n"
+        f"5. Карта : - {int(figures['card'])}р\n\n"
+        f"<b>ИТОГ ДНЯ : {figures['total']}р</b>"
+    )
+
+def _day_report(date_str: str, breakdown) -> tuple:
+    figures = breakdown_figures(breakdown[0])
+    return render_day_report(date_str, figures), figures
+
+async def get_day_report(date_str: str) -> tuple:
+    """Отчет за день (dd.mm.yy): (текст, цифры). Прошедшие дни отдаются из снимка"""
+    day = parse_date(date_str)
+    if day < date.today():
+        render = partial(_day_report, date_str)
+        return await storage.get_report_snapshot(day.isoformat(), date_str, date_str, render)
+    return _day_report(date_str, await storage.get_period_breakdown(date_str, date_str))
+
+def _month_report(year: int, month: int, breakdown) -> dict:
+    days = [{'day': day, **breakdown_figures(row)} for day, row in enumerate(breakdown, start=1)]
+
+    return {
+        'year': year,
+        'month': month,
+        'days': days,
+        'sales': sum(d['sales'] for d in days),
+        'purchases': sum(d['purchases'] for d in days),
+        'admin': sum(d['admin'] for d in days),
+        'card': sum(d['card'] for d in days),
+        'total': sum(d['total'] for d in days),
+    }
+
+def _rendered_month_report(year: int, month: int, breakdown) -> tuple:
+    report = _month_report(year, month, breakdown)
+    return render_month_report(report), report
+
+def _month_bounds(year: int, month: int) -> tuple:
+    days_in_month = calendar.monthrange(year, month)[1]
+    return date(year, month, 1).strftime('%d.%m.%y'), date(year, month, days_in_month).strftime('%d.%m.%y')
+
+async def build_month_report(year: int, month: int) -> dict:
+    """Собирает отчет за месяц: строки по каждому дню и итоги, все суммы в рублях"""
+    start_date, end_date = _month_bounds(year, month)
+    return _month_report(year, month, await storage.get_period_breakdown(start_date, end_date))
+
+async def get_month_report(year: int, month: int) -> str:
+    """Текст отчета за месяц; прошедшие месяцы отдаются из снимка"""
+    if (year, month) >= (date.today().year, date.today().month):
+        return render_month_report(await build_month_report(year, month))
+
+    start_date, end_date = _month_bounds(year, month)
+    render = partial(_rendered_month_report, year, month)
+    text, _ = await storage.get_report_snapshot(f"{year:04d}-{month:02d}", start_date, end_date, render)
+    return text
+
+def render_month_report(report: dict) -> str:
+    """Текст отчета: итоги за месяц и компактная таблица по дням"""
+    month_name = date(report['year'], report['month'], 1).strftime('%B %Y')
+
+    lines = [f"{'Дн':>2} {'Продажи':>8} {'Закупки':>8} {'Админ':>6} {'Итог':>8}"]
+    for d in report['days']:
+        lines.append(
+            f"{d['day']:>2} {int(d['sales']):>8} {int(d['purchases']):>8} "
+            f"{int(d['admin']):>6} {d['total']:>8}" + (" ✏️" if d['edited'] else "")
+        )
+
+    card_fees = {d['card'] for d in report['days']}
+    card_note = f" (карта {int(card_fees.pop())}р/день)" if len(card_fees) == 1 else ""
+
+    return (
+        f"<b>Отчетность за {month_name}</b>\n\n"
+        f"Продажи: {int(report['sales'])}р\n"
+        f"Закупки: {int(report['purchases'])}р\n"
+        f"Процент админа: {int(report['admin'])}р\n"
+        f"Комиссия карты: {int(report['card'])}р\n\n"
+        f"<b>ИТОГО: {report['total']}р</b>\n\n"
+        f"По дням{card_note}:\n"
+        f"<pre>" + "\n".join(lines) + "</pre>"
+    )
+
+async def build_leaderboard(start_date: str, end_date: str, limit: int = 10) -> str:
+    """Текст рейтинга за период: топ покупателей по сумме продаж и итоги по операторам"""
+    top = await storage.get_top_user_tags(start_date, end_date, limit)
+    operators = await storage.get_operator_totals(start_date, end_date)
+
+    period = start_date if start_date == end_date else f"{start_date} - {end_date}"
+    if not top and not operators:
+        return f"Нет записей за {period}"
+
+    lines = [f"<b>Топ покупателей за {period}</b>"]
+    for place, (user_tag, revenue, count) in enumerate(top, start=1):
+        lines.append(f"{place}. {html.quote(user_tag)} — {int(revenue / 100)}р ({count} шт.)")
+
+    lines.append("\n<b>По операторам</b>")
+    for user_id, sales, purchases, count in operators:
+        lines.append(f"ID {user_id}: продажи {int(sales / 100)}р, закупки {int(purchases / 100)}р ({count} зап.)")
+    return "\n".join(lines)
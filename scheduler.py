@@ -0,0 +1,127 @@
+"""Фоновый расчет и рассылка отчетов по расписанию.
+
+Каждый день в report_time планировщик считает отчет за вчерашний день
+(а первого числа - еще и за прошлый месяц), сохраняет снимок в базе
+и рассылает текст в чаты из chat_ids. После этого запросы отчетов за
+закрытые периоды отдаются из снимка, а не пересчитываются.
+
+Если запущено несколько воркеров, каждый отчет в каждый чат отправляет только
+один из них: перед отправкой она занимается в таблице report_deliveries, а после
+отмечается отправленной. Если отправить не удалось, отметка снимается и отправка
+повторяется через retry_interval секунд. Если бот был выключен в report_time,
+сегодняшняя рассылка уходит сразу после запуска.
+"""
+import asyncio
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+import storage
+from reports import get_day_report, get_month_report
+
+logger = logging.getLogger(__name__)
+
+def parse_report_time(value) -> time:
+    """Время рассылки из config: строка 'ЧЧ:ММ' или datetime.time"""
+    if isinstance(value, time):
+        return value
+    return datetime.strptime(value, '%H:%M').time()
+
+class ReportScheduler:
+    def __init__(self, bot: Bot, report_time: time = time(9, 0), chat_ids: Iterable[int] = (),
+                 retry_interval: float = 300, max_retries: int = 5, claim_timeout: float = 600):
+        self.bot = bot
+        self.report_time = report_time
+        self.chat_ids = list(chat_ids)
+        self.retry_interval = retry_interval
+        self.max_retries = max_retries
+        # Через столько секунд незавершенная чужая отправка (воркер упал) занимается заново
+        self.claim_timeout = claim_timeout
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _seconds_until_next_run(self) -> float:
+        now = datetime.now()
+        next_run = datetime.combine(now.date(), self.report_time)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    async def _loop(self):
+        day = date.today()
+        if datetime.now().time() >= self.report_time:
+            # Время рассылки сегодня уже прошло (например, бот был выключен): рассылаем сразу,
+            # отчеты, отправленные до перезапуска, отмечены в базе и повторно не уйдут
+            await self.deliver(day)
+        else:
+            # После перезапуска сразу готовим снимки за вчера, но ничего не рассылаем
+            try:
+                await self.precompute(day)
+            except Exception:
+                logger.exception("Не удалось подготовить отчеты")
+
+        while True:
+            await asyncio.sleep(self._seconds_until_next_run())
+            await self.deliver(date.today())
+
+    async def deliver(self, today: date):
+        """run(today), пока все отчеты не будут отправлены, но не больше max_retries повторов"""
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.retry_interval)
+            try:
+                if not await self.run(today):
+                    return
+            except Exception:
+                logger.exception("Ошибка при рассылке отчетов")
+        logger.error("Отчеты на %s так и не удалось отправить во все чаты", today)
+
+    async def precompute(self, today: date) -> list:
+        """Считает и сохраняет отчеты, закрытые к дню today; возвращает [(период, текст), ...]"""
+        yesterday = today - timedelta(days=1)
+        text, _ = await get_day_report(yesterday.strftime('%d.%m.%y'))
+        reports = [(yesterday.isoformat(), text)]
+        if today.day == 1:
+            reports.append((yesterday.strftime('%Y-%m'), await get_month_report(yesterday.year, yesterday.month)))
+        return reports
+
+    async def run(self, today: date) -> int:
+        """Рассылает отчеты, закрытые к дню today; возвращает, сколько отправок еще не сделано"""
+        pending = 0
+        for period, text in await self.precompute(today):
+            for chat_id in self.chat_ids:
+                status = await storage.claim_report_delivery(period, chat_id, self.claim_timeout)
+                if status == 'delivered':
+                    continue
+                if status == 'busy':
+                    # Отправляет другой воркер; если он не справится, отметку снимут и повтор займет ее
+                    pending += 1
+                    continue
+                delivered = await self._send(chat_id, text)
+                await storage.finish_report_delivery(period, chat_id, delivered)
+                if not delivered:
+                    pending += 1
+        return pending
+
+    async def _send(self, chat_id: int, text: str) -> bool:
+        try:
+            await self.bot.send_message(chat_id, text)
+        except TelegramAPIError as e:
+            logger.error("Не удалось отправить отчет в чат %s: %s", chat_id, e)
+            return False
+        return True
@@ -0,0 +1,63 @@
+"""Разбор поисковых запросов для /find и инлайн-режима 'найти ...'.
+
+Запрос - слова в любом порядке:
+    @user или user      - начало user_tag, без учета регистра
+    продажа / закупка   - тип записи
+    10.04.25            - день; две даты - период с первой по вторую
+    7000                - точная сумма
+    5000-10000          - диапазон сумм; >5000 и <5000 - только нижняя или верхняя граница
+"""
+import re
+
+import database
+from parsing import parse_amount, parse_date
+
+_DATE_RE = re.compile(r"\d{2}\.\d{2}\.\d{2}")
+_AMOUNT_RANGE_RE = re.compile(r"(\d[\d.,]*)р?-(\d[\d.,]*)р?")
+_USER_TAG_RE = re.compile(r"@?(\w+)")
+
+SEARCH_HELP = (
+    "Поиск: @user (начало username), продажа/закупка, дата или две даты (период), "
+    "сумма 7000, диапазон 5000-10000, >5000 или <5000.\n"
+    "Например: /find @ivan 01.04.25 30.04.25 >5000"
+)
+
+def parse_search_query(text: str) -> dict:
+    """Разбирает запрос в фильтры для database.search_sales; ValueError, если запрос неверный"""
+    filters = {}
+    dates = []
+    for word in text.split():
+        lower = word.lower()
+        if lower in ('продажа', 'закупка'):
+            filters['sale_type'] = lower
+        elif _DATE_RE.fullmatch(word):
+            try:
+                dates.append(parse_date(word))
+            except ValueError:
+                raise ValueError(f"Неверная дата: {word}")
+        elif _AMOUNT_RANGE_RE.fullmatch(word):
+            low, high = _AMOUNT_RANGE_RE.fullmatch(word).groups()
+            filters['min_amount'] = parse_amount(low)
+            filters['max_amount'] = parse_amount(high)
+        elif word[0] in '<>':
+            bound = 'min_amount' if word[0] == '>' else 'max_amount'
+            filters[bound] = parse_amount(word[1:])
+        elif word[0].isdigit():
+            filters['min_amount'] = filters['max_amount'] = parse_amount(word)
+        elif _USER_TAG_RE.fullmatch(word):
+            filters['user_tag'] = '@' + _USER_TAG_RE.fullmatch(word).group(1)
+        else:
+            raise ValueError(f"Непонятное условие: {word}")
+
+    if len(dates) > 2:
+        raise ValueError("Укажите одну дату или две даты периода")
+    if dates:
+        start, end = dates[0], dates[-1]
+        if start > end:
+            raise ValueError("Начало периода позже конца")
+        filters['start_date'] = start.strftime(database.DATE_FORMAT)
+        filters['end_date'] = end.strftime(database.DATE_FORMAT)
+
+    if not filters:
+        raise ValueError("Пустой запрос")
+    return filters
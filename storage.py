@@ -0,0 +1,311 @@
+"""Асинхронный доступ к базе продаж.
+
+Функции из database.py блокируют поток, поэтому здесь они выполняются
+в отдельном пуле потоков, а обработчики бота просто ожидают результат
+и не останавливают обработку остальных апдейтов.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Tuple, Optional
+
+import database
+import exporter
+import importer
+import metrics
+from cache import TTLCache
+
+# Небольшой пул: каждый поток держит свое соединение на чтение,
+# записи сериализуются внутри database._write()
+DB_WORKERS = 4
+
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='sales-db')
+
+# Групповой коммит новых записей: пачка собирается WRITE_BATCH_DELAY секунд
+# или до WRITE_BATCH_SIZE записей и пишется одной транзакцией
+WRITE_BATCH_SIZE = 64
+WRITE_BATCH_DELAY = 0.005
+
+# Записи за день по ключу (date, sale_type, ...) и итоги по ключу (вид, начало, конец, ...)
+# с датами в ISO, чтобы при изменении записи можно было сбросить все периоды, куда она попадает
+records_cache = TTLCache(maxsize=512, ttl=300)
+totals_cache = TTLCache(maxsize=256, ttl=300)
+
+# _invalidate видит только записи этого процесса. Если в ту же базу пишут другие
+# воркеры бота или manage.py, кэши сбрасываются целиком: перед чтением из кэша,
+# не чаще раза в EXTERNAL_CHECK_INTERVAL секунд, сверяется PRAGMA data_version
+EXTERNAL_CHECK_INTERVAL = 1.0
+_data_version = None
+_data_version_checked_at = 0.0
+
+_MISSING = object()
+
+async def _run(func, *args, **kwargs):
+    """Выполняет функцию database.py в пуле потоков и учитывает ее в метриках"""
+    loop = asyncio.get_running_loop()
+    call = metrics.observe_db(func, time.perf_counter())
+    return await loop.run_in_executor(_executor, partial(call, *args, **kwargs))
+
+def _check_external_writes():
+    """Сбрасывает кэши, если с прошлой проверки базу изменил другой процесс"""
+    global _data_version, _data_version_checked_at
+    now = time.monotonic()
+    if now - _data_version_checked_at < EXTERNAL_CHECK_INTERVAL:
+        return
+    version = database.data_version()
+    if version is None:
+        # Соединение записи занято - проверим при следующем чтении
+        return
+    _data_version_checked_at = now
+    if _data_version is not None and version != _data_version:
+        records_cache.clear()
+        totals_cache.clear()
+    _data_version = version
+
+async def _cached(cache: TTLCache, key, func, *args):
+    """Отдает значение из кэша или загружает его из базы"""
+    _check_external_writes()
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        generation = cache.generation
+        value = await _run(func, *args)
+        cache.set(key, value, generation)
+    return value
+
+def _invalidate(*rows):
+    """Сбрасывает кэш для дней, которых касаются записи (id, sale_type, ..., date, ...)"""
+    for row in rows:
+        if row is None:
+            continue
+        sale_type, date = row[1], row[5]
+        records_cache.invalidate_where(lambda key: key[0] == date and key[1] == sale_type)
+        try:
+            iso_date = database.to_iso_date(date)
+        except (TypeError, ValueError):
+            totals_cache.clear()
+            continue
+        totals_cache.invalidate_where(lambda key: key[1] <= iso_date <= key[2])
+
+def cache_stats() -> dict:
+    return {'records': records_cache.stats(), 'totals': totals_cache.stats()}
+
+@metrics.registry.collector
+def _cache_metrics():
+    stats = cache_stats()
+    families = [('bot_cache_size', 'gauge', 'size', "Записей в кэше storage")]
+    families += [(f'bot_cache_{field}_total', 'counter', field, f"Кэш storage: {field}") for field in ('hits', 'misses', 'evictions')]
+    return [
+        (name, kind, documentation, [({'cache': cache}, values[field]) for cache, values in stats.items()])
+        for name, kind, field, documentation in families
+    ]
+
+class _WriteBatcher:
+    """Очередь вставок add_sale с групповым коммитом.
+
+    Каждый вызывающий получает свой future с (id, создана ли); пока одна пачка
+    пишется в базу, следующая уже копится в очереди.
+    """
+
+    def __init__(self, max_size: int, max_delay: float):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, entry: tuple) -> asyncio.Future:
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._loop())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((entry, future))
+        return future
+
+    async def _loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            closing = False
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if closing:
+                return
+
+    async def _flush(self, batch):
+        metrics.db_write_batch_size.observe(len(batch))
+        try:
+            results = await _run(database.add_sales_batch, [entry for entry, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (entry, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                if not future.done():
+                    future.set_exception(result)
+                continue
+            sale_id, created = result
+            if created:
+                sale_type, date, user_tag, time, amount, user_id = entry
+                _invalidate((sale_id, sale_type, user_tag, time, amount, date, user_id))
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self):
+        """Дописывает все, что уже в очереди, и останавливает фоновую задачу"""
+        if self._task is not None and not self._task.done():
+            self._queue.put_nowait(None)
+            await self._task
+        self._task = None
+
+_sale_writer = _WriteBatcher(WRITE_BATCH_SIZE, WRITE_BATCH_DELAY)
+
+async def init_db():
+    await _run(database.init_db)
+
+async def close_db():
+    """Дописывает очередь вставок, дожидается завершения запросов и закрывает соединения"""
+    global _data_version
+    await _sale_writer.close()
+    await _run(database.close_db)
+    _executor.shutdown(wait=True)
+    # У нового соединения записи будет свой отсчет data_version
+    _data_version = None
+
+async def add_sale(sale_type: str, date: str, user_tag: str, time: str, amount: int, user_id: int) -> Tuple[int, bool]:
+    """Ставит запись в очередь группового коммита и ждет (id, создана ли), как database.add_sale"""
+    return await _sale_writer.submit((sale_type, date, user_tag, time, amount, user_id))
+
+async def sale_exists(sale_type: str, date: str, user_tag: str, time: str, amount: int) -> Optional[int]:
+    return await _run(database.sale_exists, sale_type, date, user_tag, time, amount)
+
+async def get_sales_by_date(date: str, sale_type: str) -> List[Tuple]:
+    return await _cached(records_cache, (date, sale_type), database.get_sales_by_date, date, sale_type)
+
+async def get_sales_page(date: str, sale_type: str, cursor_id: int = None, backward: bool = False,
+                         limit: int = 10) -> Tuple[List[Tuple], bool]:
+    key = (date, sale_type, cursor_id, backward, limit)
+    return await _cached(records_cache, key, database.get_sales_page, date, sale_type, cursor_id, backward, limit)
+
+async def search_sales(cursor_id: int = None, backward: bool = False, limit: int = 10,
+                       **filters) -> Tuple[List[Tuple], bool]:
+    return await _run(database.search_sales, cursor_id=cursor_id, backward=backward, limit=limit, **filters)
+
+async def delete_sale(sale_id: int, actor_id: int = None) -> Optional[Tuple]:
+    deleted = await _run(database.delete_sale, sale_id, actor_id)
+    _invalidate(deleted)
+    return deleted
+
+async def update_sale(sale_id: int, actor_id: int = None, **fields) -> Optional[Tuple[Tuple, Tuple]]:
+    changed = await _run(database.update_sale, sale_id, actor_id=actor_id, **fields)
+    if changed:
+        _invalidate(*changed)
+    return changed
+
+async def get_sale_history(sale_id: int) -> List[Tuple]:
+    return await _run(database.get_sale_history, sale_id)
+
+async def get_sale_by_id(sale_id: int) -> Optional[Tuple]:
+    return await _run(database.get_sale_by_id, sale_id)
+
+async def sum_sales_for_period(start_date, end_date, sale_type):
+    key = ('sum', database.to_iso_date(start_date), database.to_iso_date(end_date), sale_type)
+    return await _cached(totals_cache, key, database.sum_sales_for_period, start_date, end_date, sale_type)
+
+async def get_day_totals(date: str) -> dict:
+    iso_date = database.to_iso_date(date)
+    return await _cached(totals_cache, ('day', iso_date, iso_date), database.get_day_totals, date)
+
+async def get_period_breakdown(start_date: str, end_date: str) -> List[Tuple]:
+    key = ('breakdown', database.to_iso_date(start_date), database.to_iso_date(end_date))
+    return await _cached(totals_cache, key, database.get_period_breakdown, start_date, end_date)
+
+async def get_top_user_tags(start_date: str, end_date: str, limit: int = 10) -> List[Tuple]:
+    key = ('top', database.to_iso_date(start_date), database.to_iso_date(end_date), limit)
+    return await _cached(totals_cache, key, database.get_top_user_tags, start_date, end_date, limit)
+
+async def get_operator_totals(start_date: str, end_date: str) -> List[Tuple]:
+    key = ('operators', database.to_iso_date(start_date), database.to_iso_date(end_date))
+    return await _cached(totals_cache, key, database.get_operator_totals, start_date, end_date)
+
+def _invalidate_report(iso_start: str, iso_end: str = '9999-12-31'):
+    """Сбрасывает закэшированные итоги и снимки, пересекающиеся с периодом"""
+    totals_cache.invalidate_where(lambda key: key[1] <= iso_end and key[2] >= iso_start)
+
+async def set_report_override(date: str, **fields):
+    await _run(database.set_report_override, date, **fields)
+    iso_date = database.to_iso_date(date)
+    _invalidate_report(iso_date, iso_date)
+
+async def clear_report_overrides(date: str) -> bool:
+    cleared = await _run(database.clear_report_overrides, date)
+    iso_date = database.to_iso_date(date)
+    _invalidate_report(iso_date, iso_date)
+    return cleared
+
+async def set_report_settings(start_date: str, admin_rate: float, card_fee: int):
+    await _run(database.set_report_settings, start_date, admin_rate, card_fee)
+    _invalidate_report(database.to_iso_date(start_date))
+
+async def get_report_snapshot(period: str, start_date: str, end_date: str, render) -> Tuple[str, dict]:
+    """Снимок отчета за закрытый период: из кэша, из базы или строится заново и сохраняется"""
+    key = ('snapshot', database.to_iso_date(start_date), database.to_iso_date(end_date))
+    _check_external_writes()
+    value = totals_cache.get(key, _MISSING)
+    if value is _MISSING:
+        generation = totals_cache.generation
+        value = await _run(database.get_report_snapshot, period)
+        if value is None:
+            value = await _run(database.build_report_snapshot, period, start_date, end_date, render)
+        totals_cache.set(key, value, generation)
+    return value
+
+async def claim_report_delivery(period: str, chat_id: int, timeout: float) -> str:
+    return await _run(database.claim_report_delivery, period, chat_id, timeout)
+
+async def finish_report_delivery(period: str, chat_id: int, delivered: bool):
+    await _run(database.finish_report_delivery, period, chat_id, delivered)
+
+async def rebuild_daily_totals():
+    await _run(database.rebuild_daily_totals)
+    totals_cache.clear()
+
+async def get_media_file_id(path: str, kind: str, sha256: str) -> Optional[str]:
+    return await _run(database.get_media_file_id, path, kind, sha256)
+
+async def save_media_file_id(path: str, kind: str, sha256: str, file_id: str):
+    await _run(database.save_media_file_id, path, kind, sha256, file_id)
+
+async def delete_media_file_id(path: str, kind: str):
+    await _run(database.delete_media_file_id, path, kind)
+
+async def import_file(path, default_user_id: int = 0) -> 'importer.ImportResult':
+    """Импортирует файл в пуле потоков и сбрасывает кэши, так как затронуты произвольные даты"""
+    try:
+        return await _run(importer.import_file, path, default_user_id)
+    finally:
+        records_cache.clear()
+        totals_cache.clear()
+
+async def export_file(path, start_date: str, end_date: str, kind: str = 'все', fmt: str = 'xlsx'):
+    await _run(exporter.export_file, path, start_date, end_date, kind, fmt)
@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Модули бота лежат в корне репозитория, без пакета
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import database  # noqa: E402
+
+@pytest.fixture
+def sales_db(tmp_path, monkeypatch):
+    """Пустая база продаж последней версии во временном каталоге"""
+    monkeypatch.setattr(database, 'DATABASE_NAME', str(tmp_path / 'sales.db'))
+    database.init_db()
+    yield tmp_path / 'sales.db'
+    database.close_db()
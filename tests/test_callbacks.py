@@ -0,0 +1,33 @@
+"""Перевод callback_data старых кнопок: callbacks.LEGACY_CALLBACKS и CallbackRouter.upgrade"""
+from datetime import date
+
+import pytest
+
+from callback_router import CallbackRouter
+from callbacks import LEGACY_CALLBACKS, BackToRecords, CalendarDay, ConfirmAdd
+
+@pytest.fixture
+def router():
+    return CallbackRouter(legacy=LEGACY_CALLBACKS)
+
+@pytest.mark.parametrize('data, record_type', [
+    ('back_to_sales', 'продажа'),
+    ('back_to_purchase', 'закупка'),
+    ('back_to_продажа', 'продажа'),
+    ('back_to_закупка', 'закупка'),
+])
+def test_legacy_back_to_records(router, data, record_type):
+    today = date.today().strftime('%d.%m.%y')
+    assert router.upgrade(data) == BackToRecords(date=today, record_type=record_type).pack()
+
+@pytest.mark.parametrize('data', [
+    'back_to_menu',
+    BackToRecords(date='10.04.25', record_type='продажа').pack(),
+])
+def test_current_callbacks_unchanged(router, data):
+    assert router.upgrade(data) == data
+
+def test_legacy_confirm_and_calendar(router):
+    assert router.upgrade('confirm_add:продажа:10.04.25:@user:10:00:7000') == ConfirmAdd(
+        sale_type='продажа', date='10.04.25', user_tag='@user', time='10:00', amount='7000').pack()
+    assert router.upgrade('calendar_day_2025-04-10') == CalendarDay(date='2025-04-10').pack()
@@ -0,0 +1,72 @@
+"""Хранилище состояний FSM в SQLite: fsm_storage.SQLiteStorage"""
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=20)
+OTHER = StorageKey(bot_id=1, chat_id=11, user_id=21)
+
+def test_state_survives_reopen(tmp_path):
+    path = str(tmp_path / 'fsm.db')
+
+    async def write():
+        storage = SQLiteStorage(path, flush_interval=60)
+        await storage.set_state(KEY, 'AddSale:amount')
+        await storage.set_data(KEY, {'sale_type': 'продажа', 'date': '10.04.25'})
+        await storage.set_state(OTHER, 'Search:query')
+        # До сброса чтения этого процесса отдаются из буфера
+        assert await storage.get_state(KEY) == 'AddSale:amount'
+        await storage.flush()
+        await storage.set_state(OTHER, None)
+        await storage.close()
+
+    async def read():
+        storage = SQLiteStorage(path)
+        try:
+            return (await storage.get_state(KEY), await storage.get_data(KEY),
+                    await storage.get_state(OTHER), await storage.get_data(OTHER))
+        finally:
+            await storage.close()
+
+    asyncio.run(write())
+    assert asyncio.run(read()) == ('AddSale:amount', {'sale_type': 'продажа', 'date': '10.04.25'}, None, {})
+
+def test_ttl_expiry(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'fsm.db'), ttl=0.2)
+
+    async def main():
+        await storage.set_state(KEY, 'AddSale:amount')
+        await storage.set_data(KEY, {'amount': 700000})
+        await storage.flush()
+        fresh = await storage.get_state(KEY), await storage.get_data(KEY)
+        await asyncio.sleep(0.3)
+        expired = await storage.get_state(KEY), await storage.get_data(KEY)
+        # Новое состояние не возвращает к жизни устаревшие данные
+        await storage.set_state(KEY, 'AddSale:time')
+        await storage.flush()
+        renewed = await storage.get_state(KEY), await storage.get_data(KEY)
+        await storage.close()
+        return fresh, expired, renewed
+
+    fresh, expired, renewed = asyncio.run(main())
+    assert fresh == ('AddSale:amount', {'amount': 700000})
+    assert expired == (None, {})
+    assert renewed == ('AddSale:time', {})
+
+def test_cleanup_deletes_expired_rows(tmp_path):
+    path = tmp_path / 'fsm.db'
+    storage = SQLiteStorage(str(path), ttl=0.2, cleanup_interval=0)
+
+    async def main():
+        await storage.set_state(KEY, 'AddSale:amount')
+        await storage.flush()
+        await asyncio.sleep(0.3)
+        await storage.set_state(OTHER, 'Search:query')
+        await storage.flush()
+        rows = await storage._run(lambda: storage._connect().execute('SELECT key FROM fsm').fetchall())
+        await storage.close()
+        return rows
+
+    assert asyncio.run(main()) == [(storage.key_builder.build(OTHER),)]
@@ -0,0 +1,151 @@
+"""Миграция базы исходного формата (даты dd.mm.yy, суммы текстом) до последней версии"""
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import database
+
+# Таблица sales в том виде, в котором ее создавала первая версия бота
+BASELINE_SCHEMA = '''
+CREATE TABLE sales (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sale_type TEXT NOT NULL,
+    user_tag TEXT NOT NULL,
+    time TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    date TEXT NOT NULL,
+    user_id INTEGER NOT NULL
+)
+'''
+
+BASELINE_ROWS = [
+    # id, sale_type, user_tag, time, amount, date, user_id
+    (1, 'продажа', '@a', '10:00', '7000', '10.04.25', 1),
+    (2, 'продажа', '@a', '10:00', '7000', '10.04.25', 2),  # дубликат записи 1
+    (3, 'продажа', '@b', '11:00', '7000.5', '10.04.25', 1),
+    (4, 'закупка', '@c', '12:00', '1500', '10.04.25', 1),
+    (5, 'продажа', '@d', '13:00', '1e3', '11.04.25', 1),  # сумма не разбирается
+    (6, 'закупка', '@e', '14:00', '500', '31.02.25', 2),  # даты не существует
+    (7, 'продажа', '@f', '15:00', '2 500р', '11.04.25', 2),
+]
+
+@pytest.fixture
+def baseline_db(tmp_path, monkeypatch):
+    path = tmp_path / 'sales.db'
+    conn = sqlite3.connect(path)
+    conn.execute(BASELINE_SCHEMA)
+    conn.executemany('INSERT INTO sales VALUES (?, ?, ?, ?, ?, ?, ?)', BASELINE_ROWS)
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(database, 'DATABASE_NAME', str(path))
+    database.init_db()
+    yield path
+    database.close_db()
+
+def _query(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+def test_schema_version(baseline_db):
+    assert _query(baseline_db, 'PRAGMA user_version') == [(len(database._MIGRATIONS),)]
+    # Повторный запуск ничего не меняет
+    database.init_db()
+    assert _query(baseline_db, 'SELECT COUNT(*) FROM sales') == [(4,)]
+
+def test_rows_converted(baseline_db):
+    assert _query(baseline_db, 'SELECT id, sale_type, user_tag, time, amount, date, user_id FROM sales ORDER BY id') == [
+        (1, 'продажа', '@a', '10:00', 700000, '2025-04-10', 1),
+        (3, 'продажа', '@b', '11:00', 700050, '2025-04-10', 1),
+        (4, 'закупка', '@c', '12:00', 150000, '2025-04-10', 1),
+        (7, 'продажа', '@f', '15:00', 250000, '2025-04-11', 2),
+    ]
+
+def test_bad_rows_and_duplicates_quarantined(baseline_db):
+    assert _query(baseline_db, '''
+        SELECT sale_id, amount, raw_amount, date, reason FROM sales_quarantine ORDER BY sale_id
+    ''') == [
+        (2, 700000, None, '2025-04-10', 'дубликат записи 1'),
+        (5, None, '1e3', '2025-04-11', "сумма '1e3' не разобрана"),
+        (6, 50000, '500', '31.02.25', "дата '31.02.25' не разобрана"),
+    ]
+
+def test_daily_totals(baseline_db):
+    assert _query(baseline_db, 'SELECT date, sale_type, total, count FROM daily_totals ORDER BY date, sale_type') == [
+        ('2025-04-10', 'закупка', 150000, 1),
+        ('2025-04-10', 'продажа', 1400050, 2),
+        ('2025-04-11', 'продажа', 250000, 1),
+    ]
+
+def test_restore_quarantined_sale(baseline_db):
+    quarantine_id = _query(baseline_db, 'SELECT id FROM sales_quarantine WHERE sale_id = 6')[0][0]
+    with pytest.raises(ValueError):
+        database.restore_quarantined_sale(quarantine_id)
+
+    sale_id, created = database.restore_quarantined_sale(quarantine_id, date='28.02.25')
+    assert created
+    assert database.get_sale_by_id(sale_id)[1:] == ('закупка', '@e', '14:00', 50000, '28.02.25', 2)
+    assert database.get_day_totals('28.02.25') == {'закупка': (50000, 1)}
+    assert [action for action, *_ in database.get_sale_history(sale_id)] == ['add']
+    assert _query(baseline_db, 'SELECT COUNT(*) FROM sales_quarantine WHERE sale_id = 6') == [(0,)]
+
+_INIT_SCRIPT = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+import database
+database.DATABASE_NAME = sys.argv[2]
+database.init_db()
+'''
+
+@pytest.mark.parametrize('attempt', range(3))
+def test_concurrent_startup(tmp_path, attempt):
+    """Несколько воркеров стартуют на новой базе одновременно и не применяют миграции дважды"""
+    root = str(Path(database.__file__).resolve().parent)
+    path = tmp_path / 'sales.db'
+    processes = [
+        subprocess.Popen([sys.executable, '-c', _INIT_SCRIPT, root, str(path)], stderr=subprocess.PIPE, text=True)
+        for _ in range(4)
+    ]
+    errors = [process.communicate(timeout=60)[1] for process in processes]
+
+    assert [process.returncode for process in processes] == [0] * len(processes), errors
+    assert _query(path, 'PRAGMA user_version') == [(len(database._MIGRATIONS),)]
+
+def _downgrade(path, version, *statements):
+    """Имитирует базу, прошедшую version миграций в их первоначальном виде"""
+    conn = sqlite3.connect(path)
+    for statement in statements:
+        conn.execute(statement)
+    conn.execute(f'PRAGMA user_version = {version}')
+    conn.commit()
+    conn.close()
+
+def test_quarantine_added_to_migrated_db(sales_db):
+    database.close_db()
+    _downgrade(sales_db, 9, 'DROP TABLE sales_quarantine', 'DROP TABLE report_deliveries')
+    database.init_db()
+    assert _query(sales_db, 'PRAGMA user_version') == [(len(database._MIGRATIONS),)]
+    assert database.get_quarantined_sales() == []
+
+def test_report_pushes_replaced(sales_db):
+    # Базы, где v5 создавала report_pushes: таблица заменяется на report_deliveries
+    database.close_db()
+    _downgrade(sales_db, 10, 'DROP TABLE report_deliveries',
+               'CREATE TABLE report_pushes (period TEXT PRIMARY KEY, pushed_at TEXT)')
+    database.init_db()
+    tables = {name for name, in _query(sales_db, "SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'report_deliveries' in tables and 'report_pushes' not in tables
+
+def test_operator_totals_index(sales_db):
+    # Старые v7/v8 выполнены как были выпущены, покрывающий индекс добавила v12
+    indexes = {name for name, in _query(sales_db, "SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_sales_user_tag_date', 'idx_sales_date_user'} <= indexes
+    plan = _query(sales_db, '''EXPLAIN QUERY PLAN SELECT user_id, SUM(CASE WHEN sale_type = 'продажа'
+                               THEN amount ELSE 0 END), COUNT(*) FROM sales WHERE date BETWEEN '2025-04-01' AND '2025-04-30' GROUP BY user_id''')
+    assert any('COVERING INDEX idx_sales_date_user' in row[-1] for row in plan)
@@ -0,0 +1,48 @@
+"""Разбор сумм и записей инлайн-режима (parsing.py)"""
+import pytest
+
+import parsing
+from parsing import MAX_AMOUNT, EntryError, EntryHint, parse_amount, parse_entry, check_entry
+
+@pytest.mark.parametrize('text, kopecks', [
+    ('7000', 700000),
+    ('7000р', 700000),
+    ('7 000р', 700000),
+    ('7000.50', 700050),
+    ('7000,5', 700050),
+    ('0', 0),
+    (7000, 700000),
+    ('99999999999.99', MAX_AMOUNT - 1),
+])
+def test_parse_amount(text, kopecks):
+    assert parse_amount(text) == kopecks
+
+@pytest.mark.parametrize('text', [
+    '7,000', '7.000', '1.000.000', '-500', '1e3', '.50', '7000.', '', 'р',
+    '100000000000', '99999999999999999999', '9' * 5000,
+])
+def test_parse_amount_rejects(text):
+    with pytest.raises(ValueError):
+        parse_amount(text)
+
+def test_amount_boundary():
+    rubles = MAX_AMOUNT // 100
+    assert parse_amount(str(rubles - 1)) == MAX_AMOUNT - 100
+    assert parse_amount(f"{rubles - 1}.99") == MAX_AMOUNT - 1
+    with pytest.raises(ValueError):
+        parse_amount(str(rubles))
+    with pytest.raises(ValueError):
+        parse_amount(f"{rubles}.01")
+
+def test_entry_amount_too_large():
+    with pytest.raises(EntryError) as error:
+        parse_entry("#продажа/10.04.25/@user/10:00/99999999999999999999")
+    assert error.value.field == 'amount'
+    assert not error.value.incomplete
+
+def test_check_entry():
+    assert check_entry("#продажа/10.04.25/@user/10:00/7000р") == ('продажа', '10.04.25', '@user', '10:00', 700000)
+    assert check_entry("#продажа/10.04.25/@us", partial=True) == EntryHint('time', parsing.ENTRY_FIELDS[3][1], True)
+    assert check_entry("#продажа/31.02.25/@user", partial=True) == EntryHint('date', parsing.ENTRY_FIELDS[1][2], False)
+    assert check_entry("#продажа/10.04.25/@user/10:00/", partial=True).incomplete
+    assert not check_entry("#продажа/10.04.25/@user/10:00/7.000", partial=True).incomplete
@@ -0,0 +1,99 @@
+"""Рассылка отчетов по расписанию: scheduler.ReportScheduler и таблица report_deliveries"""
+import asyncio
+from datetime import date
+
+import pytest
+from aiogram.exceptions import TelegramAPIError
+
+import database
+import scheduler
+
+DAY = date(2025, 4, 11)
+REPORTS = [('2025-04-10', 'Отчет за 10.04.25')]
+
+class FakeBot:
+    """Запоминает отправленные сообщения; в чаты из failing отправить не получается"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if chat_id in self.failing:
+            raise TelegramAPIError(method=None, message='chat not found')
+        self.sent.append((chat_id, text))
+
+@pytest.fixture(autouse=True)
+def fixed_reports(monkeypatch):
+    async def precompute(self, today):
+        return REPORTS
+    monkeypatch.setattr(scheduler.ReportScheduler, 'precompute', precompute)
+
+def test_two_workers_send_once(sales_db):
+    first, second = FakeBot(), FakeBot()
+
+    async def main():
+        return await asyncio.gather(
+            scheduler.ReportScheduler(first, chat_ids=[1, 2]).run(DAY),
+            scheduler.ReportScheduler(second, chat_ids=[1, 2]).run(DAY),
+        )
+    asyncio.run(main())
+
+    assert sorted(first.sent + second.sent) == [(1, REPORTS[0][1]), (2, REPORTS[0][1])]
+
+def test_failed_send_is_retried(sales_db):
+    bot = FakeBot(failing=[2])
+    worker = scheduler.ReportScheduler(bot, chat_ids=[1, 2])
+
+    assert asyncio.run(worker.run(DAY)) == 1
+    assert bot.sent == [(1, REPORTS[0][1])]
+
+    # Отметка о неудачной отправке снята: после восстановления чата отчет уходит, а в чат 1 не повторяется
+    bot.failing.clear()
+    assert asyncio.run(worker.run(DAY)) == 0
+    assert bot.sent == [(1, REPORTS[0][1]), (2, REPORTS[0][1])]
+
+def test_deliver_retries_until_sent(sales_db):
+    bot = FakeBot(failing=[1])
+    worker = scheduler.ReportScheduler(bot, chat_ids=[1], retry_interval=0.01, max_retries=3)
+    original = bot.send_message
+    attempts = []
+
+    async def send_message(chat_id, text):
+        attempts.append(chat_id)
+        if len(attempts) == 2:
+            bot.failing.clear()
+        await original(chat_id, text)
+    bot.send_message = send_message
+
+    asyncio.run(worker.deliver(DAY))
+
+    assert attempts == [1, 1]
+    assert bot.sent == [(1, REPORTS[0][1])]
+
+def test_stale_claim_is_taken_over(sales_db):
+    # Воркер занял отправку и упал, не отправив: после claim_timeout ее занимает другой
+    assert database.claim_report_delivery(REPORTS[0][0], 1, 600) == 'claimed'
+    bot = FakeBot()
+
+    assert asyncio.run(scheduler.ReportScheduler(bot, chat_ids=[1]).run(DAY)) == 1
+    assert bot.sent == []
+    assert asyncio.run(scheduler.ReportScheduler(bot, chat_ids=[1], claim_timeout=0).run(DAY)) == 0
+    assert bot.sent == [(1, REPORTS[0][1])]
+
+def test_catch_up_on_startup(sales_db, monkeypatch):
+    # Бот запущен после report_time: сегодняшняя рассылка уходит сразу, а не завтра
+    monkeypatch.setattr(scheduler, 'date', type('FakeDate', (date,), {'today': staticmethod(lambda: DAY)}))
+    bot = FakeBot()
+    worker = scheduler.ReportScheduler(bot, report_time=scheduler.time(0, 0), chat_ids=[1])
+
+    async def main():
+        worker.start()
+        for _ in range(100):
+            if bot.sent:
+                break
+            await asyncio.sleep(0.01)
+        await worker.stop()
+    asyncio.run(main())
+
+    assert bot.sent == [(1, REPORTS[0][1])]
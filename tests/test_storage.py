@@ -0,0 +1,81 @@
+"""Групповой коммит новых записей: database.add_sales_batch и storage._WriteBatcher"""
+import asyncio
+
+import pytest
+
+import database
+import storage
+
+GOOD = ('продажа', '10.04.25', '@a', '10:00', 700000, 1)
+OTHER = ('закупка', '10.04.25', '@b', '11:00', 150000, 2)
+# Сумма не помещается в INTEGER: sqlite3 бросает OverflowError, а не sqlite3.Error
+TOO_LARGE = ('продажа', '10.04.25', '@c', '12:00', 10 ** 20, 1)
+BAD_DATE = ('продажа', '31.02.25', '@d', '13:00', 100, 1)
+
+def test_batch_isolates_bad_entries(sales_db):
+    results = database.add_sales_batch([GOOD, TOO_LARGE, BAD_DATE, OTHER, GOOD])
+
+    assert results[0] == (results[0][0], True)
+    assert isinstance(results[1], OverflowError)
+    assert isinstance(results[2], ValueError)
+    assert results[3] == (results[3][0], True)
+    assert results[4] == (results[0][0], False)
+    assert database.get_day_totals('10.04.25') == {'продажа': (700000, 1), 'закупка': (150000, 1)}
+    assert [action for action, *_ in database.get_sale_history(results[0][0])] == ['add']
+
+def _entries(count):
+    return [('продажа', '10.04.25', f'@u{i}', '10:00', 100 * (i + 1), 1) for i in range(count)]
+
+@pytest.fixture
+def batch_sizes(sales_db, monkeypatch):
+    """Размеры пачек, которые _WriteBatcher отдал в add_sales_batch"""
+    sizes = []
+    add_sales_batch = database.add_sales_batch
+
+    def recording(entries):
+        sizes.append(len(entries))
+        return add_sales_batch(entries)
+    monkeypatch.setattr(database, 'add_sales_batch', recording)
+    return sizes
+
+def _submit_all(batcher, entries, timeout):
+    async def main():
+        futures = [batcher.submit(entry) for entry in entries]
+        try:
+            return await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), timeout)
+        finally:
+            await batcher.close()
+    return asyncio.run(main())
+
+def test_batcher_flushes_on_size(batch_sizes):
+    # max_delay намного больше таймаута: пачки уходят только потому, что набрали max_size
+    results = _submit_all(storage._WriteBatcher(max_size=3, max_delay=60), _entries(6), timeout=5)
+
+    assert batch_sizes == [3, 3]
+    assert all(created for _, created in results)
+
+def test_batcher_flushes_on_timeout(batch_sizes):
+    batcher = storage._WriteBatcher(max_size=100, max_delay=0.05)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first = await asyncio.wait_for(asyncio.gather(*(batcher.submit(e) for e in _entries(2))), 5)
+        elapsed = loop.time() - started
+        await batcher.close()
+        return first, elapsed
+    results, elapsed = asyncio.run(main())
+
+    assert batch_sizes == [2]
+    assert elapsed >= 0.05
+    assert all(created for _, created in results)
+
+def test_batcher_isolates_bad_entries(batch_sizes):
+    results = _submit_all(storage._WriteBatcher(max_size=10, max_delay=0.01),
+                          [GOOD, TOO_LARGE, BAD_DATE, OTHER], timeout=5)
+
+    assert batch_sizes == [4]
+    assert results[0][1] is True and results[3][1] is True
+    assert isinstance(results[1], OverflowError)
+    assert isinstance(results[2], ValueError)
+    assert database.get_day_totals('10.04.25') == {'продажа': (700000, 1), 'закупка': (150000, 1)}
@@ -0,0 +1,97 @@
+"""Схлопывание нажатий и пауза после 429: throttling.CallbackCoalescer и RetryAfterBackoff"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from callback_router import CallbackRouter
+from throttling import CallbackCoalescer, RetryAfterBackoff
+
+class FakeCallback:
+    """Нажатие кнопки data на сообщении message_id; answered - сколько раз на него ответили"""
+
+    def __init__(self, data, message_id=1, chat_id=1):
+        self.data = data
+        self.message = SimpleNamespace(chat=SimpleNamespace(id=chat_id), message_id=message_id)
+        self.answered = 0
+
+    async def answer(self, *args, **kwargs):
+        self.answered += 1
+
+def _coalescer():
+    router = CallbackRouter()
+
+    @router.exact('refresh', 'next', 'delete')
+    async def handler(callback_query):
+        pass
+    return CallbackCoalescer(router, ['refresh', 'next'])
+
+def test_coalescer_drops_duplicates():
+    coalescer = _coalescer()
+    handled = []
+    release = asyncio.Event()
+
+    async def handler(event, data):
+        handled.append((event.message.message_id, event.data))
+        if len(handled) == 1:
+            await release.wait()
+
+    async def main():
+        first = asyncio.create_task(coalescer(handler, FakeCallback('refresh'), {}))
+        await asyncio.sleep(0)
+        # Повтор выполняющегося нажатия отбрасывается сразу
+        duplicate = FakeCallback('refresh')
+        await coalescer(handler, duplicate, {})
+        # Из ожидающих нажатий выполняется только последнее
+        superseded, last = FakeCallback('next'), FakeCallback('refresh')
+        waiting = [asyncio.create_task(coalescer(handler, event, {})) for event in (superseded, last)]
+        # Нажатия на другое сообщение и по другим маршрутам не ждут
+        await coalescer(handler, FakeCallback('refresh', message_id=2), {})
+        await coalescer(handler, FakeCallback('delete'), {})
+        release.set()
+        await asyncio.gather(first, *waiting)
+        return duplicate, superseded, last
+    duplicate, superseded, last = asyncio.run(main())
+
+    assert handled == [(1, 'refresh'), (2, 'refresh'), (1, 'delete'), (1, 'refresh')]
+    assert (duplicate.answered, superseded.answered, last.answered) == (1, 1, 0)
+    assert not coalescer._slots
+
+def test_backoff_pauses_chat_after_429():
+    backoff = RetryAfterBackoff(max_retries=2, max_delay=30)
+    started = time.monotonic()
+    sent = []
+
+    async def make_request(bot, method):
+        if not sent and method.chat_id == 1:
+            sent.append((method.chat_id, None))
+            raise TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=1)
+        sent.append((method.chat_id, time.monotonic() - started))
+        return True
+
+    async def main():
+        first = asyncio.create_task(backoff(make_request, None, SendMessage(chat_id=1, text='a')))
+        await asyncio.sleep(0.1)
+        # Тот же чат ждет окончания паузы, другой чат - нет
+        same = asyncio.create_task(backoff(make_request, None, SendMessage(chat_id=1, text='b')))
+        await backoff(make_request, None, SendMessage(chat_id=2, text='c'))
+        return await asyncio.gather(first, same)
+    assert asyncio.run(main()) == [True, True]
+
+    other = [elapsed for chat_id, elapsed in sent if chat_id == 2]
+    paused = [elapsed for chat_id, elapsed in sent[1:] if chat_id == 1]
+    assert other[0] < 0.5
+    assert len(paused) == 2 and min(paused) >= 0.95
+
+def test_backoff_gives_up_after_max_retries():
+    backoff = RetryAfterBackoff(max_retries=0, max_delay=30)
+    method = SendMessage(chat_id=1, text='a')
+
+    async def make_request(bot, method):
+        raise TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=0)
+
+    with pytest.raises(TelegramRetryAfter):
+        asyncio.run(backoff(make_request, None, method))
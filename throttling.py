@@ -0,0 +1,203 @@
+"""Защита от частых нажатий и флуд-лимитов Telegram.
+
+ThrottlingMiddleware - token bucket на пользователя и на чат: апдейты сверх
+лимита не доходят до обработчиков (на callback отвечаем, чтобы кнопка не
+крутилась). CallbackCoalescer - нажатия на одно сообщение выполняются по
+очереди, а пока одно выполняется, из накопившихся остается только последнее;
+повтор того же нажатия, которое уже выполняется, отбрасывается.
+RetryAfterBackoff - middleware сессии Bot: после ответа 429 все запросы в тот
+же чат (или все запросы, если ограничение не привязано к чату) ждут retry_after
+и повторяются, а не упираются в лимит по отдельности.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from aiogram import BaseMiddleware, types
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst в запасе"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+class _Buckets:
+    """Корзины по ключу; давно не использованные вытесняются - новая корзина все равно полная"""
+
+    def __init__(self, limit: Tuple[float, float], maxsize: int = 10000):
+        self.rate, self.burst = limit
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def take(self, key) -> bool:
+        bucket = self._data.get(key)
+        if bucket is None:
+            bucket = self._data[key] = TokenBucket(self.rate, self.burst)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        else:
+            self._data.move_to_end(key)
+        return bucket.take()
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничивает частоту апдейтов; user_limit и chat_limit - (в секунду, запас) или None"""
+
+    def __init__(self, user_limit: Optional[Tuple[float, float]] = (2, 6),
+                 chat_limit: Optional[Tuple[float, float]] = (5, 15)):
+        self.user_limit = user_limit
+        self.chat_limit = chat_limit
+
+    @property
+    def user_limit(self):
+        return self._users and (self._users.rate, self._users.burst)
+
+    @user_limit.setter
+    def user_limit(self, limit):
+        self._users = _Buckets(limit) if limit else None
+
+    @property
+    def chat_limit(self):
+        return self._chats and (self._chats.rate, self._chats.burst)
+
+    @chat_limit.setter
+    def chat_limit(self, limit):
+        self._chats = _Buckets(limit) if limit else None
+
+    def _allowed(self, event) -> Optional[str]:
+        """None, если апдейт можно обрабатывать, иначе какой лимит превышен"""
+        user = getattr(event, 'from_user', None)
+        if self._users is not None and user is not None and not self._users.take(user.id):
+            return 'user'
+        if isinstance(event, types.CallbackQuery):
+            chat = event.message.chat if event.message is not None else None
+        else:
+            chat = getattr(event, 'chat', None)
+        if self._chats is not None and chat is not None and not self._chats.take(chat.id):
+            return 'chat'
+        return None
+
+    async def __call__(self, handler, event, data):
+        limit = self._allowed(event)
+        if limit is None:
+            return await handler(event, data)
+
+        metrics.throttled_updates.inc(limit)
+        logger.debug("Апдейт от %s отброшен: превышен лимит (%s)", getattr(event.from_user, 'id', None), limit)
+        if isinstance(event, types.CallbackQuery):
+            await event.answer("Слишком часто, подождите секунду")
+
+class _Slot:
+    __slots__ = ('lock', 'generation', 'running', 'running_generation', 'users')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.generation = 0
+        self.running = None
+        self.running_generation = None
+        self.users = 0
+
+class CallbackCoalescer(BaseMiddleware):
+    """Схлопывает повторные нажатия кнопок routes (имена маршрутов CallbackRouter) на одном сообщении"""
+
+    def __init__(self, callback_router, routes: Iterable[str]):
+        self.callback_router = callback_router
+        self.routes = frozenset(routes)
+        self._slots: Dict[tuple, _Slot] = {}
+
+    async def _skip(self, event: types.CallbackQuery, reason: str):
+        metrics.coalesced_callbacks.inc(reason)
+        await event.answer()
+
+    async def __call__(self, handler, event: types.CallbackQuery, data):
+        if event.message is None or self.callback_router.route_name(event.data) not in self.routes:
+            return await handler(event, data)
+
+        key = (event.message.chat.id, event.message.message_id)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _Slot()
+        # То же нажатие уже выполняется и после него ничего не ждет - результат будет тем же
+        if slot.running == event.data and slot.running_generation == slot.generation:
+            return await self._skip(event, 'duplicate')
+
+        slot.generation += 1
+        generation = slot.generation
+        slot.users += 1
+        try:
+            async with slot.lock:
+                if generation != slot.generation:
+                    return await self._skip(event, 'superseded')
+                slot.running, slot.running_generation = event.data, generation
+                try:
+                    return await handler(event, data)
+                finally:
+                    slot.running = slot.running_generation = None
+        finally:
+            slot.users -= 1
+            if not slot.users:
+                del self._slots[key]
+
+class RetryAfterBackoff(BaseRequestMiddleware):
+    """Общая пауза после 429: запросы ждут retry_after и повторяются до max_retries раз.
+
+    Если пауза длиннее max_delay секунд, запрос не повторяется (ответ на callback
+    через полминуты уже бесполезен), но остальные запросы в этот чат все равно ждут.
+    """
+
+    def __init__(self, max_retries: int = 2, max_delay: float = 30.0):
+        self.max_retries = max_retries
+        self.max_delay = max_delay
+        # chat_id -> monotonic-время окончания паузы; None - пауза для всех запросов
+        self._blocked_until: Dict[Optional[int], float] = {}
+
+    def _delay(self, chat_id) -> float:
+        now = time.monotonic()
+        delay = 0.0
+        for key in (None, chat_id):
+            until = self._blocked_until.get(key)
+            if until is None:
+                continue
+            if until <= now:
+                self._blocked_until.pop(key, None)
+            else:
+                delay = max(delay, until - now)
+        return delay
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        attempt = 0
+        while True:
+            delay = self._delay(chat_id)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                metrics.retry_after.inc(type(method).__name__)
+                until = time.monotonic() + e.retry_after
+                self._blocked_until[chat_id] = max(until, self._blocked_until.get(chat_id, 0))
+                logger.warning("Флуд-лимит Telegram (%s, чат %s): пауза %s с", type(method).__name__, chat_id, e.retry_after)
+                attempt += 1
+                if attempt > self.max_retries or e.retry_after > self.max_delay:
+                    raise
@@ -0,0 +1,110 @@
+"""Прием апдейтов через вебхук (aiohttp) как альтернатива long polling.
+
+Апдейт принимается, сразу получает ответ 200 и обрабатывается в фоне.
+Одновременно обрабатывается не больше max_concurrency апдейтов: когда все
+слоты заняты, новые запросы ждут освобождения слота. При остановке сервер
+дожидается завершения уже начатых обработчиков.
+
+Проверить локально можно без Telegram: запустить `python main.py --webhook`
+без WEBHOOK_URL в config.py и отправить сохраненный апдейт:
+    curl -X POST -H 'Content-Type: application/json' -d @update.json http://127.0.0.1:8080/webhook
+"""
+import asyncio
+import logging
+from typing import Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+from aiogram.webhook.aiohttp_server import setup_application
+
+logger = logging.getLogger(__name__)
+
+class WebhookServer:
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        path: str = '/webhook',
+        secret_token: Optional[str] = None,
+        max_concurrency: int = 64,
+        drain_timeout: float = 30.0,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.drain_timeout = drain_timeout
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._closing = False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self._closing:
+            return web.Response(status=503)
+        if self.secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret_token:
+            return web.Response(status=401)
+
+        try:
+            update = types.Update.model_validate(await request.json(), context={'bot': self.bot})
+        except ValueError as e:
+            logger.warning("Некорректный апдейт: %s", e)
+            return web.Response(status=400)
+
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: types.Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logger.exception("Ошибка при обработке апдейта %s", update.update_id)
+        finally:
+            self._slots.release()
+
+    async def drain(self, *_):
+        """Перестает принимать апдейты и ждет завершения начатых обработчиков"""
+        self._closing = True
+        if not self._tasks:
+            return
+        logger.info("Ожидание завершения обработчиков: %s", len(self._tasks))
+        done, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+        if pending:
+            logger.warning("Не дождались завершения %s обработчиков", len(pending))
+
+    def create_app(self, webhook_url: Optional[str] = None) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+
+        if webhook_url:
+            async def set_webhook(*_):
+                await self.bot.set_webhook(
+                    webhook_url,
+                    secret_token=self.secret_token,
+                    allowed_updates=self.dp.resolve_used_update_types(),
+                )
+            app.on_startup.append(set_webhook)
+
+        # Сначала дожидаемся обработчиков, потом Dispatcher закрывает хранилища и сессию
+        app.on_shutdown.append(self.drain)
+        setup_application(app, self.dp, bot=self.bot)
+
+        async def close_session(*_):
+            await self.bot.session.close()
+        app.on_shutdown.append(close_session)
+        return app
+
+def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    host: str = '127.0.0.1',
+    port: int = 8080,
+    path: str = '/webhook',
+    webhook_url: Optional[str] = None,
+    secret_token: Optional[str] = None,
+    max_concurrency: int = 64,
+):
+    server = WebhookServer(dp, bot, path=path, secret_token=secret_token, max_concurrency=max_concurrency)
+    web.run_app(server.create_app(webhook_url), host=host, port=port)